@@ -2,12 +2,28 @@ import argparse
 import sys
 from pathlib import Path
 
-from m23.processor import (
-    create_nights_csv,
-    generate_masterflat,
-    renormalize,
-    start_data_processing,
-)
+from m23.bench import BENCHMARK_SIZES, BENCHMARKS
+
+# Each subcommand imports what it needs when it's run rather than here, so that
+# starting a subcommand doesn't import the (slow to import) modules of others
+
+
+def submit_to_server(args, command: str, **kwargs):
+    """
+    Runs the subcommand on the server started with `serve` instead of in this
+    process, and exits with the exit code of the job
+    """
+    from m23.processor import submit_job
+
+    try:
+        exit_code = submit_job(
+            args.server_address or "", command, args.config_file.absolute(), **kwargs
+        )
+    except (ConnectionError, FileNotFoundError, ValueError) as e:
+        sys.stdout.write(f"Couldn't submit to the server. {e}\n")
+        sys.exit(1)
+    if exit_code != 0:
+        sys.exit(exit_code)
 
 
 def process(args):
@@ -22,7 +38,31 @@ def process(args):
     if not config_file.is_file():
         sys.stdout.write("Invalid configuration file provided\n")
         return
-    start_data_processing(config_file.absolute())
+    if args.server or args.server_address is not None:
+        return submit_to_server(args, "process", resume=args.resume)
+    from m23.processor import start_data_processing
+
+    start_data_processing(config_file.absolute(), resume=args.resume)
+
+
+def recombine(args):
+    """
+    This is a subcommand that makes the combinations of one or more processed
+    nights again (for example with a different no. of images to combine) from
+    the transformations and calibration frames of their previous processing
+    """
+    config_file: Path = args.config_file
+    if not config_file.exists():
+        sys.stdout.write(f"Provided file {config_file} doesn't exist\n")
+        return
+    if not config_file.is_file():
+        sys.stdout.write("Invalid configuration file provided\n")
+        return
+    if args.server or args.server_address is not None:
+        return submit_to_server(args, "process", recombine=True)
+    from m23.processor import start_data_processing
+
+    start_data_processing(config_file.absolute(), recombine=True)
 
 
 def norm(args):
@@ -37,6 +77,10 @@ def norm(args):
     if not config_file.is_file():
         sys.stdout.write("Invalid configuration file provided\n")
         return
+    if args.server or args.server_address is not None:
+        return submit_to_server(args, "norm")
+    from m23.processor import renormalize
+
     renormalize(config_file.absolute())
 
 
@@ -52,6 +96,8 @@ def mf(args):
     if not config_file.is_file():
         sys.stdout.write("Invalid configuration file provided\n")
         return
+    from m23.processor import generate_masterflat
+
     generate_masterflat(config_file.absolute())
 
 
@@ -67,9 +113,107 @@ def csv(args):
     if not config_file.is_file():
         sys.stdout.write("Invalid configuration file provided\n")
         return
+    if args.server or args.server_address is not None:
+        return submit_to_server(args, "csv")
+    from m23.processor import create_nights_csv
+
     create_nights_csv(config_file.absolute())
 
 
+def watch(args):
+    """
+    This is a subcommand that processes a night as its raw images are written
+    by the camera, and processes the rest of the night when it ends
+    """
+    config_file: Path = args.config_file
+    if not config_file.exists():
+        sys.stdout.write(f"Provided file {config_file} doesn't exist\n")
+        return
+    if not config_file.is_file():
+        sys.stdout.write("Invalid configuration file provided\n")
+        return
+    if args.poll_interval <= 0:
+        sys.stdout.write("Poll interval has to be positive\n")
+        return
+    if args.idle_timeout < 0:
+        sys.stdout.write("Idle timeout can't be negative\n")
+        return
+    from m23.processor import start_watching
+
+    start_watching(config_file.absolute(), args.poll_interval, args.idle_timeout * 60)
+
+
+def serve(args):
+    """
+    This is a subcommand that starts a server that runs the process, norm and
+    csv subcommands submitted with the --server option, without importing
+    modules and parsing reference files for each of them
+    """
+    if args.workers < 1:
+        sys.stdout.write("No. of workers has to be at least 1\n")
+        return
+    from m23.processor import start_server
+
+    try:
+        start_server(args.address, args.workers)
+    except (OSError, ValueError) as e:
+        sys.stdout.write(f"Couldn't start the server. {e}\n")
+
+
+def bench(args):
+    """
+    This is a subcommand that benchmarks the stages of data processing on
+    synthetic images and optionally compares the results with a baseline
+    """
+    if args.repeat < 1:
+        sys.stdout.write("Repeat has to be at least 1\n")
+        return
+    if args.stars is not None and args.stars < 1:
+        sys.stdout.write("No. of stars has to be at least 1\n")
+        return
+    if args.compare is not None and not args.compare.is_file():
+        sys.stdout.write(f"Provided baseline {args.compare} doesn't exist\n")
+        return
+    from m23.bench import (
+        compare_with_baseline,
+        format_results,
+        load_baseline,
+        run_benchmarks,
+        save_baseline,
+    )
+
+    results = run_benchmarks(
+        sizes=args.size,
+        benchmarks=args.stages,
+        repeat=args.repeat,
+        no_of_stars=args.stars,
+        measure_memory=True,
+    )
+    print(format_results(results))
+    if args.save is not None:
+        save_baseline(results, args.save)
+        print(f"Saved results to {args.save}")
+    if args.compare is not None:
+        regressions = compare_with_baseline(results, load_baseline(args.compare), args.tolerance)
+        if regressions:
+            print(f"Slower than the baseline {args.compare}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"No benchmark is slower than the baseline {args.compare}")
+
+
+def add_server_arguments(subparser):
+    subparser.add_argument(
+        "--server", action="store_true", help="Run on the server started with `serve`"
+    )
+    subparser.add_argument(
+        "--server-address",
+        default=None,
+        help="Address of the server (implies --server). Default is the default of `serve`",
+    )
+
+
 parser = argparse.ArgumentParser(prog="M23 Data processor", epilog="Made in Rapti")
 subparsers = parser.add_subparsers()
 
@@ -79,9 +223,27 @@ process_parser = subparsers.add_parser("process", help="Process raw data for one
 process_parser.add_argument(
     "config_file", type=Path, help="Path to toml configuration file for data processing"
 )  # positional argument
+process_parser.add_argument(
+    "--resume",
+    action="store_true",
+    help="Resume previous processing of the nights, skipping the completed combinations",
+)
+add_server_arguments(process_parser)
 # Adding a default value so we later know which subcommand was invoked
 process_parser.set_defaults(func=process)
 
+# Recombine parser
+recombine_parser = subparsers.add_parser(
+    "recombine",
+    help="Make the combinations of processed nights again from their previous processing",
+)
+recombine_parser.add_argument(
+    "config_file", type=Path, help="Path to toml configuration file for data processing"
+)  # positional argument
+add_server_arguments(recombine_parser)
+# Adding a default value so we later know which subcommand was invoked
+recombine_parser.set_defaults(func=recombine)
+
 # Renormalize parser
 norm_parser = subparsers.add_parser(
     "norm", help="Normalize log files combined for one or more nights"
@@ -89,6 +251,7 @@ norm_parser = subparsers.add_parser(
 norm_parser.add_argument(
     "config_file", type=Path, help="Path to toml configuration file for renormalization"
 )  # positional argument
+add_server_arguments(norm_parser)
 # Adding a default value so we later know which subcommand was invoked
 norm_parser.set_defaults(func=norm)
 
@@ -107,9 +270,89 @@ csv_parser = subparsers.add_parser("csv", help="Generate csv flux file for a giv
 csv_parser.add_argument(
     "config_file", type=Path, help="Path to toml configuration file for csv generation"
 )  # positional argument
+add_server_arguments(csv_parser)
 # Adding a default value so we later know which subcommand was invoked
 csv_parser.set_defaults(func=csv)
 
+# Live processing parser
+watch_parser = subparsers.add_parser(
+    "watch", help="Process a night as its raw images are written by the camera"
+)
+watch_parser.add_argument(
+    "config_file", type=Path, help="Path to toml configuration file for data processing"
+)  # positional argument
+watch_parser.add_argument(
+    "--poll-interval",
+    type=float,
+    default=10,
+    help="Seconds between looking for new raw images when inotify isn't available. Default is 10",
+)
+watch_parser.add_argument(
+    "--idle-timeout",
+    type=float,
+    default=30,
+    help="Minutes without new raw images after which the night is finished. Default is 30",
+)
+# Adding a default value so we later know which subcommand was invoked
+watch_parser.set_defaults(func=watch)
+
+# Server parser
+serve_parser = subparsers.add_parser(
+    "serve", help="Start a server that runs process, norm and csv jobs submitted with --server"
+)
+serve_parser.add_argument(
+    "--address",
+    default="",
+    help="Socket path or host:port to listen on. Default is a socket in the temp folder",
+)
+serve_parser.add_argument(
+    "--workers", type=int, default=1, help="No. of jobs run at once. Default is 1"
+)
+# Adding a default value so we later know which subcommand was invoked
+serve_parser.set_defaults(func=serve)
+
+# Benchmark parser
+bench_parser = subparsers.add_parser(
+    "bench", help="Benchmark the stages of data processing with synthetic images"
+)
+bench_parser.add_argument(
+    "--size",
+    type=int,
+    nargs="+",
+    default=BENCHMARK_SIZES,
+    help="Width (and height) of the synthetic images, for example 1024 2048",
+)
+bench_parser.add_argument(
+    "--stars",
+    type=int,
+    default=None,
+    help="No. of stars in the synthetic images. Default is all stars in the reference file",
+)
+bench_parser.add_argument(
+    "--repeat", type=int, default=3, help="No. of times each stage is timed"
+)
+bench_parser.add_argument(
+    "--stages",
+    nargs="+",
+    choices=BENCHMARKS,
+    default=BENCHMARKS,
+    help="Stages to benchmark. Default is all",
+)
+bench_parser.add_argument(
+    "--save", type=Path, default=None, help="Save the results as JSON to use as a baseline"
+)
+bench_parser.add_argument(
+    "--compare", type=Path, default=None, help="Baseline JSON to compare the results with"
+)
+bench_parser.add_argument(
+    "--tolerance",
+    type=float,
+    default=0.2,
+    help="Fraction by which a stage can be slower than the baseline. Default is 0.2",
+)
+# Adding a default value so we later know which subcommand was invoked
+bench_parser.set_defaults(func=bench)
+
 args = parser.parse_args()
 if hasattr(args, "func"):
     args.func(args)
@@ -1,59 +1,268 @@
+from datetime import datetime
 from pathlib import Path
-from typing import Tuple
+from typing import List, Tuple
 
 import astroalign as ast
+import cv2
 import numpy as np
 import numpy.typing as npt
 from astropy.io.fits import getdata as getfitsdata
-from m23.constants import AlignmentTransformationType
+from m23.constants import (
+    WARP_BACKEND_OPENCV,
+    WARP_BACKEND_SKIMAGE,
+    AlignmentTransformationType,
+)
 from m23.exceptions import CouldNotAlignException
+from m23.file import read_cached
+from scipy.spatial import KDTree
 from skimage.transform import SimilarityTransform
 
 
-def image_alignment(
-    image_data_to_align: npt.NDArray, ref_image_name: str | Path
-) -> Tuple[npt.NDArray, AlignmentTransformationType]:
-    """
-    Aligns the image data provided in `image_data_to_align` with respect to a reference image
+# Positions (x, y) of the stars in an image and of the matching stars in the
+# reference, used to find the transformation that aligns the image
+MatchedStarsType = Tuple[npt.NDArray, npt.NDArray]
 
-    param: image_data_to_align: Numpy two dimensional array represents fits image
-    param: ref_image_name: Pathlike object for filepath string to which the source data is
-            to be aligned
+# Arguments to `astroalign.find_transform` used to align images
+MAX_CONTROL_POINTS = 50
+# Detection sigma states how much sigma higher must the signal be w. bg
+DETECTION_SIGMA = 5
+MIN_AREA = 5
 
-    return:
-        - Aligned image data
-        - Transformation object which is a tuple of information about the alignment
+# Seeded alignment (see `ReferenceAligner.refine_transform`) looks for this many
+# of the brightest stars of the reference image within SEEDED_SEARCH_RADIUS
+# pixels of their predicted positions, and the prediction is verified if at
+# least SEEDED_MIN_STARS of them are found where predicted
+SEEDED_NO_OF_STARS = 20
+SEEDED_MIN_STARS = 8
+SEEDED_SEARCH_RADIUS = 10
+# Radius of the pixels around the peak of a star used to find its centroid
+SEEDED_CENTROID_RADIUS = 3
 
-    raises:
-        ValueError: If it cannot find more than 3 stars on any input.
+
+class ReferenceAligner:
     """
+    Aligns images to a reference image the way `astroalign.find_transform`
+    does, except that the reference image is read, and its control points
+    (stars), their triangle invariants and the KD-tree of the invariants are
+    computed only once, when the aligner is created. Aligning an image then
+    only needs the control points and invariants of that image.
+
+    This uses private functions of astroalign (of the API of astroalign 2.4.1,
+    which it's pinned to), so they may change in other versions of astroalign.
+
+    Use `reference_aligner` to get an aligner, so that it's created only once
+    per process for a reference image.
+    """
+
+    def __init__(self, ref_image_name: str | Path) -> None:
+        # Note it's important to use dtype of float
+        target = np.array(getfitsdata(ref_image_name), dtype="float")
+        self.__shape = target.shape
+        self.__control_points = ast._find_sources(
+            ast._bw(target),
+            detection_sigma=DETECTION_SIGMA,
+            min_area=MIN_AREA,
+        )[:MAX_CONTROL_POINTS]
+        if len(self.__control_points) >= 3:
+            self.__invariants, self.__asterisms = ast._generate_invariants(self.__control_points)
+            self.__invariant_tree = KDTree(self.__invariants)
 
-    ref_image_data = getfitsdata(ref_image_name)
+    def find_transform(self, source: npt.NDArray) -> Tuple[SimilarityTransform, MatchedStarsType]:
+        """
+        Returns the transformation from `source` (image data of float dtype) to
+        the reference image and the positions of the stars matched to find it,
+        same as `astroalign.find_transform`
 
-    # Note it's important to use dtype of float
-    target_fixed = np.array(ref_image_data, dtype="float")
-    source_fixed = np.array(image_data_to_align, dtype="float")
+        raises:
+            ValueError: If it cannot find more than 3 stars on any input.
+            astroalign.MaxIterError: If no transformation is found
+        """
+        source_control_points = ast._find_sources(
+            ast._bw(source),
+            detection_sigma=DETECTION_SIGMA,
+            min_area=MIN_AREA,
+        )[:MAX_CONTROL_POINTS]
+        if len(source_control_points) < 3:
+            raise ValueError("Reference stars in source image are less than the minimum (3)")
+        if len(self.__control_points) < 3:
+            raise ValueError("Reference stars in target image are less than the minimum (3)")
 
-    try:
-        t, __ = ast.find_transform(
-            source=source_fixed,
-            target=target_fixed,
-            max_control_points=50,
-            # Detection signal states how much sigma higher must the signal be w. bg
-            detection_sigma=5,
-            min_area=5,
+        source_invariants, source_asterisms = ast._generate_invariants(source_control_points)
+        matches_list = KDTree(source_invariants).query_ball_tree(self.__invariant_tree, r=0.1)
+        # (N, 3, 2) array of N pairs of similar triangles in source and reference
+        matches = np.array(
+            [
+                list(zip(source_triangle, target_triangle))
+                for source_triangle, target_indices in zip(source_asterisms, matches_list)
+                for target_triangle in self.__asterisms[target_indices]
+            ]
         )
-    except ast.MaxIterError:
-        raise CouldNotAlignException
-    except ValueError:
-        raise CouldNotAlignException
-
-    aligned_image_data, _ = ast.apply_transform(
-        t,
-        source_fixed,
-        target_fixed,
-        fill_value=0,
+
+        model = ast._MatchTransform(source_control_points, self.__control_points)
+        # Set the minimum matches to be between 1 and 10 asterisms
+        min_matches = max(1, min(10, int(len(matches) * ast.MIN_MATCHES_FRACTION)))
+        if (len(source_control_points) == 3 or len(self.__control_points) == 3) and len(
+            matches
+        ) == 1:
+            transformation, inliers = model.fit(matches), np.arange(len(matches))
+        else:
+            transformation, inliers = ast._ransac(matches, model, ast.PIXEL_TOL, min_matches)
+        # Vertices of the matched triangles, as (source, reference) control point
+        # indices, keeping only the pair of each source vertex that the
+        # transformation maps closest to its reference vertex
+        pairs = np.unique(matches[inliers].reshape(-1, 2), axis=0)
+        source_vertices = source_control_points[pairs[:, 0]]
+        target_vertices = self.__control_points[pairs[:, 1]]
+        errors = np.linalg.norm(transformation(source_vertices) - target_vertices, axis=1)
+        pairs = pairs[np.lexsort((errors, pairs[:, 0]))]
+        source_indices, target_indices = pairs[np.unique(pairs[:, 0], return_index=True)[1]].T
+        return transformation, (
+            source_control_points[source_indices],
+            self.__control_points[target_indices],
+        )
+
+    def refine_transform(
+        self, source: npt.NDArray, predicted_transformation: AlignmentTransformationType
+    ) -> Tuple[SimilarityTransform, MatchedStarsType] | None:
+        """
+        Returns the transformation from `source` to the reference image, and
+        the positions of the stars used to find it, found by a least squares
+        fit of the brightest stars of the reference image to the stars near
+        their positions in `source` predicted by `predicted_transformation`.
+        Returns None if too few of the stars are found where predicted, in
+        which case the transformation has to be found with `find_transform`.
+        """
+        rotation, translation_x, translation_y, scale = predicted_transformation
+        predicted = SimilarityTransform(
+            rotation=rotation, translation=(translation_x, translation_y), scale=scale
+        )
+        reference_stars = self.__control_points[:SEEDED_NO_OF_STARS]
+        source_stars, matched_reference_stars = [], []
+        for reference_star, (x, y) in zip(reference_stars, predicted.inverse(reference_stars)):
+            if (centroid := star_centroid(source, x, y)) is not None:
+                source_stars.append(centroid)
+                matched_reference_stars.append(reference_star)
+        if len(source_stars) < SEEDED_MIN_STARS:
+            return None
+
+        source_stars = np.array(source_stars)
+        matched_reference_stars = np.array(matched_reference_stars)
+        t = ast.estimate_transform("similarity", source_stars, matched_reference_stars)
+        # Stars confused with other stars or cosmic rays are left out of the fit
+        inliers = t.residuals(source_stars, matched_reference_stars) < ast.PIXEL_TOL
+        if inliers.sum() < max(SEEDED_MIN_STARS, ast.MIN_MATCHES_FRACTION * len(source_stars)):
+            return None
+        source_stars = source_stars[inliers]
+        matched_reference_stars = matched_reference_stars[inliers]
+        return ast.estimate_transform("similarity", source_stars, matched_reference_stars), (
+            source_stars,
+            matched_reference_stars,
+        )
+
+    def align(
+        self,
+        image_data_to_align: npt.NDArray,
+        predicted_transformation: AlignmentTransformationType | None = None,
+        warp_backend: str = WARP_BACKEND_SKIMAGE,
+    ) -> Tuple[npt.NDArray, AlignmentTransformationType, float]:
+        """
+        Aligns the image data provided in `image_data_to_align` with respect to the reference
+        image, see `image_alignment`. Also returns the residual of the stars matched to align
+        the image, see `match_residual`.
+
+        raises:
+            CouldNotAlignException: If the image cannot be aligned
+        """
+        source_fixed = np.array(image_data_to_align, dtype="float")
+        found = None
+        if predicted_transformation is not None:
+            found = self.refine_transform(source_fixed, predicted_transformation)
+        try:
+            if found is None:
+                found = self.find_transform(source_fixed)
+        except ast.MaxIterError:
+            raise CouldNotAlignException
+        except ValueError:
+            raise CouldNotAlignException
+
+        t, (source_stars, reference_stars) = found
+        # The reference image is only used for the shape of the aligned image
+        aligned_image_data, transformation_metrics = apply_transformation(
+            t, source_fixed, self.__shape, warp_backend
+        )
+        return (
+            aligned_image_data,
+            transformation_metrics,
+            match_residual(t, source_stars, reference_stars),
+        )
+
+
+def warp_image(
+    t: SimilarityTransform,
+    source: npt.NDArray,
+    shape: Tuple[int, int],
+    warp_backend: str = WARP_BACKEND_SKIMAGE,
+) -> npt.NDArray:
+    """
+    Returns the image data `source` transformed with `t` into an image of `shape`,
+    with the pixels that aren't covered by `source` set to 0
+
+    param: warp_backend: WARP_BACKEND_SKIMAGE to warp with `astroalign.apply_transform`
+            (float64) or WARP_BACKEND_OPENCV to warp with OpenCV (float32)
+    """
+    if warp_backend == WARP_BACKEND_OPENCV:
+        return _warp_image_with_opencv(t, source, shape)
+    aligned_image_data, _ = ast.apply_transform(t, source, np.empty(shape), fill_value=0)
+    return aligned_image_data
+
+
+def _warp_image_with_opencv(
+    t: SimilarityTransform, source: npt.NDArray, shape: Tuple[int, int]
+) -> npt.NDArray:
+    """
+    Warps images the same way as `astroalign.apply_transform` with OpenCV
+    """
+    rows, cols = shape
+    source = np.asarray(source, dtype="float32")
+    # Like astroalign, the image is interpolated with the median outside of it,
+    # and the interpolated values are clipped to the range of the image
+    aligned_image_data = cv2.warpAffine(
+        source,
+        t.params[:2],
+        (cols, rows),
+        flags=cv2.INTER_CUBIC,
+        borderMode=cv2.BORDER_CONSTANT,
+        borderValue=float(np.median(source)),
     )
+    np.clip(aligned_image_data, source.min(), source.max(), out=aligned_image_data)
+    # Pixels that are mostly outside the image are found the same way as
+    # astroalign, by linear interpolation. OpenCV interpolates with weights in
+    # steps of 1/32 though, so a few pixels along the edge of the image that
+    # are just short of 40% outside it for astroalign are set to 0 as well
+    footprint = cv2.warpAffine(
+        np.zeros(source.shape, dtype="float32"),
+        t.params[:2],
+        (cols, rows),
+        flags=cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_CONSTANT,
+        borderValue=1.0,
+    )
+    aligned_image_data[footprint > 0.4] = 0
+    return aligned_image_data
+
+
+def apply_transformation(
+    t: SimilarityTransform,
+    source: npt.NDArray,
+    shape: Tuple[int, int],
+    warp_backend: str = WARP_BACKEND_SKIMAGE,
+) -> Tuple[npt.NDArray, AlignmentTransformationType]:
+    """
+    Transforms the image data `source` (of float dtype) with `t` into an image of
+    `shape` (see `warp_image`), and returns it with the transformation as a tuple
+    of its parameters
+    """
+    aligned_image_data = warp_image(t, source, shape, warp_backend)
     translation_x, translation_y = t.translation
     transformation_metrics: AlignmentTransformationType = (
         t.rotation,
@@ -64,19 +273,133 @@ def image_alignment(
     return aligned_image_data, transformation_metrics
 
 
+def match_residual(
+    t: SimilarityTransform, source_stars: npt.NDArray, reference_stars: npt.NDArray
+) -> float:
+    """
+    Returns the root mean square distance in pixels between the positions of
+    stars in the reference and the positions of the matching `source_stars`
+    transformed with `t`
+    """
+    return float(np.sqrt(np.mean(t.residuals(source_stars, reference_stars) ** 2)))
+
+
+def star_centroid(image_data: npt.NDArray, x: float, y: float) -> Tuple[float, float] | None:
+    """
+    Returns the centroid (x, y) of the brightest star within SEEDED_SEARCH_RADIUS
+    pixels of (`x`, `y`) in `image_data`, or None if there's no pixel there that's
+    DETECTION_SIGMA times the noise brighter than the background
+    """
+    row, col, radius = round(y), round(x), SEEDED_SEARCH_RADIUS
+    rows, cols = image_data.shape
+    if not (radius <= row < rows - radius and radius <= col < cols - radius):
+        return None
+    window = image_data[row - radius : row + radius + 1, col - radius : col + radius + 1]
+    background = np.median(window)
+    # Standard deviation of the background from the median absolute deviation
+    noise = 1.4826 * np.median(np.abs(window - background))
+    peak_row, peak_col = np.unravel_index(np.argmax(window), window.shape)
+    if noise == 0 or window[peak_row, peak_col] - background < DETECTION_SIGMA * noise:
+        return None
+
+    size = 2 * radius + 1
+    peak_rows = slice(
+        max(peak_row - SEEDED_CENTROID_RADIUS, 0), min(peak_row + SEEDED_CENTROID_RADIUS + 1, size)
+    )
+    peak_cols = slice(
+        max(peak_col - SEEDED_CENTROID_RADIUS, 0), min(peak_col + SEEDED_CENTROID_RADIUS + 1, size)
+    )
+    signal = np.clip(window[peak_rows, peak_cols] - background, 0, None)
+    ys, xs = np.mgrid[peak_rows, peak_cols]
+    total = signal.sum()
+    return (
+        col - radius + (xs * signal).sum() / total,
+        row - radius + (ys * signal).sum() / total,
+    )
+
+
+def predict_transformation(
+    previous_transformations: List[Tuple[datetime | None, AlignmentTransformationType]],
+    observed_at: datetime | None,
+) -> AlignmentTransformationType | None:
+    """
+    Predicts the transformation of an image observed at `observed_at` from the
+    (time observed, transformation) of images observed before it, in the
+    order they were observed. The drift of the last two images is
+    extrapolated linearly if their times are known, otherwise the
+    transformation of the last image is returned. Returns None if there are
+    no previous transformations.
+    """
+    if len(previous_transformations) == 0:
+        return None
+    last_observed_at, last_transformation = previous_transformations[-1]
+    if len(previous_transformations) == 1:
+        return last_transformation
+    before_last_observed_at, before_last_transformation = previous_transformations[-2]
+    if None in (observed_at, last_observed_at, before_last_observed_at):
+        return last_transformation
+    interval = (last_observed_at - before_last_observed_at).total_seconds()
+    if interval <= 0:
+        return last_transformation
+    fraction = (observed_at - last_observed_at).total_seconds() / interval
+    return tuple(
+        last + (last - before_last) * fraction
+        for last, before_last in zip(last_transformation, before_last_transformation)
+    )
+
+
+def reference_aligner(ref_image_name: str | Path) -> ReferenceAligner:
+    """
+    Returns the `ReferenceAligner` for the reference image `ref_image_name`,
+    creating it only if it wasn't created before by this process (or the
+    process it was forked from) or the image has changed since
+    """
+    return read_cached("reference_aligner", Path(ref_image_name), ReferenceAligner)
+
+
+def image_alignment(
+    image_data_to_align: npt.NDArray,
+    ref_image_name: str | Path,
+    predicted_transformation: AlignmentTransformationType | None = None,
+    warp_backend: str = WARP_BACKEND_SKIMAGE,
+) -> Tuple[npt.NDArray, AlignmentTransformationType]:
+    """
+    Aligns the image data provided in `image_data_to_align` with respect to a reference image
+
+    param: image_data_to_align: Numpy two dimensional array represents fits image
+    param: ref_image_name: Pathlike object for filepath string to which the source data is
+            to be aligned
+    param: predicted_transformation: Transformation predicted for the image (see
+            `predict_transformation`) that's verified and refined instead of
+            searching for the transformation, if given. The transformation is searched
+            for if the prediction can't be verified.
+    param: warp_backend: Backend used to warp the image, see `warp_image`
+
+    return:
+        - Aligned image data
+        - Transformation object which is a tuple of information about the alignment
+
+    raises:
+        CouldNotAlignException: If it cannot find more than 3 stars on any input or no
+            transformation is found.
+    """
+    aligned_image_data, transformation_metrics, _ = reference_aligner(ref_image_name).align(
+        image_data_to_align, predicted_transformation, warp_backend
+    )
+    return aligned_image_data, transformation_metrics
+
+
 def image_alignment_with_given_transformation(
-    image_data, transformation: AlignmentTransformationType
+    image_data, transformation: AlignmentTransformationType, warp_backend=WARP_BACKEND_SKIMAGE
 ):
     """
     Perform image alignment to given image data using the transformation details provided
     Returns aligned image data and the transformation details provided
+    See `warp_image` for `warp_backend`
     """
     target_size = (1024, 1024)
     source_fixed = np.array(image_data, dtype="float")
     rotation, translate_x, translate_y, scale = transformation
     t = SimilarityTransform(rotation=rotation, translation=(translate_x, translate_y), scale=scale)
-    dummy_target = np.zeros(target_size).astype(
-        "float"
-    )  # Note that target is just used for determining size of the output image
-    aligned_image_data, _ = ast.apply_transform(t, source_fixed, dummy_target, fill_value=0)
+    aligned_image_data = warp_image(t, source_fixed, target_size, warp_backend)
     return aligned_image_data, transformation
@@ -0,0 +1,200 @@
+from itertools import combinations
+from pathlib import Path
+from typing import Tuple
+
+import astroalign as ast
+import numpy as np
+import numpy.typing as npt
+from astropy.io.fits import getheader
+from m23.align import (
+    DETECTION_SIGMA,
+    MIN_AREA,
+    AlignmentTransformationType,
+    MatchedStarsType,
+    apply_transformation,
+    match_residual,
+)
+from m23.constants import WARP_BACKEND_SKIMAGE
+from m23.exceptions import CouldNotAlignException
+from m23.file import read_cached
+from m23.file.reference_log_file import ReferenceLogFile
+from scipy.spatial import KDTree
+from skimage.transform import SimilarityTransform
+
+# No. of the brightest sources detected in an image that are matched to the catalog
+CATALOG_NO_OF_SOURCES = 30
+# Pairs of the brightest few sources are used to make the hypotheses of the
+# transformation, each of which is tried with every pair of bright catalog stars
+CATALOG_NO_OF_HYPOTHESIS_SOURCES = 8
+CATALOG_NO_OF_HYPOTHESIS_STARS = 100
+# Hypotheses are first checked with this many other bright sources, of which
+# CATALOG_MIN_VERIFICATIONS must be within CATALOG_MATCH_TOLERANCE pixels of a
+# catalog star once transformed
+CATALOG_NO_OF_VERIFICATION_SOURCES = 4
+CATALOG_MIN_VERIFICATIONS = 2
+# A transformation is accepted if at least this many (and half) of the sources
+# are within CATALOG_MATCH_TOLERANCE pixels of distinct catalog stars once transformed
+CATALOG_MIN_MATCHES = 6
+CATALOG_MATCH_TOLERANCE = ast.PIXEL_TOL
+# Images are taken with the same telescope and camera as the reference image,
+# so transformations that scale by more than CATALOG_MAX_SCALE_CHANGE or rotate
+# by more than CATALOG_MAX_ROTATION (radians) are spurious
+CATALOG_MAX_SCALE_CHANGE = 0.05
+CATALOG_MAX_ROTATION = 0.1
+
+
+class CatalogAligner:
+    """
+    Aligns images by matching the brightest sources detected in them to the
+    positions of the stars in the reference file (the catalog), rather than
+    to the stars detected in the reference image.
+
+    The transformation is found with RANSAC: each pair of the brightest
+    sources is mapped to each pair of the brightest catalog stars. Those of
+    these transformations with a plausible scale and rotation that map a few
+    other bright sources onto catalog stars are refined with a least squares
+    fit of the sources they match, and the one that matches the most sources
+    is used.
+
+    Use `catalog_aligner` to get an aligner, so that it's created only once
+    per process for a reference file.
+    """
+
+    def __init__(self, ref_file_name: str | Path, ref_image_name: str | Path) -> None:
+        data = ReferenceLogFile(ref_file_name).data()
+        x_column = ReferenceLogFile.column_numbers["x"]
+        y_column = ReferenceLogFile.column_numbers["y"]
+        star_adu_column = ReferenceLogFile.column_numbers["star_adu"]
+        data = data[np.isfinite(data[:, [x_column, y_column, star_adu_column]]).all(axis=1)]
+        # Stars in decreasing order of brightness
+        data = data[np.argsort(-data[:, star_adu_column])]
+        self.__stars = data[:, [x_column, y_column]]
+        self.__star_tree = KDTree(self.__stars)
+        # The reference image is only used for the shape of the aligned image
+        header = getheader(ref_image_name)
+        self.__shape = (header["NAXIS2"], header["NAXIS1"])
+
+        # Vectors between every (ordered) pair of bright stars, as complex numbers
+        bright_stars = self.__stars[:CATALOG_NO_OF_HYPOTHESIS_STARS]
+        first, second = np.nonzero(~np.eye(len(bright_stars), dtype=bool))
+        self.__pair_starts = bright_stars[first, 0] + 1j * bright_stars[first, 1]
+        self.__pair_vectors = (
+            bright_stars[second, 0] + 1j * bright_stars[second, 1] - self.__pair_starts
+        )
+
+    def _matches(self, t: SimilarityTransform, sources: npt.NDArray) -> MatchedStarsType:
+        """
+        Returns the `sources` that are within CATALOG_MATCH_TOLERANCE pixels of
+        a catalog star once transformed with `t`, and those catalog stars. A
+        catalog star is matched to only the closest of the sources near it.
+        """
+        distances, indices = self.__star_tree.query(t(sources))
+        is_match = distances < CATALOG_MATCH_TOLERANCE
+        by_distance = np.flatnonzero(is_match)[np.argsort(distances[is_match])]
+        _, first = np.unique(indices[by_distance], return_index=True)
+        matched = np.sort(by_distance[first])
+        return sources[matched], self.__stars[indices[matched]]
+
+    def find_transform(self, source: npt.NDArray) -> Tuple[SimilarityTransform, MatchedStarsType]:
+        """
+        Returns the transformation from `source` (image data of float dtype) to
+        the reference and the positions of the sources and the catalog stars
+        matched to find it
+
+        raises:
+            CouldNotAlignException: If no transformation is found
+        """
+        sources = ast._find_sources(
+            ast._bw(source), detection_sigma=DETECTION_SIGMA, min_area=MIN_AREA
+        )[:CATALOG_NO_OF_SOURCES]
+        min_matches = max(CATALOG_MIN_MATCHES, len(sources) // 2)
+        if len(sources) < min_matches:
+            raise CouldNotAlignException(f"Found only {len(sources)} sources")
+        points = sources[:, 0] + 1j * sources[:, 1]
+
+        best = None
+        for i, j in combinations(range(min(len(sources), CATALOG_NO_OF_HYPOTHESIS_SOURCES)), 2):
+            # Transformations z -> a * z + b that map source i to the start and
+            # source j to the end of each pair of catalog stars
+            a = self.__pair_vectors / (points[j] - points[i])
+            is_plausible = is_plausible_transformation(np.abs(a), np.angle(a))
+            a = a[is_plausible]
+            b = self.__pair_starts[is_plausible] - a * points[i]
+            # Hypotheses are first checked with a few other sources, which rejects most of them
+            others = [k for k in range(len(sources)) if k not in (i, j)]
+            verifications = np.zeros(len(a), dtype=int)
+            for k in others[:CATALOG_NO_OF_VERIFICATION_SOURCES]:
+                transformed = a * points[k] + b
+                distances, _ = self.__star_tree.query(
+                    np.column_stack([transformed.real, transformed.imag])
+                )
+                verifications += distances < CATALOG_MATCH_TOLERANCE
+            for hypothesis in np.flatnonzero(verifications >= CATALOG_MIN_VERIFICATIONS):
+                t = SimilarityTransform(
+                    scale=abs(a[hypothesis]),
+                    rotation=np.angle(a[hypothesis]),
+                    translation=(b[hypothesis].real, b[hypothesis].imag),
+                )
+                matched_sources, matched_stars = self._matches(t, sources)
+                if len(matched_sources) < min_matches:
+                    continue
+                # Refine with the matches, which may find more matches
+                for _ in range(3):
+                    t = ast.estimate_transform("similarity", matched_sources, matched_stars)
+                    matched_sources, matched_stars = self._matches(t, sources)
+                if len(matched_sources) < min_matches:
+                    continue
+                if not is_plausible_transformation(t.scale, t.rotation):
+                    continue
+                if best is None or len(matched_sources) > len(best[1][0]):
+                    best = t, (matched_sources, matched_stars)
+        if best is None:
+            raise CouldNotAlignException(
+                "No plausible transformation maps enough sources onto catalog stars"
+            )
+        return best
+
+    def align(
+        self,
+        image_data_to_align: npt.NDArray,
+        predicted_transformation: AlignmentTransformationType | None = None,
+        warp_backend: str = WARP_BACKEND_SKIMAGE,
+    ) -> Tuple[npt.NDArray, AlignmentTransformationType, float]:
+        """
+        Aligns the image data provided in `image_data_to_align` with respect to the
+        reference, same as `m23.align.ReferenceAligner.align`. Note that
+        `predicted_transformation` isn't used as the transformation is always searched for.
+
+        raises:
+            CouldNotAlignException: If the image cannot be aligned
+        """
+        source_fixed = np.array(image_data_to_align, dtype="float")
+        t, (sources, stars) = self.find_transform(source_fixed)
+        aligned_image_data, transformation_metrics = apply_transformation(
+            t, source_fixed, self.__shape, warp_backend
+        )
+        return aligned_image_data, transformation_metrics, match_residual(t, sources, stars)
+
+
+def is_plausible_transformation(scale: npt.ArrayLike, rotation: npt.ArrayLike) -> npt.NDArray:
+    """
+    Returns whether transformations with `scale` and `rotation` (radians) can
+    map an image onto the reference image, as images are taken with the same
+    telescope and camera as the reference image
+    """
+    return (np.abs(np.subtract(scale, 1)) <= CATALOG_MAX_SCALE_CHANGE) & (
+        np.abs(rotation) <= CATALOG_MAX_ROTATION
+    )
+
+
+def catalog_aligner(ref_file_name: str | Path, ref_image_name: str | Path) -> CatalogAligner:
+    """
+    Returns the `CatalogAligner` for the reference file `ref_file_name`,
+    creating it only if it wasn't created before by this process (or the
+    process it was forked from) or the file has changed since
+    """
+    return read_cached(
+        f"catalog_aligner {Path(ref_image_name).absolute()}",
+        Path(ref_file_name),
+        lambda path: CatalogAligner(path, ref_image_name),
+    )
@@ -0,0 +1,115 @@
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+from astropy.io.fits import getdata as getfitsdata
+from m23.align import (
+    AlignmentTransformationType,
+    apply_transformation,
+    match_residual,
+    reference_aligner,
+)
+from m23.constants import WARP_BACKEND_SKIMAGE
+from m23.file import read_cached
+from skimage.transform import SimilarityTransform
+
+
+class PhaseCorrelationAligner:
+    """
+    Aligns images that are only translated with respect to the reference
+    image, like those of the old camera, by finding the translation (to the
+    nearest pixel) with FFT phase correlation. The Fourier transform of the
+    reference image is computed only once, when the aligner is created.
+
+    The translation is then refined to sub-pixel accuracy with the brightest
+    stars of the reference image (see
+    `m23.align.ReferenceAligner.refine_transform`). The image is aligned with
+    the full similarity transformation, like with `m23.align.image_alignment`,
+    if the stars aren't found where expected or the image is rotated or
+    scaled by more than `max_rotation`.
+
+    Use `phase_correlation_aligner` to get an aligner, so that it's created
+    only once per process for a reference image.
+    """
+
+    def __init__(self, ref_image_name: str | Path, max_rotation: float) -> None:
+        self.__ref_image_name = ref_image_name
+        self.__max_rotation = max_rotation
+        reference = np.array(getfitsdata(ref_image_name), dtype="float")
+        self.__shape = reference.shape
+        self.__reference_fft = np.fft.rfft2(reference)
+
+    def find_translation(self, source: npt.NDArray) -> Tuple[int, int] | None:
+        """
+        Returns the translation (x, y), to the nearest pixel, from `source`
+        (image data of float dtype) to the reference image, or None if the
+        image isn't of the same size as the reference image
+        """
+        if source.shape != self.__shape:
+            return None
+        cross_power_spectrum = self.__reference_fft * np.conj(np.fft.rfft2(source))
+        cross_power_spectrum /= np.maximum(np.abs(cross_power_spectrum), np.finfo(float).tiny)
+        correlation = np.fft.irfft2(cross_power_spectrum, s=self.__shape)
+        row, col = np.unravel_index(np.argmax(correlation), self.__shape)
+        # Shifts past the middle of the image are negative shifts
+        rows, cols = self.__shape
+        return (col - cols if col > cols // 2 else col), (row - rows if row > rows // 2 else row)
+
+    def align(
+        self,
+        image_data_to_align: npt.NDArray,
+        predicted_transformation: AlignmentTransformationType | None = None,
+        warp_backend: str = WARP_BACKEND_SKIMAGE,
+    ) -> Tuple[npt.NDArray, AlignmentTransformationType, float]:
+        """
+        Aligns the image data provided in `image_data_to_align` with respect to the
+        reference image, same as `m23.align.ReferenceAligner.align`. Note that
+        `predicted_transformation` isn't used as the translation is always found.
+
+        raises:
+            CouldNotAlignException: If the image cannot be aligned
+        """
+        aligner = reference_aligner(self.__ref_image_name)
+        source_fixed = np.array(image_data_to_align, dtype="float")
+        translation = self.find_translation(source_fixed)
+        if translation is None:
+            return aligner.align(source_fixed, warp_backend=warp_backend)
+
+        # Stars are fit with a similarity transformation to check that the
+        # image isn't rotated or scaled
+        found = aligner.refine_transform(source_fixed, (0, *translation, 1))
+        if found is None:
+            return aligner.align(source_fixed, warp_backend=warp_backend)
+        star_transformation, (source_stars, reference_stars) = found
+        if (
+            abs(star_transformation.rotation) > self.__max_rotation
+            or abs(star_transformation.scale - 1) > self.__max_rotation
+        ):
+            return aligner.align(source_fixed, warp_backend=warp_backend)
+
+        # Least squares translation of the stars
+        t = SimilarityTransform(translation=np.mean(reference_stars - source_stars, axis=0))
+        aligned_image_data, transformation_metrics = apply_transformation(
+            t, source_fixed, self.__shape, warp_backend
+        )
+        return (
+            aligned_image_data,
+            transformation_metrics,
+            match_residual(t, source_stars, reference_stars),
+        )
+
+
+def phase_correlation_aligner(
+    ref_image_name: str | Path, max_rotation: float
+) -> PhaseCorrelationAligner:
+    """
+    Returns the `PhaseCorrelationAligner` for the reference image
+    `ref_image_name`, creating it only if it wasn't created before by this
+    process (or the process it was forked from) or the image has changed since
+    """
+    return read_cached(
+        f"phase_correlation_aligner {max_rotation}",
+        Path(ref_image_name),
+        lambda path: PhaseCorrelationAligner(path, max_rotation),
+    )
@@ -0,0 +1,50 @@
+import importlib
+
+from .constants import BENCHMARK_SIZES, BENCHMARKS
+
+# Module each name is imported from, the first time it's used, as the
+# benchmarks import most of m23 and the CLI only needs the constants above
+# unless it runs the benchmarks. See `m23.processor`.
+_NAME_MODULES = {
+    "EQUIVALENCE_FUNCTIONS": "m23.bench.equivalence",
+    "RecordedInputs": "m23.bench.equivalence",
+    "SyntheticInputs": "m23.bench.equivalence",
+    "check_equivalence": "m23.bench.equivalence",
+    "compare_with_baseline": "m23.bench.benchmarks",
+    "format_equivalence_results": "m23.bench.equivalence",
+    "format_results": "m23.bench.benchmarks",
+    "generate_synthetic_night": "m23.bench.synthetic",
+    "load_baseline": "m23.bench.benchmarks",
+    "run_benchmarks": "m23.bench.benchmarks",
+    "run_equivalence": "m23.bench.equivalence",
+    "save_baseline": "m23.bench.benchmarks",
+}
+
+__all__ = [
+    "BENCHMARKS",
+    "BENCHMARK_SIZES",
+    "EQUIVALENCE_FUNCTIONS",
+    "RecordedInputs",
+    "SyntheticInputs",
+    "check_equivalence",
+    "compare_with_baseline",
+    "format_equivalence_results",
+    "format_results",
+    "generate_synthetic_night",
+    "load_baseline",
+    "run_benchmarks",
+    "run_equivalence",
+    "save_baseline",
+]
+
+
+def __getattr__(name):
+    if name in _NAME_MODULES:
+        value = getattr(importlib.import_module(_NAME_MODULES[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,501 @@
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, TypedDict
+
+import numpy as np
+import toml
+from m23 import __version__
+from m23.align import image_alignment
+from m23.bench.constants import (
+    ALIGNMENT_BENCHMARK,
+    BENCHMARK_SIZES,
+    BENCHMARKS,
+    CALIBRATION_BENCHMARK,
+    COMBINATION_BENCHMARK,
+    CSV_STARTUP_BENCHMARK,
+    EXTRACTION_BENCHMARK,
+    FILE_PARSING_BENCHMARK,
+    INTERNIGHT_NORMALIZATION_BENCHMARK,
+    INTRANIGHT_NORMALIZATION_BENCHMARK,
+    MASTER_DARK_BENCHMARK,
+)
+from m23.bench.synthetic import (
+    SYNTHETIC_IMAGE_INTERVAL,
+    SYNTHETIC_NIGHT_START,
+    SyntheticNight,
+    generate_synthetic_night,
+    synthetic_raw_images,
+)
+from m23.calibrate.calibration import calibrateImages
+from m23.calibrate.master_calibrate import makeMasterDark
+from m23.constants import (
+    CHARTS_FOLDER_NAME,
+    FLUX_LOGS_COMBINED_FOLDER_NAME,
+    INPUT_CALIBRATION_FOLDER_NAME,
+    OBSERVATION_DATETIME_FORMAT,
+    SKY_BG_FOLDER_NAME,
+)
+from m23.extract import extract_stars
+from m23.file.aligned_combined_file import AlignedCombinedFile
+from m23.file.log_file_combined_file import LogFileCombinedFile
+from m23.file.raw_image_file import RawImageFile
+from m23.file.reference_log_file import ReferenceLogFile
+from m23.file.sky_bg_file import SkyBgFile
+from m23.internight_normalize import internight_normalize
+from m23.norm import normalize_log_files
+from m23.reference import get_reference_files_dict
+from m23.utils import fit_data_from_fit_images, get_darks, get_radius_folder_name
+
+BENCHMARK_NO_OF_IMAGES_TO_COMBINE = 10
+BENCHMARK_RADII_OF_EXTRACTION = [3, 4, 5]
+# Intranight normalization needs at least 4 log files combined
+BENCHMARK_NO_OF_LOG_FILES = 8
+
+
+class BenchmarkResult(TypedDict):
+    # Wall time in seconds of each repetition
+    times: List[float]
+    median: float
+    p95: float
+    # Peak memory in bytes allocated while running the benchmark once, or None
+    # if memory isn't measured
+    peak_memory: int | None
+
+
+class BenchmarkContext:
+    """
+    Inputs of the benchmarks of a synthetic night, made on first use so that
+    each benchmark only makes the inputs it needs. For example, the alignment
+    benchmark needs calibrated images which need a master dark, but these
+    are made once and aren't part of the time of the alignment benchmark.
+    """
+
+    def __init__(self, folder: Path, size: int, no_of_stars: int | None = None) -> None:
+        self.folder = Path(folder)
+        self.size = size
+        self.night: SyntheticNight = generate_synthetic_night(
+            self.folder / "input",
+            size=size,
+            no_of_images=BENCHMARK_NO_OF_IMAGES_TO_COMBINE,
+            no_of_stars=no_of_stars,
+        )
+        self.output = self.folder / "output"
+        self.output.mkdir(exist_ok=True)
+        self.__cache = {}
+
+    def _cached(self, name: str, make: Callable):
+        if name not in self.__cache:
+            self.__cache[name] = make()
+        return self.__cache[name]
+
+    def darks_data(self):
+        return self._cached(
+            "darks_data",
+            lambda: fit_data_from_fit_images(
+                sorted(
+                    get_darks(
+                        self.night["path"] / INPUT_CALIBRATION_FOLDER_NAME,
+                        self.night["image_duration"],
+                    )
+                )
+            ),
+        )
+
+    def master_dark_data(self):
+        return self._cached("master_dark_data", self.make_master_dark)
+
+    def make_master_dark(self):
+        return makeMasterDark(
+            saveAs=self.output / "masterdark.fit",
+            headerToCopyFromName=next(
+                get_darks(self.night["path"] / INPUT_CALIBRATION_FOLDER_NAME)
+            ).absolute(),
+            listOfDarkData=self.darks_data(),
+        )
+
+    def raw_images_data(self):
+        return self._cached(
+            "raw_images_data",
+            lambda: [RawImageFile(path).data() for path in synthetic_raw_images(self.night)],
+        )
+
+    def masterflat_data(self):
+        return self._cached(
+            "masterflat_data", lambda: fit_data_from_fit_images([self.night["masterflat"]])[0]
+        )
+
+    def calibrated_images_data(self):
+        return self._cached("calibrated_images_data", self.calibrate)
+
+    def calibrate(self):
+        return calibrateImages(
+            masterDarkData=self.master_dark_data(),
+            masterFlatData=self.masterflat_data(),
+            listOfImagesData=self.raw_images_data(),
+        )
+
+    def aligned_images_data(self):
+        return self._cached("aligned_images_data", self.align)
+
+    def align(self):
+        return [
+            image_alignment(image_data, self.night["reference_image"])[0]
+            for image_data in self.calibrated_images_data()
+        ]
+
+    def aligned_combined_file(self):
+        return self._cached("combination", self.combine)[0]
+
+    def combined_image_data(self):
+        return self._cached("combination", self.combine)[1]
+
+    def combine(self):
+        combined_image_data = np.sum(self.aligned_images_data(), axis=0)
+        aligned_combined_file = AlignedCombinedFile(
+            self.output / AlignedCombinedFile.generate_file_name(self.night["image_duration"], 1)
+        )
+        aligned_combined_file.create_file(
+            combined_image_data.astype("int32"),
+            RawImageFile(synthetic_raw_images(self.night)[0]),
+        )
+        return aligned_combined_file, combined_image_data
+
+    def extract(self):
+        log_file_combined_file = LogFileCombinedFile(
+            self.output
+            / LogFileCombinedFile.generate_file_name(
+                self.night["night_date"], 1, self.night["image_duration"]
+            )
+        )
+        extract_stars(
+            self.combined_image_data(),
+            ReferenceLogFile(self.night["reference_file"]),
+            BENCHMARK_RADII_OF_EXTRACTION,
+            log_file_combined_file,
+            self.aligned_combined_file(),
+            SYNTHETIC_NIGHT_START.strftime(OBSERVATION_DATETIME_FORMAT),
+        )
+        return log_file_combined_file
+
+    def log_files_combined(self) -> List[LogFileCombinedFile]:
+        return self._cached(
+            "log_files_combined",
+            lambda: write_synthetic_log_files(
+                self.output / "Log Files Combined",
+                self.night,
+                ReferenceLogFile(self.night["reference_file"]),
+            ),
+        )
+
+    def normalize_intranight(self):
+        output_folder = self.output / "Flux Logs Combined"
+        output_folder.mkdir(exist_ok=True)
+        normalize_log_files(
+            ReferenceLogFile(self.night["reference_file"]),
+            self.log_files_combined(),
+            output_folder,
+            BENCHMARK_RADII_OF_EXTRACTION[0],
+            self.night["image_duration"],
+            self.night["night_date"],
+        )
+
+    def parse_files(self):
+        """
+        Reads the raw images, log files combined and reference file of the night
+        """
+        for path in synthetic_raw_images(self.night):
+            raw_image = RawImageFile(path)
+            raw_image.header()
+            raw_image.data()
+        for log_file in self.log_files_combined():
+            LogFileCombinedFile(log_file.path()).data()
+        ReferenceLogFile(self.night["reference_file"]).data()
+
+    def internight_night_folder(self) -> Path:
+        return self._cached("internight_night_folder", self.make_internight_night_folder)
+
+    def make_internight_night_folder(self) -> Path:
+        """
+        Returns the output folder of a night with flux logs combined of all
+        stars in the reference file, as internight normalization works with
+        the star numbers of all the stars in the reference file
+        """
+        night_folder = self.output / "internight" / self.night["path"].name
+        reference_log_file = ReferenceLogFile(get_reference_files_dict()["file"])
+        log_files = write_synthetic_log_files(
+            night_folder / "Log Files Combined", self.night, reference_log_file
+        )
+        radius = BENCHMARK_RADII_OF_EXTRACTION[0]
+        flux_logs_folder = (
+            night_folder / FLUX_LOGS_COMBINED_FOLDER_NAME / get_radius_folder_name(radius)
+        )
+        flux_logs_folder.mkdir(parents=True)
+        (night_folder / CHARTS_FOLDER_NAME).mkdir()
+        normalize_log_files(
+            reference_log_file,
+            log_files,
+            flux_logs_folder,
+            radius,
+            self.night["image_duration"],
+            self.night["night_date"],
+        )
+        return night_folder
+
+    def normalize_internight(self):
+        reference_files = get_reference_files_dict()
+        internight_normalize(
+            self.internight_night_folder(),
+            LogFileCombinedFile(reference_files["logfile"]),
+            Path(reference_files["color"]),
+            BENCHMARK_RADII_OF_EXTRACTION[:1],
+        )
+
+    def csv_config_file(self) -> Path:
+        return self._cached("csv_config_file", self.make_csv_config_file)
+
+    def make_csv_config_file(self) -> Path:
+        """
+        Returns the configuration file of the `csv` subcommand for the night
+        normalized by the internight normalization benchmark, which has the
+        color normalized file that the `csv` subcommand reads and an empty
+        sky background file
+        """
+        night_folder = self.internight_night_folder()
+        self.normalize_internight()
+        sky_bg_file_name = SkyBgFile.generate_file_name(self.night["night_date"])
+        sky_bg_file = SkyBgFile(night_folder / SKY_BG_FOLDER_NAME / sky_bg_file_name)
+        sky_bg_file.path().parent.mkdir(exist_ok=True)
+        sky_bg_file.create_file([], [], [], [], [], 0, 0, 0)
+        csv_output = self.output / "csv"
+        csv_output.mkdir()
+        config_file = self.folder / "csv.toml"
+        config_file.write_text(
+            toml.dumps(
+                {
+                    "input": [str(night_folder)],
+                    "radius": BENCHMARK_RADII_OF_EXTRACTION[0],
+                    "output": str(csv_output),
+                }
+            )
+        )
+        return config_file
+
+
+def write_synthetic_log_files(
+    folder: Path, night: SyntheticNight, reference_log_file: ReferenceLogFile
+) -> List[LogFileCombinedFile]:
+    """
+    Writes BENCHMARK_NO_OF_LOG_FILES log files combined with the stars of
+    `reference_log_file` as if they were extracted from the combined images
+    of the synthetic `night`, and returns them
+    """
+    folder.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(0)
+    xs, ys = reference_log_file.get_x_position_column(), reference_log_file.get_y_position_column()
+    star_adus = np.nan_to_num(reference_log_file.data()[:, 5])
+    log_files = []
+    for i in range(BENCHMARK_NO_OF_LOG_FILES):
+        image_number = i + 1
+        # Brightness of the whole image changes a little, like with thin clouds
+        scale = rng.uniform(0.9, 1.1)
+        data: LogFileCombinedFile.LogFileCombinedDataType = {}
+        for star_index, (x, y, star_adu) in enumerate(zip(xs, ys, star_adus)):
+            radii_adu = {
+                radius: star_adu * scale * (1 - 0.5 / radius) * rng.normal(1, 0.01)
+                for radius in BENCHMARK_RADII_OF_EXTRACTION
+            }
+            data[star_index + 1] = LogFileCombinedFile.StarLogfileCombinedData(
+                x, y, 3.5, 3.5, 3.5, 800, radii_adu
+            )
+        log_file = LogFileCombinedFile(
+            folder
+            / LogFileCombinedFile.generate_file_name(
+                night["night_date"], image_number, night["image_duration"]
+            )
+        )
+        aligned_combined_file = AlignedCombinedFile(
+            AlignedCombinedFile.generate_file_name(night["image_duration"], image_number)
+        )
+        # Each combined image is made of BENCHMARK_NO_OF_IMAGES_TO_COMBINE raw images
+        observed_at = SYNTHETIC_NIGHT_START + timedelta(
+            seconds=SYNTHETIC_IMAGE_INTERVAL * BENCHMARK_NO_OF_IMAGES_TO_COMBINE * i
+        )
+        log_file.create_file(
+            data, aligned_combined_file, observed_at.strftime(OBSERVATION_DATETIME_FORMAT)
+        )
+        log_files.append(log_file)
+    return log_files
+
+
+def run_csv_command(context: BenchmarkContext):
+    """
+    Runs the `csv` subcommand for a night in a new Python process, so that the
+    time includes the time to import what the subcommand needs
+    """
+    config_file = context.csv_config_file()
+    # The csv subcommand doesn't overwrite files, so the files of the previous run are removed
+    csv_output = Path(toml.load(config_file)["output"])
+    [file.unlink() for file in csv_output.glob("*") if file.is_file()]
+    subprocess.run(
+        [sys.executable, "-m", "m23", "csv", str(config_file)],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+# Function of the context that's timed for each benchmark
+BENCHMARK_FUNCTIONS: Dict[str, Callable[[BenchmarkContext], object]] = {
+    MASTER_DARK_BENCHMARK: BenchmarkContext.make_master_dark,
+    CALIBRATION_BENCHMARK: BenchmarkContext.calibrate,
+    ALIGNMENT_BENCHMARK: BenchmarkContext.align,
+    COMBINATION_BENCHMARK: BenchmarkContext.combine,
+    EXTRACTION_BENCHMARK: BenchmarkContext.extract,
+    INTRANIGHT_NORMALIZATION_BENCHMARK: BenchmarkContext.normalize_intranight,
+    INTERNIGHT_NORMALIZATION_BENCHMARK: BenchmarkContext.normalize_internight,
+    FILE_PARSING_BENCHMARK: BenchmarkContext.parse_files,
+    CSV_STARTUP_BENCHMARK: run_csv_command,
+}
+
+# Inputs a benchmark needs that are made before it's timed
+BENCHMARK_SETUPS: Dict[str, Callable[[BenchmarkContext], object]] = {
+    MASTER_DARK_BENCHMARK: BenchmarkContext.darks_data,
+    CALIBRATION_BENCHMARK: lambda context: (
+        context.master_dark_data(),
+        context.masterflat_data(),
+        context.raw_images_data(),
+    ),
+    ALIGNMENT_BENCHMARK: BenchmarkContext.calibrated_images_data,
+    COMBINATION_BENCHMARK: BenchmarkContext.aligned_images_data,
+    EXTRACTION_BENCHMARK: BenchmarkContext.combined_image_data,
+    INTRANIGHT_NORMALIZATION_BENCHMARK: BenchmarkContext.log_files_combined,
+    INTERNIGHT_NORMALIZATION_BENCHMARK: BenchmarkContext.internight_night_folder,
+    FILE_PARSING_BENCHMARK: BenchmarkContext.log_files_combined,
+    CSV_STARTUP_BENCHMARK: BenchmarkContext.csv_config_file,
+}
+
+
+def time_benchmark(
+    context: BenchmarkContext, benchmark: str, repeat: int, measure_memory=False
+) -> BenchmarkResult:
+    """
+    Returns the wall times of running `benchmark` `repeat` times with `context`.
+
+    If `measure_memory` is True, the benchmark is run once more while tracing
+    memory allocations (of both Python objects and numpy arrays) to find its
+    peak memory. This run isn't timed as tracing slows down the code.
+    """
+    BENCHMARK_SETUPS[benchmark](context)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        BENCHMARK_FUNCTIONS[benchmark](context)
+        times.append(time.perf_counter() - start)
+
+    peak_memory = None
+    if measure_memory:
+        tracemalloc.start()
+        try:
+            BENCHMARK_FUNCTIONS[benchmark](context)
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {
+        "times": times,
+        "median": statistics.median(times),
+        "p95": float(np.percentile(times, 95)),
+        "peak_memory": peak_memory,
+    }
+
+
+def run_benchmarks(
+    sizes: List[int] = BENCHMARK_SIZES,
+    benchmarks: List[str] = BENCHMARKS,
+    repeat: int = 3,
+    no_of_stars: int | None = None,
+    measure_memory=False,
+) -> Dict:
+    """
+    Runs each of `benchmarks` `repeat` times on a synthetic night of each of
+    `sizes` with `no_of_stars` stars (all stars in the reference file if None)
+    and returns the results, which can be saved as a baseline with
+    `save_baseline` and compared with a baseline with `compare_with_baseline`.
+    See `time_benchmark` for `measure_memory`.
+    """
+    results: Dict[str, Dict[str, BenchmarkResult]] = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            context = BenchmarkContext(Path(folder), size, no_of_stars)
+            results[str(size)] = {
+                benchmark: time_benchmark(context, benchmark, repeat, measure_memory)
+                for benchmark in benchmarks
+            }
+    return {
+        "version": __version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "repeat": repeat,
+        "no_of_stars": no_of_stars,
+        "results": results,
+    }
+
+
+def format_results(results: Dict) -> str:
+    """
+    Returns the benchmark `results` formatted as a table
+    """
+    titles = ["Size", "Benchmark", "Median (s)", "p95 (s)", "Peak memory (MB)"]
+    lines = [f"{titles[0]:<12s}{titles[1]:<28s}{titles[2]:>12s}{titles[3]:>12s}{titles[4]:>18s}"]
+    for size, size_results in results["results"].items():
+        for benchmark, result in size_results.items():
+            peak_memory = result.get("peak_memory")
+            peak_memory = "-" if peak_memory is None else f"{peak_memory / 1024**2:.1f}"
+            lines.append(
+                f"{size + 'x' + size:<12s}{benchmark:<28s}"
+                f"{result['median']:>12.3f}{result['p95']:>12.3f}{peak_memory:>18s}"
+            )
+    return "\n".join(lines)
+
+
+def save_baseline(results: Dict, file_path: Path):
+    """
+    Saves benchmark `results` to `file_path` as JSON
+    """
+    with Path(file_path).open("w") as fd:
+        json.dump(results, fd, indent=4)
+
+
+def load_baseline(file_path: Path) -> Dict:
+    with Path(file_path).open() as fd:
+        return json.load(fd)
+
+
+def compare_with_baseline(results: Dict, baseline: Dict, tolerance: float = 0.2) -> List[str]:
+    """
+    Returns descriptions of the benchmarks in `results` whose median time is
+    more than `tolerance` (a fraction) slower than in `baseline`. Benchmarks
+    that aren't in both are ignored.
+    """
+    regressions = []
+    for size, size_results in results["results"].items():
+        baseline_results = baseline["results"].get(size, {})
+        for benchmark, result in size_results.items():
+            if benchmark not in baseline_results:
+                continue
+            baseline_median = baseline_results[benchmark]["median"]
+            if result["median"] > baseline_median * (1 + tolerance):
+                regressions.append(
+                    f"{benchmark} ({size}x{size}): {result['median']:.3f} s,"
+                    f" baseline {baseline_median:.3f} s"
+                    f" ({result['median'] / baseline_median - 1:+.0%})"
+                )
+    return regressions
@@ -0,0 +1,27 @@
+# Names of the benchmarks, kept apart from the benchmarks so that the CLI can
+# list them without importing the modules the benchmarks need
+MASTER_DARK_BENCHMARK = "master_dark"
+CALIBRATION_BENCHMARK = "calibration"
+ALIGNMENT_BENCHMARK = "alignment"
+COMBINATION_BENCHMARK = "combination"
+EXTRACTION_BENCHMARK = "extraction"
+INTRANIGHT_NORMALIZATION_BENCHMARK = "intranight_normalization"
+INTERNIGHT_NORMALIZATION_BENCHMARK = "internight_normalization"
+FILE_PARSING_BENCHMARK = "file_parsing"
+# Time the `csv` subcommand takes to start, which doesn't depend on image size
+CSV_STARTUP_BENCHMARK = "csv_startup"
+
+# Benchmarks in the order the stages are done when processing a night,
+# followed by the startup of the CLI
+BENCHMARKS = [
+    MASTER_DARK_BENCHMARK,
+    CALIBRATION_BENCHMARK,
+    ALIGNMENT_BENCHMARK,
+    COMBINATION_BENCHMARK,
+    EXTRACTION_BENCHMARK,
+    INTRANIGHT_NORMALIZATION_BENCHMARK,
+    INTERNIGHT_NORMALIZATION_BENCHMARK,
+    FILE_PARSING_BENCHMARK,
+    CSV_STARTUP_BENCHMARK,
+]
+BENCHMARK_SIZES = [1024, 2048]
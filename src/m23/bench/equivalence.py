@@ -0,0 +1,521 @@
+import importlib
+import math
+import shutil
+import tempfile
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Tuple, TypedDict
+
+import numpy as np
+import toml
+from m23.bench.benchmarks import BENCHMARK_RADII_OF_EXTRACTION, BenchmarkContext
+from m23.bench.synthetic import (
+    REFERENCE_IMAGE_SIZE,
+    SYNTHETIC_SKY_ADU,
+    SYNTHETIC_STAR_FWHM,
+    reference_stars,
+    render_star_field,
+    synthetic_raw_images,
+)
+from m23.constants import (
+    ALIGNED_COMBINED_FOLDER_NAME,
+    CHARTS_FOLDER_NAME,
+    COLOR_NORMALIZED_FOLDER_NAME,
+    CONFIG_FILE_NAME,
+    FLUX_LOGS_COMBINED_FOLDER_NAME,
+    LOG_FILES_COMBINED_FOLDER_NAME,
+    OBSERVATION_DATETIME_FORMAT,
+)
+from m23.file.aligned_combined_file import AlignedCombinedFile
+from m23.file.color_normalized_file import ColorNormalizedFile
+from m23.file.flux_log_combined_file import FluxLogCombinedFile
+from m23.file.log_file_combined_file import LogFileCombinedFile
+from m23.file.raw_image_file import RawImageFile
+from m23.file.reference_log_file import ReferenceLogFile
+from m23.reference import get_reference_files_dict
+from m23.utils import get_date_from_input_night_folder_name, get_radius_folder_name
+
+# Largest difference allowed between a value of the legacy and the optimized
+# implementation, `absolute + relative * abs(legacy value)`. The absolute
+# tolerances are one unit in the last digit written to the files, as a value
+# that's off by a tiny amount can be rounded to the next digit.
+Tolerance = namedtuple("Tolerance", ["absolute", "relative"])
+
+LOG_FILE_COMBINED_TOLERANCES: Dict[str, Tolerance] = {
+    "X": Tolerance(0.01, 0),
+    "Y": Tolerance(0.01, 0),
+    "XFWHM": Tolerance(1e-4, 0),
+    "YFWHM": Tolerance(1e-4, 0),
+    "Avg FWHM": Tolerance(1e-4, 0),
+    "Sky ADU": Tolerance(0.01, 0),
+    # Used for the Star ADU column of each radius of extraction
+    "Star ADU": Tolerance(0.01, 1e-7),
+}
+FLUX_LOG_COMBINED_TOLERANCES: Dict[str, Tolerance] = {
+    "ADU": Tolerance(0.01, 1e-7),
+    "X": Tolerance(0.01, 0),
+    "Y": Tolerance(0.01, 0),
+    "Norm": Tolerance(1e-5, 0),
+}
+COLOR_NORMALIZED_TOLERANCES: Dict[str, Tolerance] = {
+    "normalized_median_flux": Tolerance(1e-7, 1e-7),
+    "norm_factor": Tolerance(1e-7, 1e-7),
+    "measured_mean_r_i": Tolerance(1e-7, 0),
+    "used_mean_r_i": Tolerance(1e-7, 0),
+}
+
+EXTRACTION = "extraction"
+INTRANIGHT_NORMALIZATION = "intranight_normalization"
+INTERNIGHT_NORMALIZATION = "internight_normalization"
+
+# Module each function is used from, and the stage whose outputs are compared
+# to check an optimized implementation of the function. An optimized
+# implementation replaces the function in its module while the stage is run,
+# so it must have the same signature as the function.
+EQUIVALENCE_FUNCTIONS: Dict[str, Tuple[str, str]] = {
+    "newStarCenters": ("m23.extract", EXTRACTION),
+    "flux_log_for_radius": ("m23.extract", EXTRACTION),
+    "SkyBgCalculator": ("m23.extract", EXTRACTION),
+    "normalize_log_files": ("m23.norm", INTRANIGHT_NORMALIZATION),
+    "internight_normalize": ("m23.internight_normalize", INTERNIGHT_NORMALIZATION),
+}
+
+
+class EquivalenceResult(TypedDict):
+    function: str
+    # Description of the inputs the implementations were run with
+    inputs: str
+    # Wall time in seconds of the stage with each implementation
+    legacy_time: float
+    optimized_time: float
+    speedup: float
+    # Largest absolute difference of each column in all the output files
+    max_deviation: Dict[str, float]
+    # Descriptions of the differences that are larger than the tolerances
+    failures: List[str]
+
+
+class SyntheticInputs:
+    """
+    Inputs of the stages of a synthetic night, see `m23.bench.synthetic`.
+
+    The combined image is rendered from the stars in the reference file with
+    the background and noise of a sum of raw images, rather than calibrating,
+    aligning and combining raw images, as only the extraction is compared.
+    """
+
+    def __init__(self, folder: Path, size: int = 1024, no_of_stars: int | None = None) -> None:
+        self.folder = Path(folder)
+        self.size = size
+        self.context = BenchmarkContext(self.folder, size, no_of_stars)
+        self.name = f"synthetic {size}x{size}"
+        self.night_date = self.context.night["night_date"]
+        self.image_duration = self.context.night["image_duration"]
+        self.radii_of_extraction = BENCHMARK_RADII_OF_EXTRACTION
+        self.no_of_stars = no_of_stars
+        self.__aligned_combined_files = None
+
+    def reference_log_file(self) -> ReferenceLogFile:
+        return ReferenceLogFile(self.context.night["reference_file"])
+
+    def reference_files(self) -> Dict[str, str]:
+        return get_reference_files_dict()
+
+    def aligned_combined_files(self) -> List[AlignedCombinedFile]:
+        if self.__aligned_combined_files is None:
+            self.__aligned_combined_files = [self.make_aligned_combined_file()]
+        return self.__aligned_combined_files
+
+    def make_aligned_combined_file(self) -> AlignedCombinedFile:
+        no_of_images = len(synthetic_raw_images(self.context.night))
+        xs, ys, star_adus = reference_stars(self.no_of_stars, self.size)
+        fwhm = SYNTHETIC_STAR_FWHM * self.size / REFERENCE_IMAGE_SIZE
+        signal = render_star_field(
+            self.size, xs, ys, star_adus, fwhm, no_of_images * SYNTHETIC_SKY_ADU
+        )
+        data = np.random.default_rng(0).poisson(signal)
+        folder = self.folder / ALIGNED_COMBINED_FOLDER_NAME
+        folder.mkdir(exist_ok=True)
+        aligned_combined_file = AlignedCombinedFile(
+            folder / AlignedCombinedFile.generate_file_name(self.image_duration, 1)
+        )
+        aligned_combined_file.create_file(
+            data.astype("int32"), RawImageFile(synthetic_raw_images(self.context.night)[0])
+        )
+        return aligned_combined_file
+
+    def log_files_combined(self) -> List[LogFileCombinedFile]:
+        return self.context.log_files_combined()
+
+    def internight_night_folder(self) -> Path:
+        return self.context.internight_night_folder()
+
+
+class RecordedInputs:
+    """
+    Inputs of the stages from the output folder of a night processed before.
+
+    The reference files default to the reference files of the package as the
+    paths in the config file saved in the night folder might not exist on the
+    computer the comparison is run on.
+    """
+
+    def __init__(self, night_folder: Path, reference_files: Dict[str, str] | None = None) -> None:
+        self.night_folder = Path(night_folder)
+        config = toml.load(self.night_folder / CONFIG_FILE_NAME)
+        self.name = self.night_folder.name
+        self.night_date = get_date_from_input_night_folder_name(self.night_folder)
+        self.image_duration = config["processing"]["image_duration"]
+        self.radii_of_extraction = config["processing"]["radii_of_extraction"]
+        self.__reference_files = reference_files or get_reference_files_dict()
+
+    def reference_log_file(self) -> ReferenceLogFile:
+        return ReferenceLogFile(self.__reference_files["file"])
+
+    def reference_files(self) -> Dict[str, str]:
+        return self.__reference_files
+
+    def aligned_combined_files(self) -> List[AlignedCombinedFile]:
+        files = [
+            AlignedCombinedFile(path)
+            for path in (self.night_folder / ALIGNED_COMBINED_FOLDER_NAME).glob("*.fit")
+        ]
+        files = [file for file in files if file.is_valid_file_name()]
+        return sorted(files, key=lambda file: file.image_number())
+
+    def log_files_combined(self) -> List[LogFileCombinedFile]:
+        files = [
+            LogFileCombinedFile(path)
+            for path in (self.night_folder / LOG_FILES_COMBINED_FOLDER_NAME).glob("*.txt")
+        ]
+        files = [file for file in files if file.is_valid_file_name()]
+        return sorted(files, key=lambda file: file.img_number())
+
+    def internight_night_folder(self) -> Path:
+        return self.night_folder
+
+
+def run_extraction(inputs, output_folder: Path):
+    """
+    Extracts the stars of each aligned combined image of `inputs` and writes
+    the log files combined to `output_folder`
+    """
+    extract = importlib.import_module("m23.extract")
+    reference_log_file = inputs.reference_log_file()
+    for aligned_combined_file in inputs.aligned_combined_files():
+        log_file_combined_file = LogFileCombinedFile(
+            output_folder
+            / LogFileCombinedFile.generate_file_name(
+                inputs.night_date, aligned_combined_file.image_number(), inputs.image_duration
+            )
+        )
+        datetime_of_image = aligned_combined_file.datetime()
+        extract.extract_stars(
+            # Extraction is done on float images when processing nights
+            aligned_combined_file.data().astype("float"),
+            reference_log_file,
+            inputs.radii_of_extraction,
+            log_file_combined_file,
+            aligned_combined_file,
+            datetime_of_image.strftime(OBSERVATION_DATETIME_FORMAT) if datetime_of_image else "",
+        )
+
+
+def run_intranight_normalization(inputs, output_folder: Path):
+    """
+    Normalizes the log files combined of `inputs` for each radius of
+    extraction and writes the flux logs combined to `output_folder`
+    """
+    norm = importlib.import_module("m23.norm")
+    for radius in inputs.radii_of_extraction:
+        radius_folder = output_folder / get_radius_folder_name(radius)
+        radius_folder.mkdir(parents=True)
+        norm.normalize_log_files(
+            inputs.reference_log_file(),
+            inputs.log_files_combined(),
+            radius_folder,
+            radius,
+            inputs.image_duration,
+            inputs.night_date,
+        )
+
+
+def run_internight_normalization(inputs, output_folder: Path):
+    """
+    Normalizes a copy of the flux logs combined of `inputs` in `output_folder`
+    for each radius of extraction that has flux logs combined
+    """
+    internight = importlib.import_module("m23.internight_normalize")
+    night_folder = inputs.internight_night_folder()
+    copy = output_folder / night_folder.name
+    shutil.copytree(
+        night_folder / FLUX_LOGS_COMBINED_FOLDER_NAME, copy / FLUX_LOGS_COMBINED_FOLDER_NAME
+    )
+    (copy / CHARTS_FOLDER_NAME).mkdir()
+    radii = [
+        radius
+        for radius in inputs.radii_of_extraction
+        if (copy / FLUX_LOGS_COMBINED_FOLDER_NAME / get_radius_folder_name(radius)).exists()
+    ]
+    reference_files = inputs.reference_files()
+    internight.internight_normalize(
+        copy,
+        LogFileCombinedFile(reference_files["logfile"]),
+        Path(reference_files["color"]),
+        radii,
+    )
+
+
+def log_file_combined_columns(path: Path) -> Dict[str, np.ndarray]:
+    log_file = LogFileCombinedFile(path)
+    data = log_file.data()
+    return {title: data[:, index] for index, title in enumerate(log_file._title_row())}
+
+
+def flux_log_combined_columns(path: Path) -> Dict[str, np.ndarray]:
+    with Path(path).open() as fd:
+        lines = [line.split() for line in fd.readlines()[FluxLogCombinedFile.header_rows :]]
+    columns = {
+        title: np.array([float(line[index]) for line in lines])
+        for index, title in enumerate(["ADU", "X", "Y", "Norm"])
+    }
+    columns["Datetime"] = np.array([" ".join(line[4:]) for line in lines])
+    return columns
+
+
+def color_normalized_columns(path: Path) -> Dict[str, np.ndarray]:
+    data = ColorNormalizedFile(Path(path)).data()
+    stars = sorted(data)
+    columns = {"Star #": np.array(stars, dtype="float")}
+    for title in COLOR_NORMALIZED_TOLERANCES:
+        columns[title] = np.array([getattr(data[star], title) for star in stars])
+    return columns
+
+
+# Glob (relative to the output folder of a stage) of the output files of each
+# stage, the function that reads the columns of a file and the tolerances
+STAGE_OUTPUTS: Dict[str, Tuple[str, Callable[[Path], Dict], Dict[str, Tolerance]]] = {
+    EXTRACTION: ("*.txt", log_file_combined_columns, LOG_FILE_COMBINED_TOLERANCES),
+    INTRANIGHT_NORMALIZATION: (
+        "*/*_flux.txt",
+        flux_log_combined_columns,
+        FLUX_LOG_COMBINED_TOLERANCES,
+    ),
+    INTERNIGHT_NORMALIZATION: (
+        f"*/{COLOR_NORMALIZED_FOLDER_NAME}/*/*.txt",
+        color_normalized_columns,
+        COLOR_NORMALIZED_TOLERANCES,
+    ),
+}
+
+STAGE_RUNNERS: Dict[str, Callable] = {
+    EXTRACTION: run_extraction,
+    INTRANIGHT_NORMALIZATION: run_intranight_normalization,
+    INTERNIGHT_NORMALIZATION: run_internight_normalization,
+}
+
+
+def column_tolerance(title: str, tolerances: Dict[str, Tolerance]) -> Tolerance:
+    """
+    Returns the tolerance of the column `title`. Columns of each radius of
+    extraction, like `Star ADU 5`, use the tolerance of `Star ADU`.
+    Columns without tolerance must be equal.
+    """
+    if title in tolerances:
+        return tolerances[title]
+    for name, tolerance in tolerances.items():
+        if title.startswith(name + " "):
+            return tolerance
+    return Tolerance(0, 0)
+
+
+def compare_columns(
+    legacy: Dict[str, np.ndarray],
+    optimized: Dict[str, np.ndarray],
+    tolerances: Dict[str, Tolerance],
+    name: str = "",
+) -> Tuple[Dict[str, float], List[str]]:
+    """
+    Compares the columns of an output file of the legacy implementation with
+    those of the optimized implementation.
+
+    Returns the largest absolute difference of each column and descriptions
+    of the differences larger than the tolerance of the column. Values that
+    are nan in both are equal, and a value that's nan in only one differs by
+    infinity.
+    """
+    deviations: Dict[str, float] = {}
+    failures: List[str] = []
+    if list(legacy) != list(optimized):
+        return deviations, [f"{name}: columns {list(optimized)}, expected {list(legacy)}"]
+    for title, legacy_values in legacy.items():
+        optimized_values = optimized[title]
+        if legacy_values.shape != optimized_values.shape:
+            failures.append(
+                f"{name}: {len(optimized_values)} values of {title}, expected"
+                f" {len(legacy_values)}"
+            )
+            continue
+        if legacy_values.dtype.kind not in "fiu":
+            # Columns like datetime must be equal
+            different = np.flatnonzero(legacy_values != optimized_values)
+            deviations[title] = math.inf if len(different) else 0
+            if len(different):
+                row = different[0]
+                failures.append(
+                    f"{name}: {title} in row {row + 1} is {optimized_values[row]},"
+                    f" expected {legacy_values[row]}"
+                )
+            continue
+        both_nan = np.isnan(legacy_values) & np.isnan(optimized_values)
+        differences = np.where(
+            both_nan, 0, np.nan_to_num(np.abs(legacy_values - optimized_values), nan=math.inf)
+        )
+        deviations[title] = float(np.max(differences, initial=0))
+        tolerance = column_tolerance(title, tolerances)
+        allowed = tolerance.absolute + tolerance.relative * np.nan_to_num(np.abs(legacy_values))
+        # Allow for the representation error of the values read from the files
+        over_tolerance = np.flatnonzero(differences > allowed * (1 + 1e-9) + 1e-12)
+        if len(over_tolerance):
+            row = over_tolerance[np.argmax(differences[over_tolerance])]
+            failures.append(
+                f"{name}: {title} in row {row + 1} is {optimized_values[row]}, expected"
+                f" {legacy_values[row]} ({len(over_tolerance)} values over tolerance)"
+            )
+    return deviations, failures
+
+
+def compare_outputs(
+    legacy_folder: Path, optimized_folder: Path, stage: str
+) -> Tuple[Dict[str, float], List[str]]:
+    """
+    Compares the output files of `stage` in `legacy_folder` with those in
+    `optimized_folder`, see `compare_columns`
+    """
+    glob, read_columns, tolerances = STAGE_OUTPUTS[stage]
+    legacy_files = {path.relative_to(legacy_folder) for path in legacy_folder.glob(glob)}
+    optimized_files = {path.relative_to(optimized_folder) for path in optimized_folder.glob(glob)}
+    deviations: Dict[str, float] = {}
+    failures = [f"{path}: missing" for path in sorted(legacy_files - optimized_files)]
+    failures += [f"{path}: not expected" for path in sorted(optimized_files - legacy_files)]
+    if not legacy_files:
+        failures.append(f"No {stage} outputs to compare")
+    for path in sorted(legacy_files & optimized_files):
+        file_deviations, file_failures = compare_columns(
+            read_columns(legacy_folder / path),
+            read_columns(optimized_folder / path),
+            tolerances,
+            str(path),
+        )
+        for title, deviation in file_deviations.items():
+            deviations[title] = max(deviation, deviations.get(title, 0))
+        failures += file_failures
+    return deviations, failures
+
+
+@contextmanager
+def replaced(function: str, implementation: Callable) -> Iterator[None]:
+    """
+    Replaces `function` (one of EQUIVALENCE_FUNCTIONS) in the module it's
+    used from with `implementation` within the context
+    """
+    module = importlib.import_module(EQUIVALENCE_FUNCTIONS[function][0])
+    original = getattr(module, function)
+    setattr(module, function, implementation)
+    try:
+        yield
+    finally:
+        setattr(module, function, original)
+
+
+def check_equivalence(
+    function: str, implementation: Callable, inputs, folder: Path
+) -> EquivalenceResult:
+    """
+    Runs the stage that uses `function` (one of EQUIVALENCE_FUNCTIONS) with
+    `inputs` once with the legacy implementation and once with
+    `implementation`, and compares their output files.
+
+    The time of each implementation is the time of the whole stage, including
+    reading and writing files, so the speedup is what processing a night gains.
+    """
+    stage = EQUIVALENCE_FUNCTIONS[function][1]
+    folder = Path(folder)
+    legacy_folder, optimized_folder = folder / "legacy", folder / "optimized"
+    legacy_folder.mkdir(parents=True)
+    optimized_folder.mkdir(parents=True)
+
+    start = time.perf_counter()
+    STAGE_RUNNERS[stage](inputs, legacy_folder)
+    legacy_time = time.perf_counter() - start
+    with replaced(function, implementation):
+        start = time.perf_counter()
+        STAGE_RUNNERS[stage](inputs, optimized_folder)
+        optimized_time = time.perf_counter() - start
+
+    deviations, failures = compare_outputs(legacy_folder, optimized_folder, stage)
+    return {
+        "function": function,
+        "inputs": inputs.name,
+        "legacy_time": legacy_time,
+        "optimized_time": optimized_time,
+        "speedup": legacy_time / optimized_time if optimized_time > 0 else math.inf,
+        "max_deviation": deviations,
+        "failures": failures,
+    }
+
+
+def run_equivalence(
+    implementations: Dict[str, Callable],
+    sizes: List[int] = [1024],
+    no_of_stars: int | None = None,
+    recorded_nights: List[Path] = [],
+) -> List[EquivalenceResult]:
+    """
+    Checks the optimized `implementations` (function name in
+    EQUIVALENCE_FUNCTIONS to implementation) against the legacy ones with a
+    synthetic night of each of `sizes` and with each night output folder in
+    `recorded_nights`
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        all_inputs = [
+            SyntheticInputs(Path(folder) / f"synthetic_{size}", size, no_of_stars)
+            for size in sizes
+        ] + [RecordedInputs(night) for night in recorded_nights]
+        for inputs_index, inputs in enumerate(all_inputs):
+            for function, implementation in implementations.items():
+                results.append(
+                    check_equivalence(
+                        function,
+                        implementation,
+                        inputs,
+                        Path(folder) / "outputs" / str(inputs_index) / function,
+                    )
+                )
+    return results
+
+
+def format_equivalence_results(results: List[EquivalenceResult]) -> str:
+    """
+    Returns the equivalence `results` formatted as a table followed by the
+    failures
+    """
+    titles = ["Function", "Inputs", "Speedup", "Max deviation", "Result"]
+    lines = [f"{titles[0]:<24s}{titles[1]:<32s}{titles[2]:>10s}  {titles[3]:<32s}{titles[4]}"]
+    failures = []
+    for result in results:
+        deviations = result["max_deviation"]
+        if deviations:
+            column = max(deviations, key=deviations.get)
+            max_deviation = f"{deviations[column]:.3g} ({column})"
+        else:
+            max_deviation = "-"
+        lines.append(
+            f"{result['function']:<24s}{result['inputs']:<32s}{result['speedup']:>9.2f}x"
+            f"  {max_deviation:<32s}{'FAIL' if result['failures'] else 'OK'}"
+        )
+        failures += [f"{result['function']} ({result['inputs']}): {f}" for f in result["failures"]]
+    return "\n".join(lines + failures)
@@ -0,0 +1,226 @@
+import math
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import List, TypedDict
+
+import numpy as np
+import numpy.typing as npt
+from astropy.io import fits
+from m23.constants import (
+    INPUT_CALIBRATION_FOLDER_NAME,
+    INPUT_NIGHT_FOLDER_NAME_DATE_FORMAT,
+    M23_RAW_IMAGES_FOLDER_NAME,
+    OBSERVATION_DATETIME_FORMAT,
+)
+from m23.file.reference_log_file import ReferenceLogFile
+from m23.reference import get_reference_files_dict
+
+# Size of the images the positions in the reference files are for
+REFERENCE_IMAGE_SIZE = 1024
+# FWHM of the stars in pixels of an image of REFERENCE_IMAGE_SIZE
+SYNTHETIC_STAR_FWHM = 3.5
+SYNTHETIC_SKY_ADU = 800
+SYNTHETIC_DARK_ADU = 100
+SYNTHETIC_FLAT_ADU = 20000
+# UTC datetime of the first raw image, when M23 is well above the horizon
+SYNTHETIC_NIGHT_START = datetime(2019, 9, 5, 3, 40, 0)
+# Seconds between the start of consecutive raw images
+SYNTHETIC_IMAGE_INTERVAL = 10
+
+
+class SyntheticNight(TypedDict):
+    # Folder of the night, laid out and named like the input nights
+    path: Path
+    night_date: date
+    masterflat: Path
+    # Reference image and reference (stars) file the raw images are aligned
+    # and extracted with
+    reference_image: Path
+    reference_file: Path
+    image_duration: float
+    size: int
+    no_of_stars: int
+
+
+def reference_stars(no_of_stars: int | None = None, size: int = REFERENCE_IMAGE_SIZE):
+    """
+    Returns the x positions, y positions and ADUs of the first `no_of_stars`
+    stars (all if None) of the reference file, with positions scaled for
+    images of `size` x `size` pixels
+    """
+    reference = ReferenceLogFile(get_reference_files_dict()["file"])
+    data = reference.data()[:no_of_stars]
+    scale = size / REFERENCE_IMAGE_SIZE
+    star_adu = data[:, ReferenceLogFile.column_numbers["star_adu"]]
+    return data[:, 0] * scale, data[:, 1] * scale, star_adu
+
+
+def render_star_field(
+    size: int,
+    xs: npt.NDArray,
+    ys: npt.NDArray,
+    fluxes: npt.NDArray,
+    fwhm: float,
+    background: float = 0,
+) -> npt.NDArray:
+    """
+    Returns a noise free `size` x `size` image with a Gaussian star of total
+    flux `fluxes[i]` at (`xs[i]`, `ys[i]`) for each star on `background`.
+    Stars with non positive or unknown flux and those too close to the edges
+    aren't drawn.
+    """
+    image = np.full((size, size), float(background))
+    sigma = fwhm / (2 * math.sqrt(2 * math.log(2)))
+    half_width = math.ceil(4 * sigma)
+    offsets = np.arange(-half_width, half_width + 1)
+    for x, y, flux in zip(xs, ys, fluxes):
+        if not np.isfinite(flux) or flux <= 0:
+            continue
+        col, row = int(round(x)), int(round(y))
+        if not (half_width <= col < size - half_width and half_width <= row < size - half_width):
+            continue
+        # The Gaussian is separable, so the stamp is an outer product
+        gauss_x = np.exp(-((offsets + col - x) ** 2) / (2 * sigma**2))
+        gauss_y = np.exp(-((offsets + row - y) ** 2) / (2 * sigma**2))
+        stamp = np.outer(gauss_y, gauss_x)
+        image[
+            row - half_width : row + half_width + 1, col - half_width : col + half_width + 1
+        ] += (flux * stamp / stamp.sum())
+    return image
+
+
+def synthetic_flat(size: int) -> npt.NDArray:
+    """
+    Returns a flat that falls off towards the edges like vignetting does
+    """
+    yy, xx = np.mgrid[0:size, 0:size]
+    center = (size - 1) / 2
+    r_squared = ((xx - center) ** 2 + (yy - center) ** 2) / center**2
+    return SYNTHETIC_FLAT_ADU * (1 - 0.15 * r_squared)
+
+
+def write_reference_file(path: Path, xs, ys, star_adus, fwhm: float):
+    """
+    Writes the stars in the format of the reference file
+    """
+    with path.open("w") as fd:
+        fd.write("Synthetic reference file\n")
+        fd.write("Star Data Extractor Tool\n")
+        fd.write("     Image: synthetic\n")
+        fd.write(f"     Stars Found: {len(xs)}\n")
+        fd.write("     Radius of star diaphragm: 5\n")
+        fd.write("     Sky annulus inner radius: 7\n")
+        fd.write("     Sky annulus outer radius: 11\n")
+        fd.write("     Threshold factor: High = 1.04\n")
+        titles = ["X", "Y", "Sigma", "FWHM", "Sky ADU", "Star ADU"]
+        fd.write("".join(f"{title:<20s}" for title in titles) + "\n")
+        for x, y, star_adu in zip(xs, ys, star_adus):
+            values = [x, y, fwhm / 2.355, fwhm, SYNTHETIC_SKY_ADU, star_adu]
+            fd.write("".join(f"{value:<20.2f}" for value in values) + "\n")
+
+
+def generate_synthetic_night(
+    folder: Path,
+    size: int = 1024,
+    no_of_images: int = 10,
+    no_of_darks: int = 5,
+    no_of_stars: int | None = None,
+    image_duration: float = 7.0,
+    seed: int = 0,
+) -> SyntheticNight:
+    """
+    Generates a night of synthetic data in `folder` that can be processed
+    like a real night.
+
+    The raw images have Gaussian stars at the positions of the first
+    `no_of_stars` stars (all if None) in the reference file, scaled to images
+    of `size` x `size` pixels. Each image is shifted and rotated slightly
+    from the one before it, like the telescope drifts during a night, and has
+    sky background, dark current, hot pixels, vignetting and Poisson noise.
+    The night also has darks, a master flat, a reference image and a
+    reference file for the stars in the images.
+    """
+    folder = Path(folder)
+    rng = np.random.default_rng(seed)
+    night_date = (SYNTHETIC_NIGHT_START - timedelta(hours=12)).date()
+    night_path = folder / night_date.strftime(INPUT_NIGHT_FOLDER_NAME_DATE_FORMAT)
+    calibration_folder = night_path / INPUT_CALIBRATION_FOLDER_NAME
+    raw_images_folder = night_path / M23_RAW_IMAGES_FOLDER_NAME
+    calibration_folder.mkdir(parents=True, exist_ok=True)
+    raw_images_folder.mkdir(exist_ok=True)
+
+    xs, ys, star_adus = reference_stars(no_of_stars, size)
+    fwhm = SYNTHETIC_STAR_FWHM * size / REFERENCE_IMAGE_SIZE
+    # Reference ADUs are of combined images, so each raw image has a fraction
+    fluxes = star_adus / 10
+
+    reference_file = folder / "synthetic_reference.txt"
+    write_reference_file(reference_file, xs, ys, star_adus, fwhm)
+    reference_image = folder / "synthetic_reference.fit"
+    fits.writeto(
+        reference_image,
+        render_star_field(size, xs, ys, fluxes, fwhm, SYNTHETIC_SKY_ADU).astype("uint16"),
+        overwrite=True,
+    )
+
+    flat = synthetic_flat(size)
+    masterflat = folder / "synthetic_masterflat.fit"
+    fits.writeto(masterflat, flat.astype("int32"), overwrite=True)
+    flat_ratio = flat / SYNTHETIC_FLAT_ADU
+
+    # Hot pixels are at the same positions in the darks and the raw images
+    no_of_hot_pixels = size // 16
+    hot_rows = rng.integers(0, size, no_of_hot_pixels)
+    hot_cols = rng.integers(0, size, no_of_hot_pixels)
+
+    def dark_current():
+        dark = rng.poisson(SYNTHETIC_DARK_ADU, (size, size)).astype(float)
+        dark[hot_rows, hot_cols] += 3000
+        return dark
+
+    for i in range(no_of_darks):
+        fits.writeto(
+            calibration_folder / f"dark_{image_duration}-{i + 1:03}.fit",
+            dark_current().astype("uint16"),
+            overwrite=True,
+        )
+
+    center = (size - 1) / 2
+    dx, dy, rotation = 0.0, 0.0, 0.0
+    for i in range(no_of_images):
+        # Drift by a fraction of a pixel and rotate a little each image
+        dx += rng.normal(0, 0.3)
+        dy += rng.normal(0, 0.3)
+        rotation += rng.normal(0, 0.0002)
+        cos, sin = math.cos(rotation), math.sin(rotation)
+        image_xs = center + cos * (xs - center) - sin * (ys - center) + dx
+        image_ys = center + sin * (xs - center) + cos * (ys - center) + dy
+        signal = render_star_field(size, image_xs, image_ys, fluxes, fwhm, SYNTHETIC_SKY_ADU)
+        data = rng.poisson(signal * flat_ratio) + dark_current()
+        header = fits.Header()
+        observed_at = SYNTHETIC_NIGHT_START + timedelta(seconds=SYNTHETIC_IMAGE_INTERVAL * i)
+        header["DATE-OBS"] = observed_at.strftime(OBSERVATION_DATETIME_FORMAT)
+        fits.writeto(
+            raw_images_folder / f"m23_{image_duration}-{i + 1:03}.fit",
+            np.clip(data, 0, np.iinfo("uint16").max).astype("uint16"),
+            header=header,
+            overwrite=True,
+        )
+
+    return {
+        "path": night_path,
+        "night_date": night_date,
+        "masterflat": masterflat,
+        "reference_image": reference_image,
+        "reference_file": reference_file,
+        "image_duration": image_duration,
+        "size": size,
+        "no_of_stars": len(xs),
+    }
+
+
+def synthetic_raw_images(night: SyntheticNight) -> List[Path]:
+    """
+    Returns the paths of the raw images of the synthetic `night` in order
+    """
+    return sorted((night["path"] / M23_RAW_IMAGES_FOLDER_NAME).glob("*.fit"))
@@ -1,6 +1,7 @@
 import numpy as np
 from m23.constants import ASSUMED_MAX_BRIGHTNESS
 from m23.matrix import cropIntoRectangle
+from m23.matrix.fill import fillMatrix
 from m23.utils import customMedian
 
 # This file is for code related to applying master calibrations (dark, flats)
@@ -71,33 +72,53 @@ def applyCalibration(
     # after subtraction so that we avoid problems like mentioned in
     # https://github.com/LutherAstrophysics/m23/issues/33
     subtractedRaw[subtractedRaw < 0] = 0
-    
-    # Avoid division by zero, and consider the flat ratio as 0 in all places where masterflat is 0
-    # This ensures that in the calibrated image, those positions' ADU values become 0 as well
-    
-    flatRatio = np.divide(averageFlatData, masterFlatData, out=np.zeros_like(masterFlatData, dtype="float64"), where=masterFlatData!=0)
-    
+
+    flatRatio = getFlatRatio(masterFlatData, averageFlatData)
+
     # dtype is set to float32 for our image viewing software Astromagic, since
     # it does not support float64 We think we are not losing any significant
     # precision with this down casting
 
     calibratedImage = np.multiply(flatRatio, subtractedRaw, dtype="float32")
 
-    # Unlike current IDL Code we're doing this step to calibrated
-    #   image instead of the raw
-    # Calculate the median and standard deviation of the raw image
+    return recalibrateHotPixels(calibratedImage, hotPixelsInMasterDark)
+
+
+# getFlatRatio
+#
+# returns AVERAGE_FLAT/MASTER_FLAT, the matrix the dark subtracted raw
+# images are multiplied with
+
 
-    medianInRaw = customMedian(imageData)
-    stdInRaw = np.std(imageData)
+def getFlatRatio(masterFlatData, averageFlatData):
+    # Avoid division by zero, and consider the flat ratio as 0 in all places where masterflat is 0
+    # This ensures that in the calibrated image, those positions' ADU values become 0 as well
+    return np.divide(
+        averageFlatData,
+        masterFlatData,
+        out=np.zeros_like(masterFlatData, dtype="float64"),
+        where=masterFlatData != 0,
+    )
+
+
+# recalibrateHotPixels
+#
+# parameters:
+#   calibratedImage: calibrated image data (float32), which is mutated
+#   hotPixelsInMasterDark: array of positions of hot pixels in master dark
+#
+# returns
+#   calibrated image with the hot pixels recalibrated and the values
+#   brighter than ASSUMED_MAX_BRIGHTNESS set to 0
 
-    # NOTE We don't know why it's 2 sigma???
-    highValue = medianInRaw + 2 * stdInRaw
-    lowValue = medianInRaw - 2 * stdInRaw
+
+def recalibrateHotPixels(calibratedImage, hotPixelsInMasterDark):
+    # Unlike current IDL Code we're doing this step to calibrated
+    #   image instead of the raw
 
     # recalibrate the pixels in hot positions (which are defined by
     #   hot pixels in masterDark)
-    for pixelLocation in hotPixelsInMasterDark:
-        recalibrateAtHotLocation(pixelLocation, calibratedImage, highValue, lowValue)
+    recalibrateAtHotLocations(hotPixelsInMasterDark, calibratedImage)
 
     # This calibration formula converts low background values to very high values,
     # sometimes up to millions, whereas the maximum signal of stars is less than
@@ -111,58 +132,59 @@ def applyCalibration(
     return calibratedImage
 
 
-def recalibrateAtHotLocation(location, calibratedImageData, highValue, lowValue):
+# Offsets of the pixels in the 3X3 box around a pixel, in row major order,
+# and the index of the pixel itself
+BOX_ROW_OFFSETS = np.repeat([-1, 0, 1], 3)
+BOX_COLUMN_OFFSETS = np.tile([-1, 0, 1], 3)
+BOX_CENTER = 4
+
+
+def recalibrateAtHotLocations(locations, calibratedImageData):
     # For all hot pixel positions that aren't at edges (in the master dark)
-    # Check if the pixel value in calibrated( or RAW ??? TO FIX) img is abnormally
-    #   high + one of the surrounding pixels is abnormally high too,
-    #   then we fit a gaussian of surrounding 10X10 pixel box
-    #   and assign the gaussian's value at position [5,5] (because that's the center
-    #   pixel we started with) to that pixel value.
-    #  ELSE: In other words:
-    #  If the pixel value is not abnormally high, or if it's abnormally high but none of
-    #    its surrounding pixels is abnormally high:
-    #    create a 3X3 box with our pixel at center, and take the average of 8 pixels around it
-
-    row, col = location
-
-    # This is the smallest surrounding
-    # We use 11*11 surrounding for Gaussian
-    # and 3*3 for average
-    def surroundingValues():
-        return [
-            calibratedImageData[row - 1, col],
-            calibratedImageData[row + 1, col],
-            calibratedImageData[row, col - 1],
-            calibratedImageData[row, col + 1],
-        ]
-
-    def needsGaussian():
-        # isHigh
-        isHigh = calibratedImageData[row][col].all() > highValue and any(
-            [value > highValue for value in surroundingValues()]
-        )
-        # isLow
-        isLow = calibratedImageData[row][col].all() < lowValue and any(
-            [value < lowValue for value in surroundingValues()]
-        )
-        return isHigh or isLow
-
-    def doGaussian():
-        # Create a gaussian matrix for the surrounding matrix
-        # Let the hot pixel value equal to the middle position value of the gaussian box
-        # Gaussian needs to be done, for now though we're just taking average.
-        # TODO
-        takeAverage()
-
-    def takeAverage():
-        surroundingMatrix = calibratedImageData[row - 1 : row + 2, col - 1 : col + 2]
-        surroundingSum = np.sum(surroundingMatrix)
-        surroundingMatrixAverageWithoutCenter = (
-            surroundingSum - calibratedImageData[row][col]
-        ) / 8
-        calibratedImageData[row][col] = surroundingMatrixAverageWithoutCenter
+    #   create a 3X3 box with our pixel at center, and take the average of 8 pixels around it
+    # TODO: Pixels that are abnormally high (or low) along with one of their surrounding
+    #   pixels should get the value of a gaussian fit to their surrounding 10X10 box instead
+    #
+    # The hot pixels are recalibrated one after another in the order of `locations`,
+    #   so a hot pixel next to hot pixels that come before it takes the average of
+    #   their recalibrated values. Rather than looping over the hot pixels, they're
+    #   recalibrated in waves with array operations: the first wave is the hot pixels
+    #   with no hot pixel before them in their 3X3 box, the next wave those with
+    #   hot pixels only of the first wave before them, and so on. Since most hot
+    #   pixels aren't next to each other, there are only a few waves.
+
+    locations = np.asarray(locations, dtype=int).reshape(-1, 2)
+    if len(locations) == 0:
+        return
+
+    # Rows and columns of the 3X3 box of each hot pixel
+    rows = locations[:, [0]] + BOX_ROW_OFFSETS
+    columns = locations[:, [1]] + BOX_COLUMN_OFFSETS
+
+    # Find the hot pixels in the 3X3 box of each hot pixel that come before it
+    boxIndices = np.ravel_multi_index((rows, columns), calibratedImageData.shape)
+    hotIndices = boxIndices[:, BOX_CENTER]
+    sorter = np.argsort(hotIndices, kind="stable")
+    boxHotPixels = sorter[
+        np.minimum(np.searchsorted(hotIndices, boxIndices, sorter=sorter), len(locations) - 1)
+    ]
+    isHotBefore = (hotIndices[boxHotPixels] == boxIndices) & (
+        boxHotPixels < np.arange(len(locations))[:, np.newaxis]
+    )
 
-    doGaussian() if needsGaussian() else takeAverage()
+    waves = np.zeros(len(locations), dtype=int)
+    while True:
+        nextWaves = np.where(isHotBefore, waves[boxHotPixels] + 1, 0).max(axis=1)
+        if np.array_equal(nextWaves, waves):
+            break
+        waves = nextWaves
+
+    for wave in range(waves.max() + 1):
+        inWave = waves == wave
+        boxValues = calibratedImageData[rows[inWave], columns[inWave]]
+        calibratedImageData[rows[inWave, BOX_CENTER], columns[inWave, BOX_CENTER]] = (
+            np.sum(boxValues, axis=1) - boxValues[:, BOX_CENTER]
+        ) / 8
 
 
 # A word of caution:
@@ -182,6 +204,17 @@ def recalibrateAtHotLocation(location, calibratedImageData, highValue, lowValue)
 
 
 def calibrateImages(masterDarkData, masterFlatData, listOfImagesData, masterBiasData=np.array([])):
+    calibrationContext = CalibrationContext(masterDarkData, masterFlatData)
+    return [calibrationContext.calibrate(imageData) for imageData in listOfImagesData]
+
+
+# getHotPixelPositions
+#
+# returns array of positions (row, column) of the hot pixels in the master
+# dark that aren't at its edges
+
+
+def getHotPixelPositions(masterDarkData):
     # We save the hot pixels, which are 3 standard deviation higher than the median
     # We will save their positions (x,y)
     stdInMasterDark = np.std(masterDarkData)
@@ -199,33 +232,54 @@ def calibrateImages(masterDarkData, masterFlatData, listOfImagesData, masterBias
     totalRows, totalColumns = masterDarkData.shape[0], masterDarkData.shape[1]
 
     # Filter out the edges
-    # Filter top/left
-    topLeftFiltered = filter(
-        lambda row_column: not (row_column[0] < edgeSize or row_column[1] < edgeSize),
-        hotPixelPositions,
-    )
-    # Filter bottom/right & convert to tuple
-    filteredHotPixelPositions = tuple(
-        filter(
-            lambda row_column: not (
-                row_column[0] > totalRows - edgeSize or row_column[1] > totalColumns - edgeSize
-            ),
-            topLeftFiltered,
-        )
-    )
-
-    averageFlat = (getCenterAverage(masterFlatData),)
+    rows, columns = hotPixelPositions[:, 0], hotPixelPositions[:, 1]
+    return hotPixelPositions[
+        (rows >= edgeSize)
+        & (columns >= edgeSize)
+        & (rows <= totalRows - edgeSize)
+        & (columns <= totalColumns - edgeSize)
+    ]
 
-    # print("NO OF HOT PIXEL", len(filteredHotPixelPositions))
-    # We need to find the flux values of (x,y) in the calibrated images
 
-    return [
-        applyCalibration(
-            imageData,
-            masterDarkData,
-            masterFlatData,
-            averageFlat,
-            hotPixelsInMasterDark=filteredHotPixelPositions,
-        )
-        for imageData in listOfImagesData
-    ]
+class CalibrationContext:
+    """
+    Calibrates the raw images of a night with its master dark and master flat
+    the same way as `applyCalibration`. What's computed from the master
+    frames (the flat ratio, the positions of the hot pixels and the pixels of
+    the crop region) is computed only once, when the context is created.
+
+    param: cropRegion: Polygons of the regions of the images to fill with 1
+        after calibration (see `fill_crop_region`), like the crop_region of
+        the configuration
+    """
+
+    def __init__(self, masterDarkData, masterFlatData, cropRegion=()) -> None:
+        self.__master_dark_data = masterDarkData
+        # The calibrated image is multiplied with the flat ratio in float32 anyway
+        self.__flat_ratio = getFlatRatio(
+            masterFlatData, getCenterAverage(masterFlatData)
+        ).astype("float32")
+        self.__hot_pixel_positions = getHotPixelPositions(masterDarkData)
+        self.__crop_region_mask = None
+        if len(cropRegion) > 0:
+            self.__crop_region_mask = fillMatrix(
+                np.zeros(masterDarkData.shape, dtype="uint8"), cropRegion, 1
+            ).astype(bool)
+
+    def calibrate(self, imageData):
+        """
+        Returns the calibrated image data (float32) of the raw image data `imageData`
+        """
+        calibratedImage = np.subtract(imageData, self.__master_dark_data)
+        # Negative values are set to 0, see `applyCalibration`
+        np.maximum(calibratedImage, 0, out=calibratedImage)
+        calibratedImage = np.multiply(self.__flat_ratio, calibratedImage, dtype="float32")
+        return recalibrateHotPixels(calibratedImage, self.__hot_pixel_positions)
+
+    def fill_crop_region(self, calibratedImage):
+        """
+        Fills the crop region of `calibratedImage` with 1, in place, and returns it
+        """
+        if self.__crop_region_mask is not None:
+            calibratedImage[self.__crop_region_mask] = 1
+        return calibratedImage
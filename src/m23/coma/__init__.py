@@ -32,14 +32,6 @@ def coma_correction(
         without performing coma correction.
     """
 
-    # To calculate target fwhm for the night, and use the best fwhm from the night,
-    # uncomment the following line
-    # xfwhm_target, yfwhm_target = best_fwhm_from_the_night(logfiles)
-
-    logger.info(
-        f"Comma correction values: alpha={COMA_ALPHA}, epsilon={COMA_EPSILON} target_XFWHM={xfwhm_target} target_YFWHM={yfwhm_target}"
-    )
-
     # Group aligned combined files based on the hour they're processed
     # This is because for each hour, we generate a new correction model
     group_of_aligned_combined: Dict[str, List[AlignedCombinedFile]] = {}
@@ -55,15 +47,47 @@ def coma_correction(
     # aligned combined image in the middle. Note that the raw images
     # corresponding to that aligned combined image should be used in creating a
     # the coma model.
-    coma_correction_models: Dict[str, rpsf.ArrayCorrector] = {}
-
+    raw_images_for_group: Dict[str, List[RawImageFile]] = {}
     for name, aligned_images in group_of_aligned_combined.items():
         # Sort the aligned images so that we can choose the aligned combined
         # file from the middle of the hour as the sample
         aligned_images.sort(key=lambda x: x.image_number())
         mid_aligned_image = aligned_images[len(aligned_images) // 2]
+        raw_images_for_group[name] = mid_aligned_image.raw_images
+
+    return coma_correction_from_raw_images(
+        raw_images_for_group, logger, save_models_to_folder, xfwhm_target, yfwhm_target
+    )
+
+
+def coma_correction_from_raw_images(
+    raw_images_for_group: Dict[str, List[RawImageFile]],
+    logger,
+    save_models_to_folder: Path,
+    xfwhm_target: float,
+    yfwhm_target: float,
+):
+    """
+    Returns a function that takes raw image of type RawImageFile and returns
+    its corrected image corrected using appropriate coma correction model
+
+    param: raw_images_for_group: Raw images to create the correction model
+        from for each coma group (see `coma_group_name_for_image`)
+    """
+
+    # To calculate target fwhm for the night, and use the best fwhm from the night,
+    # uncomment the following line
+    # xfwhm_target, yfwhm_target = best_fwhm_from_the_night(logfiles)
+
+    logger.info(
+        f"Comma correction values: alpha={COMA_ALPHA}, epsilon={COMA_EPSILON} target_XFWHM={xfwhm_target} target_YFWHM={yfwhm_target}"
+    )
+
+    coma_correction_models: Dict[str, rpsf.ArrayCorrector] = {}
+
+    for name, raw_images in raw_images_for_group.items():
         # Find the raw images associated with that image.
-        raw_images_paths = [x.path() for x in mid_aligned_image.raw_images]
+        raw_images_paths = [x.path() for x in raw_images]
         logger.info(f"Generating coma correction model for day-Hour {name} using images: ")
         for img in raw_images_paths:
             logger.info(f"{img}")
@@ -74,6 +98,31 @@ def coma_correction(
         ac.save(save_model_as)
         logger.info(f"Made coma correction model and saved by name {name}")
 
+    return coma_correction_from_models(coma_correction_models, logger)
+
+
+def load_coma_correction(model_paths: Dict[str, Path], logger):
+    """
+    Returns a function that takes raw image of type RawImageFile and returns
+    its corrected image corrected using the coma correction models previously
+    saved at `model_paths` for each coma group
+    """
+    coma_correction_models: Dict[str, rpsf.ArrayCorrector] = {}
+    for name, path in model_paths.items():
+        coma_correction_models[name] = rpsf.ArrayCorrector.load(str(path))
+        logger.info(f"Loaded coma correction model {name} from {path}")
+    return coma_correction_from_models(coma_correction_models, logger)
+
+
+def coma_correction_from_models(
+    coma_correction_models: Dict[str, rpsf.ArrayCorrector], logger
+):
+    """
+    Returns a function that takes raw image of type RawImageFile and returns
+    its corrected image corrected using the model of its coma group in
+    `coma_correction_models`
+    """
+
     def get_corrected_data_for(raw_img: RawImageFile):
         data = raw_img.data()
         group_name = coma_group_name_for_image(raw_img)
@@ -100,6 +149,44 @@ def coma_correction(
     return get_corrected_data_for
 
 
+def sample_combinations_for_coma_groups(
+    raw_images: List[RawImageFile], no_of_images_to_combine: int
+) -> Dict[str, List[int]]:
+    """
+    Returns the combinations (the nth combined image) that can be used to
+    generate the coma correction model for each coma group of the night. The
+    combinations in each group are ordered by their distance from the middle of
+    the group, so the first combination of a group that can be aligned is the
+    same one that `coma_correction` would choose had the entire night been
+    aligned and combined.
+
+    Note that only the headers of the raw images in the middle of each
+    combination are read. The aligned combined image of a combination uses the
+    header of its middle raw image, so this is the same grouping that
+    `coma_correction` uses.
+    """
+    no_of_combined_images = len(raw_images) // no_of_images_to_combine
+    combinations_in_group: Dict[str, List[int]] = {}
+    for nth_combined_image in range(no_of_combined_images):
+        from_index = nth_combined_image * no_of_images_to_combine
+        to_index = from_index + no_of_images_to_combine
+        # Combinations of non sequential images are skipped in align combine
+        # extract, so they can't be used as a sample
+        first, last = raw_images[from_index], raw_images[to_index - 1]
+        if last.image_number() - first.image_number() >= no_of_images_to_combine:
+            continue
+        sample_raw_image = raw_images[from_index + no_of_images_to_combine // 2]
+        name = coma_group_name_for_image(sample_raw_image)
+        combinations_in_group.setdefault(name, []).append(nth_combined_image)
+
+    result: Dict[str, List[int]] = {}
+    for name, combinations in combinations_in_group.items():
+        mid = len(combinations) // 2
+        indices = sorted(range(len(combinations)), key=lambda i: abs(i - mid))
+        result[name] = [combinations[i] for i in indices]
+    return result
+
+
 def coma_group_name_for_image(a: AlignedCombinedFile | RawImageFile) -> str:
     """
     Return the group name for the aligned combined file to be used in coma
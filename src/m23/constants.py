@@ -7,6 +7,42 @@ COMA_PSF_SIZE = 16  # size of the PSF model to use in pixels
 COMA_PATCH_SIZE = 128  # square side dimension PSF will be applied over
 COMA_ALPHA = 3  # see paper
 COMA_EPSILON = 0.3  # see paper
+# Ways to find the images to make coma correction models from. A full prepass
+# aligns, combines and extracts the entire night without coma correction, while
+# a sampled prepass only aligns one combination per coma group (hour)
+COMA_PREPASS_FULL = "full"
+COMA_PREPASS_SAMPLED = "sampled"
+
+# Ways to find the transformation that aligns an image to the reference image.
+# "astroalign" searches for it by matching triangles of stars in the image and
+# the reference image. "seeded" predicts it from the images aligned before in
+# the same combination and verifies the prediction with a few bright stars,
+# searching for it like "astroalign" only when the prediction can't be verified.
+# "catalog" matches stars in the image to the positions of the stars in the
+# reference file instead of the stars in the reference image. "phase" finds the
+# translation of the image with phase correlation, and is for images that are
+# not rotated or scaled, falling back to "astroalign" for images that are.
+ALIGNMENT_METHOD_ASTROALIGN = "astroalign"
+ALIGNMENT_METHOD_SEEDED = "seeded"
+ALIGNMENT_METHOD_CATALOG = "catalog"
+ALIGNMENT_METHOD_PHASE = "phase"
+
+# Ways to warp images to align them. "skimage" uses `astroalign.apply_transform`
+# (scikit-image's warp in float64) and "opencv" uses OpenCV's warpAffine in float32,
+# both with bicubic interpolation. "opencv" is about twice as fast.
+WARP_BACKEND_SKIMAGE = "skimage"
+WARP_BACKEND_OPENCV = "opencv"
+
+# Ways to use multiple processors when processing nights. The "nights" scheduler
+# processes nights in parallel (see cpu_fraction) and the combinations of each
+# night with its own processors (see combination_cpu_fraction). The "global"
+# scheduler processes combinations of all nights with a single pool of processors.
+SCHEDULER_NIGHTS = "nights"
+SCHEDULER_GLOBAL = "global"
+# Maximum number of nights in progress at once with the global scheduler. Few
+# nights have enough combinations to keep all processors busy, and limiting
+# them limits the memory used by nights waiting for processors.
+SCHEDULER_MAX_NIGHTS_IN_PROGRESS = 4
 
 ASSUMED_MAX_BRIGHTNESS = 65_000
 
@@ -38,6 +74,9 @@ SKY_BG_FOLDER_NAME = "Sky background"
 CHARTS_FOLDER_NAME = "Charts"
 MASTER_DARK_NAME = "masterdark.fit"
 MASTER_FLAT_NAME = "masterflat.fit"
+PROCESSING_MANIFEST_FILE_NAME = "processing_manifest.jsonl"
+ALIGNMENT_TRANSFORMS_FILE_NAME = "alignment_transforms.sqlite"
+TIMINGS_FILE_NAME = "timings.json"
 
 # Extraction
 # We currently use 64*64 size boxes when calculating sky bg
@@ -58,6 +97,11 @@ TYPICAL_NEW_CAMERA_CROP_REGION = [
 ]
 
 DEFAULT_CPU_FRACTION_USAGE = 0.6
+# Maximum memory used to hold raw images that are read ahead of processing
+DEFAULT_PREFETCH_MEMORY_GB = 2
+# Maximum rotation (radians) and change in scale of images aligned with phase
+# correlation, at which the corners of 1024x1024 images are off by 0.07 pixels
+DEFAULT_PHASE_CORRELATION_MAX_ROTATION = 0.0001
 
 # TYPES
 ScaleType = float
@@ -1,5 +1,10 @@
+import hashlib
 import re
-from pathlib import WindowsPath
+from pathlib import Path, WindowsPath
+from typing import Callable, Dict, Tuple
+
+# Data parsed from reference files, see `read_cached`
+_parsed_files: Dict[Tuple[str, str], Tuple[Tuple[int, int], object]] = {}
 
 
 def getLinesWithNumbersFromFile(fileName):
@@ -42,3 +47,34 @@ def is_string_float(string: str) -> bool:
         return True
     except ValueError:
         return False
+
+
+def read_cached(kind: str, path: Path, parse: Callable[[Path], object]):
+    """
+    Returns `parse(path)`, parsing the file only if it wasn't parsed before by
+    this process (or the process it was forked from) or has changed since.
+
+    This is meant for reference files that are read for every night and
+    combination, and by every job of the server (see `m23.processor.server`).
+    Note that callers get the same object, so they must not modify it.
+
+    param: kind: Kind of file, so that files parsed differently are cached separately
+    """
+    stat = path.stat()
+    version = (stat.st_mtime_ns, stat.st_size)
+    key = (kind, str(path.absolute()))
+    if (cached := _parsed_files.get(key)) is not None and cached[0] == version:
+        return cached[1]
+    data = parse(path)
+    _parsed_files[key] = (version, data)
+    return data
+
+
+def file_hash(path: Path) -> str:
+    """
+    Returns the SHA-256 hash of the contents of the file at `path`, hashing
+    the file only if it wasn't hashed before by this process or has changed since
+    """
+    return read_cached(
+        "sha256", Path(path), lambda path: hashlib.sha256(path.read_bytes()).hexdigest()
+    )
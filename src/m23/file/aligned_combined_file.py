@@ -101,19 +101,36 @@ class AlignedCombinedFile:
         return self.__data
 
     def header(self) -> Header:
-        if not self.__is_read:
+        if self.__header is None:
             self._read()
         return self.__header
 
+    def set_header_from(self, raw_image: RawImageFile) -> None:
+        """
+        Uses the header of `raw_image` as the header of this file without
+        reading it from disk. This is useful for aligned combined files that
+        are never written, as `create_file` would copy the same header.
+        """
+        self.__header = raw_image.header()
+
     def path(self):
         return self.__path
 
+    def clear(self):
+        """
+        Clears the data attribute of the object to save memory. Call the data
+        method as usual if you need data after calling this method
+        """
+        self.__data = None
+        self.__header = None
+        self.__is_read = False
+
     def create_file(self, data: npt.NDArray, copy_header_from: RawImageFile) -> None:
         """
         Create a fit file based on provided np array `data`.
         It copies the header information from the `RawImageFile`
         """
-        fits.writeto(self.path(), data, header=copy_header_from.header())
+        fits.writeto(self.path(), data, header=copy_header_from.header(), overwrite=True)
 
     def __repr__(self) -> str:
         return self.__str__()
@@ -1,6 +1,7 @@
 from datetime import date
 from pathlib import Path
 
+import numpy as np
 from m23.align import AlignmentTransformationType
 from m23.constants import ALIGNED_STATS_FILE_DATE_FORMAT
 
@@ -31,21 +32,33 @@ class AlignmentStatsFile:
                 f"{'Rotation':<20s}"
                 f"{'Translation_X':<15s}"
                 f"{'Translation_Y':<15s}"
-                f"{'Scale':<10s}\n"
+                f"{'Scale':<10s}"
+                f"{'Residual':<10s}\n"
             )
 
-    def add_record(self, image_name: str, alignment_stats: AlignmentTransformationType):
+    def add_record(
+        self,
+        image_name: str,
+        alignment_stats: AlignmentTransformationType,
+        residual: float | None = None,
+    ):
         """
         Adds a record to the file based on the provided `alignment_stats`
+
+        param: residual: Root mean square distance in pixels between the stars matched
+            to align the image and the matching stars in the reference, nan if not known
         """
         rotation, translation_x, translation_y, scale = alignment_stats
+        if residual is None:
+            residual = np.nan
         with open(self.path(), "a") as fd:
             fd.write(
                 f"{image_name:<30}"
                 f"{rotation:<20.9f}"
                 f"{translation_x:<15.3f}"
                 f"{translation_y:<15.3f}"
-                f"{scale:<10.3f}\n"
+                f"{scale:<10.3f}"
+                f"{residual:<10.3f}\n"
             )
 
     def __repr__(self) -> str:
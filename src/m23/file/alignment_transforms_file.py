@@ -0,0 +1,123 @@
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, Iterable, Tuple
+
+from m23.align import AlignmentTransformationType
+
+
+class AlignmentTransformsFile:
+    """
+    Store of the transformations found to align the raw images of a night, so
+    that processing the night again (for example with a different no. of
+    images to combine, radii of extraction or coma correction target) doesn't
+    have to find them again. Unlike the alignment stats file, which is only
+    written, this file is read back when the night is processed.
+
+    The transformations are stored in an SQLite database keyed by the path of
+    the raw image, the hash of the reference image and the alignment method
+    they were found with. The size and modification time of the raw image are
+    stored as well, so that transformations of raw images that have changed
+    since aren't used.
+    """
+
+    def __init__(self, file_path) -> None:
+        self.__path = Path(file_path)
+
+    def path(self):
+        return self.__path
+
+    def exists(self):
+        return self.path().exists()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path())
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS transforms ("
+            " raw_image TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " reference_hash TEXT NOT NULL,"
+            " alignment_method TEXT NOT NULL,"
+            " rotation REAL NOT NULL,"
+            " translation_x REAL NOT NULL,"
+            " translation_y REAL NOT NULL,"
+            " scale REAL NOT NULL,"
+            " residual REAL,"
+            " PRIMARY KEY (raw_image, reference_hash, alignment_method))"
+        )
+        return connection
+
+    def add_transforms(
+        self,
+        transforms: Iterable[Tuple[Path, AlignmentTransformationType, float | None]],
+        reference_hash: str,
+        alignment_method: str,
+    ):
+        """
+        Stores the transformation and residual (see `m23.align.match_residual`)
+        of each raw image in `transforms`, given as (raw image path,
+        transformation, residual), found with the reference image with hash
+        `reference_hash` and `alignment_method`
+        """
+        rows = []
+        for raw_image_path, transformation, residual in transforms:
+            rotation, translation_x, translation_y, scale = transformation
+            stat = Path(raw_image_path).stat()
+            rows.append(
+                (
+                    str(Path(raw_image_path).absolute()),
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    reference_hash,
+                    alignment_method,
+                    float(rotation),
+                    float(translation_x),
+                    float(translation_y),
+                    float(scale),
+                    None if residual is None else float(residual),
+                )
+            )
+        if len(rows) == 0:
+            return
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO transforms VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def transforms(
+        self, raw_image_paths: Iterable[Path], reference_hash: str, alignment_method: str
+    ) -> Dict[Path, Tuple[AlignmentTransformationType, float | None]]:
+        """
+        Returns the stored (transformation, residual) of each of the raw images
+        at `raw_image_paths` that was aligned with the reference image with hash
+        `reference_hash` and `alignment_method` and hasn't changed since
+        """
+        if not self.exists():
+            return {}
+        with closing(self._connect()) as connection:
+            stored = {
+                raw_image: row
+                for raw_image, *row in connection.execute(
+                    "SELECT raw_image, size, mtime_ns, rotation, translation_x, translation_y,"
+                    " scale, residual FROM transforms"
+                    " WHERE reference_hash = ? AND alignment_method = ?",
+                    (reference_hash, alignment_method),
+                )
+            }
+        result = {}
+        for raw_image_path in raw_image_paths:
+            row = stored.get(str(Path(raw_image_path).absolute()))
+            if row is None:
+                continue
+            size, mtime_ns, *transformation, residual = row
+            stat = Path(raw_image_path).stat()
+            if (stat.st_size, stat.st_mtime_ns) == (size, mtime_ns):
+                result[raw_image_path] = tuple(transformation), residual
+        return result
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
+    def __str__(self) -> str:
+        return f"Alignment transforms file: {self.path()}"
@@ -0,0 +1,131 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# Events of inotify (see `man inotify`) after which a file in a watched folder
+# may be complete
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+
+# Size of fit files is always a multiple of the size of a fit block
+FIT_BLOCK_SIZE = 2880
+
+
+def _load_inotify():
+    """
+    Returns the C library if it has inotify (Linux), None otherwise
+    """
+    if not hasattr(select, "select"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, "inotify_init1") or not hasattr(libc, "inotify_add_watch"):
+        return None
+    return libc
+
+
+class FolderWatcher:
+    """
+    Waits for files to be written to folders, for example the raw images that
+    the telescope's camera writes during the night.
+
+    Usage:
+        with FolderWatcher([folder], poll_interval=10) as watcher:
+            while True:
+                for path in watcher.settled(sorted_by_number(folder.glob("*.fit"))):
+                    # Process the file that's completely written
+                watcher.wait()
+
+    On Linux, inotify is used so that `wait` returns as soon as a file in the
+    folders is written. Elsewhere (or if inotify can't be used), `wait` just
+    waits for the poll interval before the folders are looked at again.
+    """
+
+    def __init__(self, folders: List[Path], poll_interval: float, use_inotify=True) -> None:
+        """
+        param: folders: Folders to watch
+        param: poll_interval: Max. no. of seconds `wait` waits
+        param: use_inotify: Whether to use inotify when it's available
+        """
+        self.__folders = [Path(folder) for folder in folders]
+        self.__poll_interval = poll_interval
+        self.__sizes: Dict[Path, Tuple[int, int]] = {}
+        self.__fd = None
+        libc = _load_inotify() if use_inotify else None
+        if libc is not None:
+            fd = libc.inotify_init1(IN_NONBLOCK)
+            mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+            if fd >= 0 and all(
+                libc.inotify_add_watch(fd, str(folder).encode(), mask) >= 0
+                for folder in self.__folders
+            ):
+                self.__fd = fd
+            elif fd >= 0:
+                os.close(fd)
+
+    def uses_inotify(self) -> bool:
+        return self.__fd is not None
+
+    def wait(self, timeout: float | None = None) -> None:
+        """
+        Waits until a file is written to one of the folders or for `timeout`
+        seconds (the poll interval by default), whichever is sooner. Note that
+        when inotify isn't used, this always waits for `timeout` seconds.
+        """
+        timeout = self.__poll_interval if timeout is None else timeout
+        if self.__fd is None:
+            time.sleep(timeout)
+            return
+        readable, _, _ = select.select([self.__fd], [], [], timeout)
+        if readable:
+            # Discard the events as the folders are looked at again anyway
+            try:
+                while os.read(self.__fd, 64 * 1024):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def settled(self, paths: List[Path]) -> List[Path]:
+        """
+        Returns the paths from the start of `paths` up to (not including) the
+        first file that may still be being written. A file is considered to be
+        completely written if it's a whole no. of fit blocks long and its size
+        and modification time haven't changed since the previous call.
+        """
+        settled_paths = []
+        is_prefix = True
+        for path in paths:
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                is_prefix = False
+                continue
+            # Sizes are noted for all files, not just the ones in the prefix,
+            # so that files that were written together settle together
+            size = (stat.st_size, stat.st_mtime_ns)
+            previous_size = self.__sizes.get(path)
+            self.__sizes[path] = size
+            if stat.st_size == 0 or stat.st_size % FIT_BLOCK_SIZE != 0 or previous_size != size:
+                is_prefix = False
+            if is_prefix:
+                settled_paths.append(path)
+        return settled_paths
+
+    def close(self):
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
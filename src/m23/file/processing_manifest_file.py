@@ -0,0 +1,171 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, List
+
+from m23 import __version__
+
+
+class ProcessingManifestFile:
+    """
+    Manifest of the processing of a night. It records the master dark, the
+    result of each combination as soon as it's processed and the coma
+    correction models, so that processing that was interrupted can be resumed
+    without redoing the combinations that were already completed.
+
+    Each of these is recorded along with the fingerprints of the stages that
+    produced it (see `m23.processor.stages`), so that the products can be
+    reused only if they'd be the same with the current configuration.
+
+    The file is written in the JSON lines format and records are only ever
+    appended to it, so if the processing crashes while writing a record, only
+    that record is lost. Records read later override the records read earlier.
+    """
+
+    PRECOMA_PASS = "precoma"
+    CORRECTED_PASS = "corrected"
+
+    def __init__(self, file_path) -> None:
+        self.__path = Path(file_path)
+        self.__is_read = False
+        self.__combinations: Dict[str, Dict[int, Dict]] = {}
+        self.__coma_models: Dict | None = None
+        self.__master_dark: Dict | None = None
+
+    def path(self):
+        return self.__path
+
+    def exists(self):
+        return self.path().exists()
+
+    def _read(self):
+        self.__combinations = {self.PRECOMA_PASS: {}, self.CORRECTED_PASS: {}}
+        with self.path().open() as fd:
+            for line in fd:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Record that was being written when the processing crashed
+                    continue
+                match record:
+                    case {"type": "combination", "pass": pass_name, "nth_combined_image": nth}:
+                        self.__combinations[pass_name][nth] = record
+                    case {"type": "clear_combinations", "pass": pass_name}:
+                        self.__combinations[pass_name] = {}
+                    case {"type": "coma_models"}:
+                        self.__coma_models = record
+                    case {"type": "master_dark"}:
+                        self.__master_dark = record
+        self.__is_read = True
+
+    def _append(self, record: Dict):
+        with self.path().open("a") as fd:
+            fd.write(json.dumps(record) + "\n")
+            fd.flush()
+            os.fsync(fd.fileno())
+
+    def create_file(self):
+        """
+        Create a file (wipes out if the file already exists)
+        """
+        with self.path().open("w"):
+            pass
+        self._append({"type": "night", "version": __version__})
+        self.__combinations = {self.PRECOMA_PASS: {}, self.CORRECTED_PASS: {}}
+        self.__coma_models = None
+        self.__master_dark = None
+        self.__is_read = True
+
+    def add_master_dark(self, path: Path, stages: Dict[str, str]):
+        """
+        Records the path of the master dark made by the stages with
+        fingerprints `stages`
+        """
+        self.__master_dark = {"type": "master_dark", "path": str(path), "stages": stages}
+        self._append(self.__master_dark)
+
+    def master_dark(self, stages: Dict[str, str]) -> Path | None:
+        """
+        Returns the path of the master dark if it's recorded and was made by the
+        stages with fingerprints `stages`, None otherwise
+        """
+        if not self.__is_read:
+            self._read()
+        if self.__master_dark is None or not is_made_by(self.__master_dark, stages):
+            return None
+        return Path(self.__master_dark["path"])
+
+    def add_combination(self, pass_name: str, record: Dict, stages: Dict[str, str]):
+        """
+        Records the result of processing a combination in the pass `pass_name`
+        by the stages with fingerprints `stages`. `record` must have the key
+        `nth_combined_image`
+        """
+        record = {"type": "combination", "pass": pass_name, **record, "stages": stages}
+        self._append(record)
+        self.__combinations[pass_name][record["nth_combined_image"]] = record
+
+    def clear_combinations(self, pass_name: str):
+        """
+        Records that the combinations of the pass `pass_name` recorded so far
+        can't be used anymore, for example because their files were replaced
+        """
+        self._append({"type": "clear_combinations", "pass": pass_name})
+        if self.__is_read:
+            self.__combinations[pass_name] = {}
+
+    def combination(self, pass_name: str, nth_combined_image: int) -> Dict | None:
+        """
+        Returns the record of the `nth_combined_image` in the pass `pass_name`
+        or None if the combination isn't recorded
+        """
+        if not self.__is_read:
+            self._read()
+        return self.__combinations[pass_name].get(nth_combined_image)
+
+    def combinations(self, pass_name: str) -> List[Dict]:
+        """
+        Returns the records of all combinations in the pass `pass_name`
+        ordered by the image number
+        """
+        if not self.__is_read:
+            self._read()
+        return [v for _, v in sorted(self.__combinations[pass_name].items())]
+
+    def add_coma_models(self, models: Dict[str, Path], stages: Dict[str, str]):
+        """
+        Records the paths of the coma correction models for each coma group
+        made by the stages with fingerprints `stages`
+        """
+        self.__coma_models = {
+            "type": "coma_models",
+            "models": {name: str(path) for name, path in models.items()},
+            "stages": stages,
+        }
+        self._append(self.__coma_models)
+
+    def coma_models(self, stages: Dict[str, str]) -> Dict[str, Path] | None:
+        """
+        Returns the paths of the coma correction models for each coma group, or
+        None if the models aren't recorded yet or weren't made by the stages
+        with fingerprints `stages`
+        """
+        if not self.__is_read:
+            self._read()
+        if self.__coma_models is None or not is_made_by(self.__coma_models, stages):
+            return None
+        return {name: Path(path) for name, path in self.__coma_models["models"].items()}
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
+    def __str__(self) -> str:
+        return f"Processing manifest file: {self.path()}"
+
+
+def is_made_by(record: Dict, stages: Dict[str, str]) -> bool:
+    """
+    Returns whether the product in `record` was made by the stages with
+    fingerprints `stages`
+    """
+    return all(record.get("stages", {}).get(stage) == fp for stage, fp in stages.items())
@@ -86,8 +86,13 @@ class RawImageFile:
         return self.__data
 
     def header(self) -> Header:
-        if not self.__is_read:
-            self._read()
+        # Note that we only read the header (and not the data) if the data
+        # hasn't been read already. This makes reading headers of all images
+        # of a night, for example to find their datetime, cheap.
+        if self.__header is None:
+            if not self.exists():
+                raise FileNotFoundError(f"File not found {self.path()}")
+            self.__header = fits.getheader(self.path())
         return self.__header
 
     def create_file(self, data: npt.NDArray, copy_header_from) -> None:
@@ -95,7 +100,7 @@ class RawImageFile:
         Create a fit file based on provided np array `data`.
         It copies the header information from the `RawImageFile`
         """
-        fits.writeto(self.path(), data, header=copy_header_from.header())
+        fits.writeto(self.path(), data, header=copy_header_from.header(), overwrite=True)
 
     def clear(self):
         """
@@ -0,0 +1,135 @@
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, List, Sequence
+
+from m23.file.raw_image_file import RawImageFile
+
+
+class RawImagePrefetcher:
+    """
+    Reads the raw images of upcoming combinations in a background thread so
+    that reading (and decoding) fit files from slow drives overlaps with the
+    calibration and alignment of the current combination.
+
+    Usage:
+        with RawImagePrefetcher(raw_images, 10, 2, 2 * 1024**3) as prefetcher:
+            for nth_combined_image in range(no_of_combined_images):
+                prefetcher.wait(nth_combined_image)
+                # Process raw images of the combination as usual
+                prefetcher.release(nth_combined_image)
+
+    The data of the raw images are cached in the `RawImageFile` objects
+    themselves, so code that calls `RawImageFile.data()` after `wait` gets the
+    prefetched data. A `depth` of 0 disables prefetching, in which case `wait`
+    does nothing and images are read when their data is first accessed.
+
+    When only some of the combinations are processed (for example when
+    resuming a night), pass them as `nth_combined_images` so that only their
+    raw images are read ahead.
+    """
+
+    def __init__(
+        self,
+        raw_images: List[RawImageFile],
+        no_of_images_to_combine: int,
+        depth: int,
+        max_bytes_in_memory: int,
+        nth_combined_images: Sequence[int] | None = None,
+    ) -> None:
+        """
+        param: raw_images: Raw images of the night, in the order they're combined
+        param: no_of_images_to_combine: No. of raw images in one combination
+        param: depth: No. of combinations after the current one to read ahead
+        param: max_bytes_in_memory: Memory budget for the prefetched raw images.
+            Combinations ahead of the current one are read only while the raw
+            images that are read but not yet released fit within this budget.
+        param: nth_combined_images: Combinations that are processed, in the order
+            they're processed. All combinations of `raw_images` if None.
+        """
+        self.__raw_images = raw_images
+        self.__no_of_images_to_combine = no_of_images_to_combine
+        if nth_combined_images is None:
+            nth_combined_images = range(len(raw_images) // no_of_images_to_combine)
+        self.__nth_combined_images = list(nth_combined_images)
+        # Position of each combination in the order they're processed
+        self.__positions = {n: i for i, n in enumerate(self.__nth_combined_images)}
+        self.__depth = depth
+        self.__max_bytes_in_memory = max_bytes_in_memory
+        self.__futures: Dict[int, List[Future]] = {}
+        self.__bytes_for_combination: Dict[int, int] = {}
+        # We read images one after another in a single thread as reading
+        # multiple files at once from spinning disks only slows them down
+        self.__executor = ThreadPoolExecutor(max_workers=1) if depth > 0 else None
+
+    def _raw_images_for(self, nth_combined_image: int) -> List[RawImageFile]:
+        from_index = nth_combined_image * self.__no_of_images_to_combine
+        to_index = from_index + self.__no_of_images_to_combine
+        return self.__raw_images[from_index:to_index]
+
+    def _bytes_in_memory(self) -> int:
+        return sum(self.__bytes_for_combination.values())
+
+    def _schedule(self, nth_combined_image: int, ignore_budget=False) -> bool:
+        """
+        Schedules reading of the raw images of `nth_combined_image` and returns
+        whether it is scheduled (or had already been scheduled)
+        """
+        if nth_combined_image in self.__futures:
+            return True
+        raw_images = self._raw_images_for(nth_combined_image)
+        # Fit files aren't compressed, so the file size is a good estimate
+        # of the memory the data of the image is going to take
+        size = sum(raw_image.path().stat().st_size for raw_image in raw_images)
+        if not ignore_budget and self._bytes_in_memory() + size > self.__max_bytes_in_memory:
+            return False
+        self.__bytes_for_combination[nth_combined_image] = size
+        self.__futures[nth_combined_image] = [
+            self.__executor.submit(raw_image.data) for raw_image in raw_images
+        ]
+        return True
+
+    def wait(self, nth_combined_image: int) -> None:
+        """
+        Waits until the raw images of `nth_combined_image` are read and
+        schedules reading of the (up to `depth`) combinations processed after it.
+
+        Note that errors in reading images are ignored here. Since a raw image
+        that couldn't be read isn't cached, the error is raised again when its
+        data is accessed, i.e. at the same place it would without prefetching.
+        """
+        if self.__executor is None:
+            return
+        # The current combination is read regardless of the memory budget as
+        # it'd have to be read anyway
+        self._schedule(nth_combined_image, ignore_budget=True)
+        if (position := self.__positions.get(nth_combined_image)) is not None:
+            ahead = self.__nth_combined_images[position + 1 : position + 1 + self.__depth]
+            for nth_ahead in ahead:
+                if not self._schedule(nth_ahead):
+                    break
+        wait(self.__futures[nth_combined_image])
+
+    def release(self, nth_combined_image: int) -> None:
+        """
+        Frees the data of the raw images of `nth_combined_image`
+        """
+        if futures := self.__futures.pop(nth_combined_image, None):
+            # Futures cancelled when closing never complete, so we don't wait for them
+            wait([future for future in futures if not future.cancelled()])
+        self.__bytes_for_combination.pop(nth_combined_image, None)
+        for raw_image in self._raw_images_for(nth_combined_image):
+            raw_image.clear()
+
+    def close(self) -> None:
+        """
+        Stops reading ahead and frees the data of all prefetched raw images
+        """
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=True, cancel_futures=True)
+        for nth_combined_image in list(self.__futures.keys()):
+            self.release(nth_combined_image)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -5,7 +5,7 @@ from typing import Dict, Tuple
 import numpy as np
 import numpy.typing as npt
 
-from m23.file import line_str_contains_numbers_and_non_alphabets
+from m23.file import line_str_contains_numbers_and_non_alphabets, read_cached
 
 
 class ReferenceLogFile:
@@ -25,15 +25,22 @@ class ReferenceLogFile:
         self.__is_read = False
         self.__data = None
 
-    def _read(self):
-        with self.__path.open() as fd:
+    @classmethod
+    def _parse(cls, path: Path) -> npt.NDArray:
+        with path.open() as fd:
             lines = [line.strip() for line in fd.readlines()]
-            lines = lines[self.header_rows :]  # Skip headers
+            lines = lines[cls.header_rows :]  # Skip headers
             lines = filter(line_str_contains_numbers_and_non_alphabets, lines)
             # Create a 2d list
             lines = [line.split() for line in lines]
             # Convert to 2d numpy array
-            self.__data = np.array(lines, dtype="float")
+            data = np.array(lines, dtype="float")
+        # The data is shared by all instances for the file, see `read_cached`
+        data.flags.writeable = False
+        return data
+
+    def _read(self):
+        self.__data = read_cached("reference_log_file", self.__path, self._parse)
         self.__is_read = True
 
     def _get_col_value(self, star_no: int, col: str) -> float:
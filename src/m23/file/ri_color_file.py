@@ -2,7 +2,7 @@ from pathlib import Path
 
 import numpy as np
 
-from m23.file import is_string_float
+from m23.file import is_string_float, read_cached
 
 
 class RIColorFile:
@@ -19,13 +19,20 @@ class RIColorFile:
         if not self.path().is_file() or self.path().suffix != ".txt":
             raise ValueError(f"{self.path()} is not a valid txt file")
 
+    @classmethod
+    def _parse(cls, path: Path):
+        with path.open() as fd:
+            lines = [line.strip() for line in fd.readlines()]
+            lines = lines[cls.header_rows :]  # Skip the header rows
+            data = np.array([x for x in lines if is_string_float(x)], dtype="float")
+        # The data is shared by all instances for the file, see `read_cached`
+        data.flags.writeable = False
+        return data
+
     def _read(self):
         self._validate_file()
-        with self.path().open() as fd:
-            lines = [line.strip() for line in fd.readlines()]
-            lines = lines[self.header_rows :]  # Skip the header rows
-            self.__data = np.array([x for x in lines if is_string_float(x)], dtype="float")
-            self.__is_read = True
+        self.__data = read_cached("ri_color_file", self.path(), self._parse)
+        self.__is_read = True
 
     def data(self):
         if not self.__is_read:
@@ -0,0 +1,54 @@
+import json
+from pathlib import Path
+from typing import Dict
+
+from m23 import __version__
+
+
+class TimingsFile:
+    """
+    Machine readable record of the time taken by each stage of processing a
+    night, written in the JSON format
+    """
+
+    def __init__(self, file_path) -> None:
+        self.__path = Path(file_path)
+
+    def path(self):
+        return self.__path
+
+    def exists(self):
+        return self.path().exists()
+
+    def create_file(
+        self, stage_timings: Dict[str, Dict[str, float]], total_wall_time: float, no_of_frames: int
+    ):
+        """
+        Create a file (wipes out if the file already exists) with the timings
+        of each stage, see `m23.processor.timings.StageTimings.stages`, and the
+        `total_wall_time` taken to process `no_of_frames` raw images
+        """
+        stages = {}
+        for stage, values in stage_timings.items():
+            stages[stage] = dict(values)
+            wall_time = values["wall_time"]
+            stages[stage]["frames_per_second"] = values["frames"] / wall_time if wall_time else 0
+        data = {
+            "version": __version__,
+            "wall_time": total_wall_time,
+            "frames": no_of_frames,
+            "frames_per_second": no_of_frames / total_wall_time if total_wall_time else 0,
+            "stages": stages,
+        }
+        with self.path().open("w") as fd:
+            json.dump(data, fd, indent=4)
+
+    def data(self) -> Dict:
+        with self.path().open() as fd:
+            return json.load(fd)
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
+    def __str__(self) -> str:
+        return f"Timings file: {self.path()}"
@@ -1,11 +1,37 @@
-from .generate_masterflat import generate_masterflat
-from .nights_csv import create_nights_csv
-from .process_nights import start_data_processing
-from .renormalize import renormalize
+import importlib
+
+# Module each function is imported from. Modules are imported the first time
+# one of their functions is used rather than when this package is imported,
+# so that a subcommand like `csv` doesn't pay for importing matplotlib,
+# astropy, scipy, etc. that only processing nights needs.
+_FUNCTION_MODULES = {
+    "start_data_processing": "m23.processor.process_nights",
+    "renormalize": "m23.processor.renormalize",
+    "generate_masterflat": "m23.processor.generate_masterflat",
+    "create_nights_csv": "m23.processor.nights_csv",
+    "start_watching": "m23.processor.watch",
+    "start_server": "m23.processor.server",
+    "submit_job": "m23.processor.server",
+}
 
 __all__ = [
     "start_data_processing",
     "renormalize",
     "generate_masterflat",
     "create_nights_csv",
+    "start_watching",
+    "start_server",
+    "submit_job",
 ]
+
+
+def __getattr__(name):
+    if name in _FUNCTION_MODULES:
+        value = getattr(importlib.import_module(_FUNCTION_MODULES[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
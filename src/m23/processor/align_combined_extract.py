@@ -1,29 +1,71 @@
 import logging
-from datetime import timedelta
+import sys
+import traceback
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterable, Iterator, List, Tuple, TypedDict
 
+import multiprocess as mp
 import numpy as np
-from m23.align import image_alignment, image_alignment_with_given_transformation
-from m23.calibrate.calibration import calibrateImages
+from m23.align import (
+    image_alignment_with_given_transformation,
+    predict_transformation,
+    reference_aligner,
+)
+from m23.align.catalog import catalog_aligner
+from m23.align.phase import phase_correlation_aligner
+from m23.calibrate.calibration import CalibrationContext
 from m23.coma import precoma_folder_name
 from m23.constants import (
     ALIGNED_COMBINED_FOLDER_NAME,
+    ALIGNMENT_METHOD_CATALOG,
+    ALIGNMENT_METHOD_PHASE,
+    ALIGNMENT_METHOD_SEEDED,
     ALIGNED_FOLDER_NAME,
+    COMA_PREPASS_SAMPLED,
     LOG_FILES_COMBINED_FOLDER_NAME,
     M23_RAW_IMAGES_FOLDER_NAME,
     RAW_CALIBRATED_FOLDER_NAME,
+    AlignmentTransformationType,
 )
 from m23.exceptions import CouldNotAlignException
 from m23.extract import extract_stars
+from m23.file import file_hash
 from m23.file.aligned_combined_file import AlignedCombinedFile
 from m23.file.log_file_combined_file import LogFileCombinedFile
 from m23.file.raw_image_file import RawImageFile
 from m23.file.reference_log_file import ReferenceLogFile
 from m23.matrix import crop
-from m23.matrix.fill import fillMatrix
 from m23.processor.config_loader import Config, ConfigInputNight
+from m23.processor.memory import log_peak_memory_usage
+from m23.processor.stages import (
+    ALIGNMENT_STAGE,
+    CALIBRATION_STAGE,
+    COMBINATION_STAGE,
+    EXTRACTION_STAGE,
+)
+from m23.processor.timings import (
+    COMA_CORRECTION_STAGE,
+    READING_STAGE,
+    StageTimings,
+    file_size,
+)
 from m23.utils import time_taken_to_capture_and_save_a_raw_file
+from typing_extensions import NotRequired
+
+
+class AlignCombineExtractResult(TypedDict):
+    nth_combined_image: int
+    # Transformation of each raw image that was aligned in this combination and
+    # the residual of the stars matched to align it (see `m23.align.match_residual`,
+    # None if not known), in the order in which they were aligned. Note that this
+    # may contain images from a combination that was later skipped.
+    alignment_stats: List[Tuple[RawImageFile, AlignmentTransformationType, float | None]]
+    # Only present if the combination was successfully combined and extracted
+    aligned_combined_file: NotRequired[AlignedCombinedFile]
+    log_file_combined_file: NotRequired[LogFileCombinedFile]
+    # Time taken by each stage of processing this combination
+    timings: NotRequired[StageTimings]
 
 
 def align_combined_extract(  # noqa
@@ -33,20 +75,31 @@ def align_combined_extract(  # noqa
     night_date,
     nth_combined_image,
     raw_images: List[RawImageFile],
-    master_dark_data,
-    master_flat_data,
-    alignment_stats_file,
+    calibration_context: CalibrationContext,
     image_duration,
-    log_files_to_normalize,
-    aligned_combined_files,
     coma_correction_fn,
     alignment_matrices_for_raw_images,
-):
+    find_transformations=True,
+) -> AlignCombineExtractResult:
+    """
+    Calibrates, aligns, combines and extracts stars from the `nth_combined_image`
+    set of `raw_images` for the night. Raw images whose transformation is in
+    `alignment_matrices_for_raw_images` are aligned with it instead of finding it again.
+    If `find_transformations` is False, the combination is skipped if the
+    transformation of any of its raw images isn't known.
+
+    Note that this function doesn't write to the alignment stats file or mutate
+    `alignment_matrices_for_raw_images`. The transformations of the aligned
+    images are instead returned as part of the result so that the caller can
+    record them, this allows combinations to be processed in separate processes.
+    """
     logger = logging.getLogger("LOGGER_" + str(night_date))
-
-    # Define relevant input folders for the night being processed
-    NIGHT_INPUT_FOLDER: Path = night["path"]
-    NIGHT_INPUT_IMAGES_FOLDER = NIGHT_INPUT_FOLDER / M23_RAW_IMAGES_FOLDER_NAME
+    timings = StageTimings()
+    result: AlignCombineExtractResult = {
+        "nth_combined_image": nth_combined_image,
+        "alignment_stats": [],
+        "timings": timings,
+    }
 
     # Define and create relevant output folders for the night being processed
     if coma_correction_fn is None:
@@ -63,15 +116,21 @@ def align_combined_extract(  # noqa
         RAW_CALIBRATED_OUTPUT_FOLDER = output / RAW_CALIBRATED_FOLDER_NAME
 
     ref_image_path = config["reference"]["image"]
-    ref_file_path = config["reference"]["file"]
-    reference_log_file = ReferenceLogFile(ref_file_path)
     rows, cols = config["image"]["rows"], config["image"]["columns"]
     no_of_images_to_combine = config["processing"]["no_of_images_to_combine"]
 
-    crop_region = config["image"]["crop_region"]
     save_aligned_images = config["output"]["save_aligned"]
     save_calibrated_images = config["output"]["save_calibrated"]
-    radii_of_extraction = config["processing"]["radii_of_extraction"]
+    # Results of the run before coma correction are only needed to pick the
+    # raw images for the coma correction models and the transformations of the
+    # raw images, both of which we keep in memory. So when they aren't to be
+    # saved, we don't write any files or extract stars for that run.
+    is_unsaved_precoma_run = coma_correction_fn is None and not config["output"]["save_precoma"]
+    if is_unsaved_precoma_run:
+        save_aligned_images = save_calibrated_images = False
+    sampled_coma_prepass = config["processing"]["coma_prepass"] == COMA_PREPASS_SAMPLED
+    alignment_method = config["processing"]["alignment_method"]
+    warp_backend = config["processing"]["warp_backend"]
 
     from_index = nth_combined_image * no_of_images_to_combine
     # Note the to_index is exclusive
@@ -82,34 +141,40 @@ def align_combined_extract(  # noqa
     # and the no_of_images_to_combine. The later is the number of raw images
     # that are combined together to form on aligned combined image
 
-    # Get coma corrected data when the correction function is defined
-    if coma_correction_fn is None:
+    # Data of the raw images that were prefetched are already in memory
+    with timings.time(READING_STAGE) as counts:
         images_data = [raw_image_file.data() for raw_image_file in raw_images[from_index:to_index]]
-    else:
-        images_data = list(map(coma_correction_fn, raw_images[from_index:to_index]))
-
-    # Ensure that image dimensions are as specified by rows and cols
-    # If there's extra noise cols or rows, we crop them
-    images_data = [crop(matrix, rows, cols) for matrix in images_data]
-
-    # Calibrate images
-    images_data = calibrateImages(
-        masterDarkData=master_dark_data,
-        masterFlatData=master_flat_data,
-        listOfImagesData=images_data,
-    )
-
-    if save_calibrated_images:
-        for index, raw_image_index in enumerate(range(from_index, to_index)):
-            raw_img = raw_images[raw_image_index]
-            calibrated_image = RawImageFile(RAW_CALIBRATED_OUTPUT_FOLDER / raw_img.path().name)
-            calibrated_image.create_file(images_data[index], raw_img)
-            logger.info(f"Saving calibrated image. {raw_image_index}")
+        counts["frames"] += len(images_data)
+        counts["bytes_read"] += sum(
+            file_size(raw_image_file.path()) for raw_image_file in raw_images[from_index:to_index]
+        )
 
-    # Fill out the cropped regions with value of 1
-    # Note, it's important to fill after the calibration step
-    if len(crop_region) > 0:
-        images_data = [fillMatrix(matrix, crop_region, 1) for matrix in images_data]
+    # Get coma corrected data when the correction function is defined
+    if coma_correction_fn is not None:
+        with timings.time(COMA_CORRECTION_STAGE) as counts:
+            images_data = list(map(coma_correction_fn, raw_images[from_index:to_index]))
+            counts["frames"] += len(images_data)
+
+    with timings.time(CALIBRATION_STAGE) as counts:
+        # Ensure that image dimensions are as specified by rows and cols
+        # If there's extra noise cols or rows, we crop them
+        images_data = [crop(matrix, rows, cols) for matrix in images_data]
+
+        # Calibrate images
+        images_data = [calibration_context.calibrate(matrix) for matrix in images_data]
+        counts["frames"] += len(images_data)
+
+        if save_calibrated_images:
+            for index, raw_image_index in enumerate(range(from_index, to_index)):
+                raw_img = raw_images[raw_image_index]
+                calibrated_image = RawImageFile(RAW_CALIBRATED_OUTPUT_FOLDER / raw_img.path().name)
+                calibrated_image.create_file(images_data[index], raw_img)
+                counts["bytes_written"] += file_size(calibrated_image.path())
+                logger.info(f"Saving calibrated image. {raw_image_index}")
+
+        # Fill out the cropped regions with value of 1
+        # Note, it's important to fill after the calibration step
+        images_data = [calibration_context.fill_crop_region(matrix) for matrix in images_data]
 
     # Alignment
     # We want to discard this set of images if any one image in this set cannot be aligned
@@ -127,60 +192,88 @@ def align_combined_extract(  # noqa
     # 3. Multiply the combined_image_data with m to wash out edges.
     m = np.ones((1024, 1024))
 
-    for index, image_data in enumerate(images_data):
-        raw_image_to_align = raw_images[from_index + index]
-        raw_image_to_align_name = raw_image_to_align.path().name
-        try:
-            # If run as part of coma correction, we want to use existing image alignment
-            # else run normally, and save the alignment statistics
-            if coma_correction_fn is None:
-                aligned_data, statistics = image_alignment(image_data, ref_image_path)
-                alignment_matrices_for_raw_images[str(raw_image_to_align)] = statistics
-            else:
-                stats = alignment_matrices_for_raw_images[str(raw_image_to_align)]
-                logger.info(
-                    f"Using preexisting alignemnt stats {stats} to align {raw_image_to_align}"
-                )
-                aligned_data, statistics = image_alignment_with_given_transformation(
-                    image_data, stats
+    with timings.time(ALIGNMENT_STAGE) as counts:
+        for index, image_data in enumerate(images_data):
+            raw_image_to_align = raw_images[from_index + index]
+            raw_image_to_align_name = raw_image_to_align.path().name
+            try:
+                # If run as part of coma correction, we want to use existing image alignment
+                # else run normally, and save the alignment statistics
+                # When coma correction models are made from a sample of combinations,
+                # most images won't have been aligned before the coma corrected run
+                # Images aligned when the night was processed before (see
+                # `AlignmentTransformsFile`) aren't aligned again
+                is_known = str(raw_image_to_align) in alignment_matrices_for_raw_images
+                if not is_known and not find_transformations:
+                    raise CouldNotAlignException("Transformation of the image isn't known")
+                if (coma_correction_fn is None or sampled_coma_prepass) and not is_known:
+                    predicted_transformation = None
+                    if alignment_method == ALIGNMENT_METHOD_SEEDED:
+                        predicted_transformation = predict_transformation(
+                            [
+                                (observation_time(raw_image), stats)
+                                for raw_image, stats, _ in result["alignment_stats"]
+                            ],
+                            observation_time(raw_image_to_align),
+                        )
+                    if alignment_method == ALIGNMENT_METHOD_CATALOG:
+                        aligner = catalog_aligner(config["reference"]["file"], ref_image_path)
+                    elif alignment_method == ALIGNMENT_METHOD_PHASE:
+                        aligner = phase_correlation_aligner(
+                            ref_image_path, config["processing"]["phase_correlation_max_rotation"]
+                        )
+                    else:
+                        aligner = reference_aligner(ref_image_path)
+                    aligned_data, statistics, residual = aligner.align(
+                        image_data, predicted_transformation, warp_backend
+                    )
+                else:
+                    stats, residual = alignment_matrices_for_raw_images[str(raw_image_to_align)]
+                    logger.info(
+                        f"Using preexisting alignemnt stats {stats} to align {raw_image_to_align}"
+                    )
+                    aligned_data, statistics = image_alignment_with_given_transformation(
+                        image_data, stats, warp_backend
+                    )
+
+                aligned_images_data.append(aligned_data)
+                counts["frames"] += 1
+                # We add the transformation statistics to the alignment stats
+                # file Information of the file that can't be aligned isn't
+                # written only in the logfile. This is intended so that we can
+                # easily process the alignment stats file if we keep it in a TSV
+                # like format
+
+                # Note that we're down-scaling the matrix dtype from float to int32 for
+                # support in the image viewing softwares. For the combination step though
+                # we are using the more precise float data. This means that if you read
+                # the data of the aligned images from the fit file and combined them yourself
+                # that is going to be off by a small amount that the data in the aligned
+                # combined image.
+                aligned_image = RawImageFile(
+                    JUST_ALIGNED_NOT_COMBINED_OUTPUT_FOLDER / raw_image_to_align_name
                 )
 
-            aligned_images_data.append(aligned_data)
-            # We add the transformation statistics to the alignment stats
-            # file Information of the file that can't be aligned isn't
-            # written only in the logfile. This is intended so that we can
-            # easily process the alignment stats file if we keep it in a TSV
-            # like format
-
-            # Note that we're down-scaling the matrix dtype from float to int32 for
-            # support in the image viewing softwares. For the combination step though
-            # we are using the more precise float data. This means that if you read
-            # the data of the aligned images from the fit file and combined them yourself
-            # that is going to be off by a small amount that the data in the aligned
-            # combined image.
-            aligned_image = RawImageFile(
-                JUST_ALIGNED_NOT_COMBINED_OUTPUT_FOLDER / raw_image_to_align_name
-            )
-
-            if save_aligned_images:
-                aligned_image.create_file(aligned_data.astype("int32"), raw_image_to_align)
-
-            alignment_stats_file.add_record(raw_image_to_align_name, statistics)
-            logger.info(f"Aligned {raw_image_to_align_name}")
-        except CouldNotAlignException as e:
-            logger.error(f"Could not align image {raw_image_to_align}")
-            logger.error(f"Skipping combination {from_index}-{to_index}")
-            logger.error(f"{e}")
-            break
-        except Exception as e:
-            logger.error(f"Could not align image {raw_image_to_align}")
-            logger.error(f"Skipping combination {from_index}-{to_index}")
-            logger.error(f"{e}")
-            break
-
-        aligned_areas = aligned_data.copy()
-        aligned_areas[aligned_areas > 0] = 1
-        m *= aligned_areas
+                if save_aligned_images:
+                    aligned_image.create_file(aligned_data.astype("int32"), raw_image_to_align)
+                    counts["bytes_written"] += file_size(aligned_image.path())
+
+                result["alignment_stats"].append((raw_image_to_align, statistics, residual))
+                logger.info(f"Aligned {raw_image_to_align_name}")
+            except CouldNotAlignException as e:
+                logger.error(f"Could not align image {raw_image_to_align}")
+                logger.error(f"Skipping combination {from_index}-{to_index}")
+                logger.error(f"{e}")
+                break
+            except Exception as e:
+                logger.error(f"Could not align image {raw_image_to_align}")
+                logger.error(f"Skipping combination {from_index}-{to_index}")
+                logger.error(f"{e}")
+                break
+
+            aligned_areas = aligned_data.copy()
+            aligned_areas[aligned_areas > 0] = 1
+            m *= aligned_areas
 
     # We proceed to next set of images if the alignment wasn't successful for any one
     # image in the combination set. We now this by checking no of aligned images.
@@ -189,7 +282,7 @@ def align_combined_extract(  # noqa
             f"Length of aligned images {len(aligned_images_data)}. No of images to combined: {no_of_images_to_combine}"  # noqa
         )
         logger.warning("Skipping align-combine-extract")
-        return
+        return result
 
     # If the images to combine are non sequential. For example, images 101, 102, 115, 116, ...
     # then we don't want to combine them as they're from different sections of the night
@@ -201,47 +294,97 @@ def align_combined_extract(  # noqa
         logger.warning(
             f"skipping combination because missing raw images. start: {first_raw_image} end: {last_raw_image} where no. of images to combine is {no_of_images_to_combine}"
         )
-        return
+        return result
+
+    if is_unsaved_precoma_run:
+        return unsaved_precoma_result(
+            result, raw_images, from_index, to_index, image_duration, logger
+        )
 
     # Combination
-    combined_images_data = np.sum(aligned_images_data, axis=0)
-    combined_images_data *= m  # Wash out the edges
-    logger.info("Washing out the edges in this set of combined image")
-    logger.info("Combined")
+    with timings.time(COMBINATION_STAGE) as counts:
+        # Images aligned with OpenCV are float32, but are combined in float64
+        combined_images_data = np.sum(aligned_images_data, axis=0, dtype="float")
+        combined_images_data *= m  # Wash out the edges
+        logger.info("Washing out the edges in this set of combined image")
+        logger.info("Combined")
+
+        # We take the middle image from the combination as the sample This is
+        # the image whose header will be copied to the combined image fit file
+        midpoint_index = from_index + no_of_images_to_combine // 2
+        sample_raw_image_file = raw_images[midpoint_index]
+        logger.info(f"Using {sample_raw_image_file} as sample")
+
+        aligned_combined_image_number = to_index // no_of_images_to_combine
+        logger.info(f"Aligned combined image number {aligned_combined_image_number}")
+        aligned_combined_file_name = AlignedCombinedFile.generate_file_name(
+            image_duration, aligned_combined_image_number
+        )
+        logger.info(f"Aligned combined image name {aligned_combined_file_name}")
+        aligned_combined_file = AlignedCombinedFile(
+            ALIGNED_COMBINED_OUTPUT_FOLDER / aligned_combined_file_name
+        )
+        # Set the raw images used to create this Aligned Combined image
+        aligned_combined_file.set_raw_images(raw_images[from_index:to_index])
+        result["aligned_combined_file"] = aligned_combined_file
+
+        # Image viewing softwares like Astromagic and Fits Liberator don't work
+        # if the image data type is float, for some reason that we don't know.
+        # So we're setting the datatype to int32 which has enough precision for
+        # us.
+        aligned_combined_file.create_file(
+            combined_images_data.astype("int32"), sample_raw_image_file
+        )
+        counts["frames"] += 1
+        counts["bytes_written"] += file_size(aligned_combined_file.path())
+        logger.info(f"Set {aligned_combined_file_name} dtype to int32")
+        logger.info(f"Combined images {from_index}-{to_index}")
 
-    # We take the middle image from the combination as the sample This is
-    # the image whose header will be copied to the combined image fit file
-    midpoint_index = from_index + no_of_images_to_combine // 2
-    sample_raw_image_file = raw_images[midpoint_index]
-    logger.info(f"Using {sample_raw_image_file} as sample")
+    # Extraction
+    with timings.time(EXTRACTION_STAGE) as counts:
+        result["log_file_combined_file"] = extract_combined_image(
+            config,
+            night,
+            LOG_FILES_COMBINED_OUTPUT_FOLDER,
+            night_date,
+            image_duration,
+            aligned_combined_file,
+            combined_images_data,
+        )
+        counts["frames"] += 1
+        counts["bytes_written"] += file_size(result["log_file_combined_file"].path())
+    logger.info(f"Extraction from combination {from_index}-{to_index} completed")
 
-    aligned_combined_image_number = to_index // no_of_images_to_combine
-    logger.info(f"Aligned combined image number {aligned_combined_image_number}")
-    aligned_combined_file_name = AlignedCombinedFile.generate_file_name(
-        image_duration, aligned_combined_image_number
-    )
-    logger.info(f"Aligned combined image name {aligned_combined_file_name}")
-    aligned_combined_file = AlignedCombinedFile(
-        ALIGNED_COMBINED_OUTPUT_FOLDER / aligned_combined_file_name
-    )
-    # Set the raw images used to create this Aligned Combined image
-    aligned_combined_file.set_raw_images(raw_images[from_index:to_index])
-    aligned_combined_files.append(aligned_combined_file)
+    # Performance
+    # Free data from raw images for improving memory usage
+    for raw_img in raw_images[from_index:to_index]:
+        raw_img.clear()
 
-    # Image viewing softwares like Astromagic and Fits Liberator don't work
-    # if the image data type is float, for some reason that we don't know.
-    # So we're setting the datatype to int32 which has enough precision for
-    # us.
-    aligned_combined_file.create_file(combined_images_data.astype("int32"), sample_raw_image_file)
-    logger.info(f"Set {aligned_combined_file_name} dtype to int32")
-    logger.info(f"Combined images {from_index}-{to_index}")
+    return result
+
+
+def extract_combined_image(
+    config: Config,
+    night: ConfigInputNight,
+    log_files_combined_folder: Path,
+    night_date,
+    image_duration,
+    aligned_combined_file: AlignedCombinedFile,
+    combined_images_data,
+) -> LogFileCombinedFile:
+    """
+    Extracts stars from the `combined_images_data` of the `aligned_combined_file`
+    and returns the log file combined file they're written to
+    """
+    logger = logging.getLogger("LOGGER_" + str(night_date))
+    NIGHT_INPUT_IMAGES_FOLDER = night["path"] / M23_RAW_IMAGES_FOLDER_NAME
+    no_of_images_to_combine = config["processing"]["no_of_images_to_combine"]
 
-    # Extraction
     log_file_combined_file_name = LogFileCombinedFile.generate_file_name(
-        night_date, aligned_combined_image_number, image_duration
+        night_date, aligned_combined_file.image_number(), image_duration
     )
     log_file_combined_file = LogFileCombinedFile(
-        LOG_FILES_COMBINED_OUTPUT_FOLDER / log_file_combined_file_name
+        log_files_combined_folder / log_file_combined_file_name
     )
 
     date_time_to_use = get_datetime_to_use(
@@ -251,20 +394,138 @@ def align_combined_extract(  # noqa
 
     extract_stars(
         combined_images_data,
-        reference_log_file,
-        radii_of_extraction,
+        ReferenceLogFile(config["reference"]["file"]),
+        config["processing"]["radii_of_extraction"],
         log_file_combined_file,
         aligned_combined_file,
         date_time_to_use,
     )
+    return log_file_combined_file
 
-    logger.info(f"Extraction from combination {from_index}-{to_index} completed")
-    log_files_to_normalize.append(log_file_combined_file)
 
-    # Performance
-    # Free data from raw images for improving memory usage
+def unsaved_precoma_result(
+    result: AlignCombineExtractResult,
+    raw_images: List[RawImageFile],
+    from_index: int,
+    to_index: int,
+    image_duration,
+    logger,
+) -> AlignCombineExtractResult:
+    """
+    Completes `result` of a successfully aligned combination in a run before
+    coma correction without combining the images, writing the aligned combined
+    file or extracting stars from it. The aligned combined file in the result
+    is never created, but it knows its raw images and has the header the file
+    would've had, which is all that the coma correction needs.
+    """
+    no_of_images_to_combine = to_index - from_index
+    sample_raw_image_file = raw_images[from_index + no_of_images_to_combine // 2]
+    aligned_combined_image_number = to_index // no_of_images_to_combine
+    aligned_combined_file = AlignedCombinedFile(
+        AlignedCombinedFile.generate_file_name(image_duration, aligned_combined_image_number)
+    )
+    aligned_combined_file.set_raw_images(raw_images[from_index:to_index])
+    aligned_combined_file.set_header_from(sample_raw_image_file)
+    result["aligned_combined_file"] = aligned_combined_file
+    logger.info(f"Aligned images {from_index}-{to_index}, not saving pre coma correction results")
+
     for raw_img in raw_images[from_index:to_index]:
         raw_img.clear()
+    return result
+
+
+def manifest_record_for_result(
+    result: AlignCombineExtractResult, raw_images: List[RawImageFile]
+) -> Dict:
+    """
+    Returns the record of the align combine extract `result` to save in the
+    processing manifest (see `ProcessingManifestFile`). `raw_images` are the
+    raw images of the combination.
+    """
+    record = {
+        "nth_combined_image": result["nth_combined_image"],
+        "raw_images": [raw_image.path().name for raw_image in raw_images],
+        "alignment_stats": [
+            [raw_image.path().name, list(statistics), residual]
+            for raw_image, statistics, residual in result["alignment_stats"]
+        ],
+        "aligned_combined_file": None,
+        "log_file_combined_file": None,
+    }
+    if aligned_combined_file := result.get("aligned_combined_file"):
+        record["aligned_combined_file"] = str(aligned_combined_file.path())
+    if log_file_combined_file := result.get("log_file_combined_file"):
+        record["log_file_combined_file"] = str(log_file_combined_file.path())
+    return record
+
+
+def result_from_manifest_record(
+    record: Dict, raw_images: List[RawImageFile], include_log_file=True
+) -> AlignCombineExtractResult | None:
+    """
+    Returns the align combine extract result saved as `record` in the processing
+    manifest if it's still valid for the combination of `raw_images`, that is,
+    the combination has the same raw images and the files produced by it exist.
+    Returns None otherwise.
+
+    If `include_log_file` is False, the log file combined file isn't required
+    to exist and isn't included in the result, which is useful when stars are
+    to be extracted again from the aligned combined file.
+    """
+    if record["raw_images"] != [raw_image.path().name for raw_image in raw_images]:
+        return None
+    aligned_combined_path = record["aligned_combined_file"]
+    log_file_combined_path = record["log_file_combined_file"]
+    # Aligned combined files are written only when the log files combined are,
+    # see `unsaved_precoma_result`
+    if log_file_combined_path is not None:
+        if not Path(aligned_combined_path).exists():
+            return None
+        if include_log_file and not Path(log_file_combined_path).exists():
+            return None
+
+    raw_image_for_name = {raw_image.path().name: raw_image for raw_image in raw_images}
+    result: AlignCombineExtractResult = {
+        "nth_combined_image": record["nth_combined_image"],
+        "alignment_stats": [
+            # Records made before residuals were recorded don't have them
+            (raw_image_for_name[name], tuple(statistics), residual[0] if residual else None)
+            for name, statistics, *residual in record["alignment_stats"]
+        ],
+    }
+    if aligned_combined_path is not None:
+        aligned_combined_file = AlignedCombinedFile(aligned_combined_path)
+        aligned_combined_file.set_raw_images(raw_images)
+        # This is the header the aligned combined file is created with
+        aligned_combined_file.set_header_from(raw_images[len(raw_images) // 2])
+        result["aligned_combined_file"] = aligned_combined_file
+    if log_file_combined_path is not None and include_log_file:
+        result["log_file_combined_file"] = LogFileCombinedFile(log_file_combined_path)
+    return result
+
+
+def alignment_transforms_key(config: Config) -> Tuple[str, str]:
+    """
+    Returns the hash of the reference image and the alignment method with which
+    the transformations found when processing with `config` are stored in the
+    alignment transforms file (see `AlignmentTransformsFile`)
+    """
+    alignment_method = config["processing"]["alignment_method"]
+    if alignment_method == ALIGNMENT_METHOD_PHASE:
+        alignment_method += f" {config['processing']['phase_correlation_max_rotation']}"
+    elif alignment_method == ALIGNMENT_METHOD_CATALOG:
+        alignment_method += f" {file_hash(config['reference']['file'])}"
+    return file_hash(config["reference"]["image"]), alignment_method
+
+
+def observation_time(raw_image: RawImageFile) -> datetime | None:
+    """
+    Returns the time `raw_image` was observed, or None if it isn't in its header
+    """
+    try:
+        return raw_image.datetime()
+    except (AttributeError, ValueError):
+        return None
 
 
 def get_datetime_to_use(
@@ -305,3 +566,67 @@ def get_datetime_to_use(
         return datetime_in_aligned_combined.strftime(datetime_format)
     else:
         return ""
+
+
+# Arguments to `align_combined_extract` that are common to all combinations of
+# a night. These are set once per worker process by `_init_worker` so that
+# large objects like the master dark and flat aren't sent with every task.
+_worker_kwargs = {}
+
+
+def _init_worker(kwargs, log_file_path: Path):
+    _worker_kwargs.clear()
+    _worker_kwargs.update(kwargs)
+    add_worker_logger_handlers(kwargs["night_date"], log_file_path)
+
+
+def add_worker_logger_handlers(night_date, log_file_path: Path):
+    """
+    Adds handlers to the logger of the night in a worker process, if it
+    doesn't already have them
+    """
+    # Worker processes that aren't forked from the night's process (for
+    # example on Windows) don't have the handlers of the night's logger
+    logger = logging.getLogger("LOGGER_" + str(night_date))
+    if not logger.handlers:
+        logger.setLevel(logging.INFO)
+        formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        ch = logging.FileHandler(log_file_path)
+        ch.setFormatter(formatter)
+        logger.addHandler(ch)
+        ch2 = logging.StreamHandler(sys.stdout)
+        ch2.setFormatter(formatter)
+        logger.addHandler(ch2)
+
+
+def _align_combined_extract_worker(nth_combined_image):
+    try:
+        result = align_combined_extract(nth_combined_image=nth_combined_image, **_worker_kwargs)
+        log_peak_memory_usage(logging.getLogger("LOGGER_" + str(_worker_kwargs["night_date"])))
+        return nth_combined_image, result, None
+    except Exception:
+        return nth_combined_image, None, traceback.format_exc()
+
+
+def align_combined_extract_in_parallel(
+    no_of_processes: int,
+    nth_combined_images: Iterable[int],
+    log_file_path: Path,
+    **kwargs,
+) -> Iterator[Tuple[int, AlignCombineExtractResult | None, str | None]]:
+    """
+    Runs `align_combined_extract` for each of `nth_combined_images` in a pool of
+    `no_of_processes` processes. `kwargs` are the arguments to
+    `align_combined_extract` other than `nth_combined_image`.
+
+    Yields a tuple of (nth_combined_image, result, traceback) in the order of
+    `nth_combined_images` regardless of the order in which the combinations
+    finish. The result is None and traceback is the formatted exception if
+    processing the combination raised an exception.
+    """
+    with mp.Pool(
+        no_of_processes,
+        initializer=_init_worker,
+        initargs=(kwargs, log_file_path),
+    ) as p:
+        yield from p.imap(_align_combined_extract_worker, nth_combined_images)
@@ -7,11 +7,23 @@ from typing import Callable, Dict, List, TypedDict
 
 import toml
 from m23.constants import (
+    ALIGNMENT_METHOD_ASTROALIGN,
+    ALIGNMENT_METHOD_CATALOG,
+    ALIGNMENT_METHOD_PHASE,
+    ALIGNMENT_METHOD_SEEDED,
     CAMERA_CHANGE_2022_DATE,
+    COMA_PREPASS_FULL,
+    COMA_PREPASS_SAMPLED,
     DEFAULT_CPU_FRACTION_USAGE,
+    DEFAULT_PHASE_CORRELATION_MAX_ROTATION,
+    DEFAULT_PREFETCH_MEMORY_GB,
     INPUT_CALIBRATION_FOLDER_NAME,
     M23_RAW_IMAGES_FOLDER_NAME,
+    SCHEDULER_GLOBAL,
+    SCHEDULER_NIGHTS,
     TYPICAL_NEW_CAMERA_CROP_REGION,
+    WARP_BACKEND_OPENCV,
+    WARP_BACKEND_SKIMAGE,
 )
 from m23.exceptions import InvalidDatetimeInConfig
 from m23.file.log_file_combined_file import LogFileCombinedFile
@@ -40,6 +52,15 @@ class ConfigProcessing(TypedDict):
     yfwhm_target: float
     dark_prefix: NotRequired[str]
     cpu_fraction: NotRequired[float]
+    combination_cpu_fraction: NotRequired[float]
+    prefetch_combinations: NotRequired[int]
+    prefetch_memory_gb: NotRequired[float]
+    max_memory_gb: NotRequired[float]
+    coma_prepass: NotRequired[str]
+    alignment_method: NotRequired[str]
+    phase_correlation_max_rotation: NotRequired[float]
+    warp_backend: NotRequired[str]
+    scheduler: NotRequired[str]
 
 
 class ConfigInputNight(TypedDict):
@@ -66,6 +87,7 @@ class ConfigOutput(TypedDict):
     path: str | Path
     save_aligned: NotRequired[bool]
     save_calibrated: NotRequired[bool]
+    save_precoma: NotRequired[bool]
 
 
 class ConfigDateTime(TypedDict):
@@ -121,6 +143,10 @@ def create_processing_config(config_dict: Config) -> Config:  # noqa
     else:
         config_dict["output"]["save_calibrated"] = False
 
+    # Pre coma correction results are saved unless explicitly disabled
+    if config_dict["output"].get("save_precoma") is None:
+        config_dict["output"]["save_precoma"] = True
+
     # Convert reference file/img to Path object
     if type(config_dict["reference"]["file"]) == str:
         config_dict["reference"]["file"] = Path(config_dict["reference"]["file"])
@@ -137,6 +163,39 @@ def create_processing_config(config_dict: Config) -> Config:  # noqa
     if config_dict["processing"].get("cpu_fraction", None) is None:
         config_dict["processing"]["cpu_fraction"] = DEFAULT_CPU_FRACTION_USAGE
 
+    # Combinations within a night are processed with single processor by default
+    if config_dict["processing"].get("combination_cpu_fraction", None) is None:
+        config_dict["processing"]["combination_cpu_fraction"] = 0
+
+    # Raw images aren't read ahead by default
+    if config_dict["processing"].get("prefetch_combinations", None) is None:
+        config_dict["processing"]["prefetch_combinations"] = 0
+    if config_dict["processing"].get("prefetch_memory_gb", None) is None:
+        config_dict["processing"]["prefetch_memory_gb"] = DEFAULT_PREFETCH_MEMORY_GB
+
+    # Memory used by combinations processed at once isn't limited by default
+    if config_dict["processing"].get("max_memory_gb", None) is None:
+        config_dict["processing"]["max_memory_gb"] = 0
+
+    # By default coma correction models are made after processing the entire
+    # night without coma correction
+    if config_dict["processing"].get("coma_prepass", None) is None:
+        config_dict["processing"]["coma_prepass"] = COMA_PREPASS_FULL
+
+    # By default the transformation of each image is searched for from scratch
+    if config_dict["processing"].get("alignment_method", None) is None:
+        config_dict["processing"]["alignment_method"] = ALIGNMENT_METHOD_ASTROALIGN
+    if config_dict["processing"].get("phase_correlation_max_rotation", None) is None:
+        config_dict["processing"][
+            "phase_correlation_max_rotation"
+        ] = DEFAULT_PHASE_CORRELATION_MAX_ROTATION
+    if config_dict["processing"].get("warp_backend", None) is None:
+        config_dict["processing"]["warp_backend"] = WARP_BACKEND_SKIMAGE
+
+    # Nights are processed in parallel by default
+    if config_dict["processing"].get("scheduler", None) is None:
+        config_dict["processing"]["scheduler"] = SCHEDULER_NIGHTS
+
     # Set default darks and flats
     if config_dict["processing"].get("dark_prefix", None) is None:
         config_dict["processing"]["dark_prefix"] = "dark_"
@@ -244,7 +303,20 @@ def verify_optional_processing_options(options: Dict) -> bool:
     """
     Verifies that the optional processing options are valid
     """
-    valid_options = ["cpu_fraction", "dark_prefix", "flat_prefix"]
+    valid_options = [
+        "cpu_fraction",
+        "combination_cpu_fraction",
+        "dark_prefix",
+        "flat_prefix",
+        "prefetch_combinations",
+        "prefetch_memory_gb",
+        "max_memory_gb",
+        "coma_prepass",
+        "alignment_method",
+        "phase_correlation_max_rotation",
+        "warp_backend",
+        "scheduler",
+    ]
     for key in options.keys():
         if key not in valid_options:
             sys.stderr.write(
@@ -262,6 +334,79 @@ def verify_optional_processing_options(options: Dict) -> bool:
                 f"CPU fraction has to be a value between 0 and 1. Received: {cpu_fraction}\n"
             )
             return False
+    if combination_cpu_fraction := options.get("combination_cpu_fraction"):
+        if not 0 <= combination_cpu_fraction <= 1:
+            sys.stderr.write(
+                "Combination CPU fraction has to be a value between 0 and 1."
+                f" Received: {combination_cpu_fraction}\n"
+            )
+            return False
+    prefetch_combinations = options.get("prefetch_combinations", 0)
+    if type(prefetch_combinations) != int or prefetch_combinations < 0:
+        sys.stderr.write(
+            f"Prefetch combinations has to be a non-negative integer. Received: {prefetch_combinations}\n"  # noqa
+        )
+        return False
+    prefetch_memory_gb = options.get("prefetch_memory_gb", DEFAULT_PREFETCH_MEMORY_GB)
+    if type(prefetch_memory_gb) not in [int, float] or prefetch_memory_gb <= 0:
+        sys.stderr.write(
+            f"Prefetch memory has to be a positive number (GB). Received: {prefetch_memory_gb}\n"
+        )
+        return False
+    max_memory_gb = options.get("max_memory_gb", 0)
+    if type(max_memory_gb) not in [int, float] or max_memory_gb < 0:
+        sys.stderr.write(
+            f"Max memory has to be a non-negative number (GB). Received: {max_memory_gb}\n"
+        )
+        return False
+
+    coma_prepass = options.get("coma_prepass", COMA_PREPASS_FULL)
+    if coma_prepass not in [COMA_PREPASS_FULL, COMA_PREPASS_SAMPLED]:
+        sys.stderr.write(
+            f"Coma prepass has to be '{COMA_PREPASS_FULL}' or '{COMA_PREPASS_SAMPLED}'."
+            f" Received: {coma_prepass}\n"
+        )
+        return False
+
+    alignment_method = options.get("alignment_method", ALIGNMENT_METHOD_ASTROALIGN)
+    alignment_methods = [
+        ALIGNMENT_METHOD_ASTROALIGN,
+        ALIGNMENT_METHOD_SEEDED,
+        ALIGNMENT_METHOD_CATALOG,
+        ALIGNMENT_METHOD_PHASE,
+    ]
+    if alignment_method not in alignment_methods:
+        sys.stderr.write(
+            f"Alignment method has to be one of {alignment_methods}."
+            f" Received: {alignment_method}\n"
+        )
+        return False
+
+    max_rotation = options.get(
+        "phase_correlation_max_rotation", DEFAULT_PHASE_CORRELATION_MAX_ROTATION
+    )
+    if type(max_rotation) not in [int, float] or max_rotation < 0:
+        sys.stderr.write(
+            "Phase correlation max rotation has to be a non-negative number (radians)."
+            f" Received: {max_rotation}\n"
+        )
+        return False
+
+    warp_backend = options.get("warp_backend", WARP_BACKEND_SKIMAGE)
+    if warp_backend not in [WARP_BACKEND_SKIMAGE, WARP_BACKEND_OPENCV]:
+        sys.stderr.write(
+            f"Warp backend has to be '{WARP_BACKEND_SKIMAGE}' or '{WARP_BACKEND_OPENCV}'."
+            f" Received: {warp_backend}\n"
+        )
+        return False
+
+    scheduler = options.get("scheduler", SCHEDULER_NIGHTS)
+    if scheduler not in [SCHEDULER_NIGHTS, SCHEDULER_GLOBAL]:
+        sys.stderr.write(
+            f"Scheduler has to be '{SCHEDULER_NIGHTS}' or '{SCHEDULER_GLOBAL}'."
+            f" Received: {scheduler}\n"
+        )
+        return False
 
     dark_prefix = options.get("dark_prefix", "dark_")
 
@@ -292,11 +437,15 @@ def is_night_name_valid(NIGHT_INPUT_PATH: Path):
         return False
 
 
-def validate_night(night: ConfigInputNight, image_duration: float) -> bool:  # noqa
+def validate_night(  # noqa
+    night: ConfigInputNight, image_duration: float, live=False
+) -> bool:
     """
     Checks whether the input configuration provided for night is valid.
     We check whether the input folders follow the required conventions,
     whether the right files are present and more.
+    If `live` is True, the darks and raw images of the night needn't exist yet
+    as they're processed as they're written. See `m23.processor.watch`.
     """
     try:
         NIGHT_INPUT_PATH = Path(night["path"])
@@ -335,7 +484,7 @@ def validate_night(night: ConfigInputNight, image_duration: float) -> bool:  # n
         return False
 
     # Check for darks
-    if len(list(get_darks(CALIBRATION_FOLDER_PATH, image_duration))) == 0:
+    if not live and len(list(get_darks(CALIBRATION_FOLDER_PATH, image_duration))) == 0:
         sys.stderr.write(
             f"Night {NIGHT_INPUT_PATH} doesn't contain darks in {CALIBRATION_FOLDER_PATH}"
             f" for image duration {image_duration}." + " Cannot continue without darks.\n"
@@ -346,7 +495,7 @@ def validate_night(night: ConfigInputNight, image_duration: float) -> bool:  # n
     try:
         # Check if the user has defined raw image prefix
         if raw_img_prefix := night.get("image_prefix"):
-            if (
+            if not live and (
                 len(
                     list(get_all_fit_files(M23_FOLDER_PATH, image_duration, prefix=raw_img_prefix))
                 )
@@ -358,7 +507,7 @@ def validate_night(night: ConfigInputNight, image_duration: float) -> bool:  # n
                 )
                 return False
         else:
-            if len(list(get_raw_images(M23_FOLDER_PATH, image_duration))) == 0:
+            if not live and len(list(get_raw_images(M23_FOLDER_PATH, image_duration))) == 0:
                 sys.stderr.write(
                     f"Night {NIGHT_INPUT_PATH} doesn't have raw images in {M23_FOLDER_PATH}."
                     f" for image duration {image_duration}\n"
@@ -416,11 +565,13 @@ def validate_night(night: ConfigInputNight, image_duration: float) -> bool:  # n
     return True  # Assuming we did the best we could to catch errors
 
 
-def validate_input_nights(list_of_nights: List[ConfigInputNight], image_duration: float) -> bool:
+def validate_input_nights(
+    list_of_nights: List[ConfigInputNight], image_duration: float, live=False
+) -> bool:
     """
     Returns True if input for all nights is valid, False otherwise.
     """
-    return all([validate_night(night, image_duration) for night in list_of_nights])
+    return all([validate_night(night, image_duration, live) for night in list_of_nights])
 
 
 def validate_reference_files(
@@ -475,7 +626,7 @@ def validate_datetime(time_obj):
 
 
 def verify_optional_output_options(output_options: Dict[str, any]):
-    valid_keys = ["save_aligned", "save_calibrated"]
+    valid_keys = ["save_aligned", "save_calibrated", "save_precoma"]
     for key in output_options.keys():
         if key not in valid_keys:
             sys.stderr.write(
@@ -496,6 +647,12 @@ def verify_optional_output_options(output_options: Dict[str, any]):
                 f" option found {save_calibrated}\n"
             )
             return False
+    if (save_precoma := output_options.get("save_precoma")) is not None:
+        if not isinstance(save_precoma, bool):
+            sys.stderr.write(
+                f"Expected (true/false) instance for save_precoma option found {save_precoma}\n"
+            )
+            return False
     return True
 
 
@@ -518,11 +675,13 @@ def sanity_check_no_of_images_to_combine(no_of_images_to_combine: int, image_dur
     return True
 
 
-def validate_file(file_path: Path, on_success: Callable[[Config], None]) -> None:
+def validate_file(file_path: Path, on_success: Callable[[Config], None], live=False) -> None:
     """
     This method reads data processing configuration from the file path
     provided and calls the unary function on_success if the configuration
     file is valid with the configuration dictionary (Note, *not* config file).
+    If `live` is True, the nights are validated to be processed as their
+    images are written, see `validate_night`.
     """
     if not file_path.exists() or not file_path.exists():
         raise FileNotFoundError("Cannot find configuration file")
@@ -559,7 +718,7 @@ def validate_file(file_path: Path, on_success: Callable[[Config], None]) -> None
                 and verify_optional_output_options(optional_output_options)
                 and is_valid_radii_of_extraction(radii_of_extraction)
                 and is_valid_fwhm_target(xfwhm_target, yfwhm_target)
-                and validate_input_nights(list_of_nights, image_duration)
+                and validate_input_nights(list_of_nights, image_duration, live)
                 and validate_reference_files(
                     reference_image,
                     reference_file,
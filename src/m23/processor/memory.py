@@ -0,0 +1,143 @@
+import logging
+import os
+import sys
+import threading
+
+from astropy.io.fits import Header, getheader
+from m23.processor.config_loader import Config, ConfigInputNight
+from m23.processor.night_costs import raw_image_paths
+
+try:
+    import resource
+except ImportError:
+    # The resource module isn't available on Windows
+    resource = None
+
+
+def raw_image_bytes_per_pixel(header: Header) -> int:
+    """
+    Returns the no. of bytes each pixel of the data of a raw image with
+    `header` takes in memory once it's read
+    """
+    bitpix = header.get("BITPIX", 16)
+    itemsize = abs(bitpix) // 8
+    bscale, bzero = header.get("BSCALE", 1), header.get("BZERO", 0)
+    # Unsigned integers are stored as signed integers with an offset, and are
+    # read as unsigned integers of the same size
+    if bscale == 1 and (bzero == 0 or (bitpix > 0 and bzero == 2 ** (bitpix - 1))):
+        return itemsize
+    # Other scaled data are read as floats
+    return 4 if itemsize <= 2 else 8
+
+
+def combination_memory_estimate(header: Header, no_of_images_to_combine: int) -> int:
+    """
+    Returns the estimated peak memory in bytes used to align, combine and
+    extract one combination of raw images with `header`.
+
+    For each raw image of the combination, its data, the coma corrected data
+    (float64), the calibrated data (float32) and the aligned data (float64)
+    can be in memory at once. In addition to these, a few float64 images are
+    used for aligning an image and washing out the edges of the combination.
+    """
+    pixels = header.get("NAXIS1", 0) * header.get("NAXIS2", 0)
+    bytes_per_image = raw_image_bytes_per_pixel(header) + 8 + 4 + 8
+    return pixels * (no_of_images_to_combine * bytes_per_image + 6 * 8)
+
+
+def night_combination_memory_estimate(night: ConfigInputNight, config: Config) -> int:
+    """
+    Returns the estimated peak memory in bytes used to process one
+    combination of `night`. Only the header of the first raw image is read, as
+    all raw images of a night have the same size.
+    """
+    raw_images = raw_image_paths(night, config)
+    if len(raw_images) == 0:
+        return 0
+    no_of_images_to_combine = config["processing"]["no_of_images_to_combine"]
+    return combination_memory_estimate(getheader(raw_images[0]), no_of_images_to_combine)
+
+
+def processes_within_budget(no_of_processes: int, bytes_per_process: int, max_bytes: int) -> int:
+    """
+    Returns the no. of processes, at most `no_of_processes`, that can each use
+    `bytes_per_process` at once without exceeding `max_bytes`. At least one
+    process is always allowed. A `max_bytes` of 0 means there's no limit.
+    """
+    if max_bytes <= 0 or bytes_per_process <= 0:
+        return no_of_processes
+    return max(1, min(no_of_processes, max_bytes // bytes_per_process))
+
+
+class MemoryBudget:
+    """
+    Budget of memory shared by threads that submit work to processes, so that
+    work is only started while the estimated memory of the work in progress
+    fits within the budget.
+
+    Usage:
+        budget = MemoryBudget(8 * 1024**3)
+        budget.acquire(estimate)
+        # Submit the work, and once it's completed
+        budget.release(estimate)
+
+    Work is always admitted when nothing else is in progress, even when its
+    estimate alone exceeds the budget, as it would never be admitted otherwise.
+    A budget of 0 bytes means there's no limit.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.__max_bytes = max_bytes
+        self.__bytes_in_use = 0
+        self.__condition = threading.Condition()
+
+    def _fits(self, no_of_bytes: int) -> bool:
+        return (
+            self.__max_bytes <= 0
+            or self.__bytes_in_use == 0
+            or self.__bytes_in_use + no_of_bytes <= self.__max_bytes
+        )
+
+    def acquire(self, no_of_bytes: int, blocking=True) -> bool:
+        """
+        Reserves `no_of_bytes` of the budget, waiting until they're available
+        if `blocking` is True. Returns whether the bytes are reserved.
+        """
+        with self.__condition:
+            if blocking:
+                self.__condition.wait_for(lambda: self._fits(no_of_bytes))
+            elif not self._fits(no_of_bytes):
+                return False
+            self.__bytes_in_use += no_of_bytes
+            return True
+
+    def release(self, no_of_bytes: int) -> None:
+        """
+        Returns `no_of_bytes` reserved with `acquire` to the budget
+        """
+        with self.__condition:
+            self.__bytes_in_use -= no_of_bytes
+            self.__condition.notify_all()
+
+    def bytes_in_use(self) -> int:
+        return self.__bytes_in_use
+
+
+def peak_memory_usage() -> int | None:
+    """
+    Returns the peak resident memory in bytes used by the current process, or
+    None if it can't be found on this platform
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # The peak is in bytes on macOS and in kilobytes on Linux
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def log_peak_memory_usage(logger: logging.Logger) -> None:
+    """
+    Logs the peak resident memory used by the current process, if it's known
+    """
+    if (peak := peak_memory_usage()) is not None:
+        logger.info(f"Peak memory usage of process {os.getpid()}: {peak / 1024**2:.0f} MB")
@@ -0,0 +1,95 @@
+import time
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, Hashable, Iterable, List, TypeVar
+
+from astropy.io.fits import getheader
+from m23.constants import M23_RAW_IMAGES_FOLDER_NAME
+from m23.processor.config_loader import Config, ConfigInputNight
+from m23.processor.renormalize_config_loader import RenormalizeConfigNight
+from m23.utils import get_all_fit_files, get_raw_images
+
+T = TypeVar("T")
+
+
+def raw_image_paths(night: ConfigInputNight, config: Config) -> List[Path]:
+    """
+    Returns the paths of the raw images of `night` that are processed
+    """
+    NIGHT_INPUT_IMAGES_FOLDER = night["path"] / M23_RAW_IMAGES_FOLDER_NAME
+    image_duration = config["processing"]["image_duration"]
+    if raw_img_prefix := night.get("image_prefix"):
+        raw_images = list(
+            get_all_fit_files(NIGHT_INPUT_IMAGES_FOLDER, image_duration, prefix=raw_img_prefix)
+        )
+    else:
+        raw_images = [
+            raw_image.path()
+            for raw_image in get_raw_images(NIGHT_INPUT_IMAGES_FOLDER, image_duration)
+        ]
+    return raw_images
+
+
+def processing_cost(night: ConfigInputNight, config: Config) -> int:
+    """
+    Returns the estimated cost of processing `night`, which is the number of
+    pixels in all of its raw images. Only the header of the first raw image is
+    read, as all raw images of a night have the same size.
+    """
+    raw_images = raw_image_paths(night, config)
+    if len(raw_images) == 0:
+        return 0
+    header = getheader(raw_images[0])
+    return len(raw_images) * header.get("NAXIS1", 0) * header.get("NAXIS2", 0)
+
+
+def renormalization_cost(night: RenormalizeConfigNight) -> int:
+    """
+    Returns the estimated cost of renormalizing `night`, which is the number of
+    log files combined to normalize
+    """
+    return len(night["files_to_use"])
+
+
+def largest_first(items: Iterable[T], costs: List[int]) -> List[T]:
+    """
+    Returns `items` sorted by their `costs` in descending order. Processing
+    the largest items first in parallel keeps a large item from being the only
+    one processed at the end.
+    """
+    items_and_costs = sorted(zip(items, costs), key=lambda item_and_cost: -item_and_cost[1])
+    return [item for item, _ in items_and_costs]
+
+
+class NightsProgress:
+    """
+    Prints the progress of processing nights, along with the estimated time
+    to complete the remaining nights based on their cost
+    """
+
+    def __init__(self, costs: Dict[Hashable, int]) -> None:
+        """
+        param: costs: Cost of each night keyed by a key that identifies the night
+        """
+        self.__costs = costs
+        self.__total_cost = sum(costs.values())
+        self.__completed_cost = 0
+        self.__no_of_completed = 0
+        self.__start = time.monotonic()
+
+    def completed(self, key: Hashable) -> None:
+        """
+        Records that the night identified by `key` is completed and prints the progress
+        """
+        self.__no_of_completed += 1
+        self.__completed_cost += self.__costs[key]
+        elapsed = time.monotonic() - self.__start
+        message = (
+            f"Completed {key} ({self.__no_of_completed}/{len(self.__costs)})."
+            f" Elapsed: {timedelta(seconds=round(elapsed))}."
+        )
+        remaining_cost = self.__total_cost - self.__completed_cost
+        if self.__completed_cost > 0 and self.__no_of_completed < len(self.__costs):
+            eta = elapsed * remaining_cost / self.__completed_cost
+            message += f" ETA: {timedelta(seconds=round(eta))}"
+        print(message)
@@ -2,22 +2,33 @@ import logging
 import os
 import shutil
 import sys
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date
+from functools import partial
 from pathlib import Path
-from typing import Dict, Iterable, List
+from typing import Dict, Iterable, List, Tuple
 
 import multiprocess as mp
 import toml
 from astropy.io.fits import getdata
 from m23 import __version__
+from m23.calibrate.calibration import CalibrationContext
 from m23.calibrate.master_calibrate import makeMasterDark
 from m23.charts import draw_normfactors_chart
-from m23.coma import coma_correction, precoma_folder_name
+from m23.coma import (
+    coma_correction,
+    load_coma_correction,
+    precoma_folder_name,
+    sample_combinations_for_coma_groups,
+)
 from m23.constants import (
     ALIGNED_COMBINED_FOLDER_NAME,
     ALIGNED_FOLDER_NAME,
+    ALIGNMENT_TRANSFORMS_FILE_NAME,
     COMA_CORRECTION_MODELS,
+    COMA_PREPASS_SAMPLED,
     CONFIG_FILE_NAME,
     FLUX_LOGS_COMBINED_FOLDER_NAME,
     INPUT_CALIBRATION_FOLDER_NAME,
@@ -25,24 +36,59 @@ from m23.constants import (
     M23_RAW_IMAGES_FOLDER_NAME,
     MASTER_DARK_NAME,
     OUTPUT_CALIBRATION_FOLDER_NAME,
+    PROCESSING_MANIFEST_FILE_NAME,
     RAW_CALIBRATED_FOLDER_NAME,
+    SCHEDULER_GLOBAL,
+    SCHEDULER_MAX_NIGHTS_IN_PROGRESS,
     SKY_BG_BOX_REGION_SIZE,
     SKY_BG_FOLDER_NAME,
+    TIMINGS_FILE_NAME,
     AlignmentTransformationType,
 )
 from m23.exceptions import InternightException
 from m23.extract import sky_bg_average_for_all_regions
 from m23.file.aligned_combined_file import AlignedCombinedFile
 from m23.file.alignment_stats_file import AlignmentStatsFile
+from m23.file.alignment_transforms_file import AlignmentTransformsFile
 from m23.file.log_file_combined_file import LogFileCombinedFile
+from m23.file.processing_manifest_file import ProcessingManifestFile, is_made_by
 from m23.file.raw_image_file import RawImageFile
+from m23.file.raw_image_prefetcher import RawImagePrefetcher
 from m23.file.reference_log_file import ReferenceLogFile
 from m23.file.sky_bg_file import SkyBgFile
+from m23.file.timings_file import TimingsFile
 from m23.internight_normalize import internight_normalize
 from m23.matrix import crop
 from m23.norm import normalize_log_files
-from m23.processor.align_combined_extract import align_combined_extract
+from m23.processor.align_combined_extract import (
+    AlignCombineExtractResult,
+    align_combined_extract,
+    align_combined_extract_in_parallel,
+    alignment_transforms_key,
+    extract_combined_image,
+    manifest_record_for_result,
+    result_from_manifest_record,
+)
 from m23.processor.config_loader import Config, ConfigInputNight, validate_file
+from m23.processor.memory import (
+    combination_memory_estimate,
+    log_peak_memory_usage,
+    night_combination_memory_estimate,
+    processes_within_budget,
+)
+from m23.processor.night_costs import NightsProgress, largest_first, processing_cost
+from m23.processor.scheduler import CombinationScheduler
+from m23.processor.stages import (
+    ALIGNMENT_STAGE,
+    CALIBRATION_STAGE,
+    COMA_MODELS_STAGE,
+    COMBINATION_STAGE,
+    EXTRACTION_STAGE,
+    MASTER_DARK_STAGE,
+    NORMALIZATION_STAGE,
+    stage_fingerprints,
+)
+from m23.processor.timings import StageTimings, file_size
 from m23.utils import (
     fit_data_from_fit_images,
     get_all_fit_files,
@@ -230,17 +276,146 @@ def create_sky_bg_file(
     logger.info("Completed generating sky background file")
 
 
-def process_night(night: ConfigInputNight, config: Config, output: Path, night_date: date):  # noqa
+def create_output_folders(output: Path, save_precoma: bool, clear: bool):
     """
-    Processes a given night of data based on the settings provided in `config` dict
+    Creates the folders for the products of processing a night in the night's
+    `output` folder. If `clear` is True, files from a previous processing of
+    the night are removed from the folders.
     """
-    # Save the config file used to do the current data processing
-    CONFIG_PATH = output / CONFIG_FILE_NAME
-    with CONFIG_PATH.open("w+") as fd:
-        toml.dump(config, fd)
+    precoma_folders = [
+        output / precoma_folder_name(RAW_CALIBRATED_FOLDER_NAME),
+        output / precoma_folder_name(LOG_FILES_COMBINED_FOLDER_NAME),
+        output / precoma_folder_name(ALIGNED_COMBINED_FOLDER_NAME),
+        output / precoma_folder_name(ALIGNED_FOLDER_NAME),
+    ]
+    for folder in [
+        output / ALIGNED_FOLDER_NAME,
+        output / OUTPUT_CALIBRATION_FOLDER_NAME,
+        output / RAW_CALIBRATED_FOLDER_NAME,
+        output / ALIGNED_COMBINED_FOLDER_NAME,
+        output / LOG_FILES_COMBINED_FOLDER_NAME,
+        output / FLUX_LOGS_COMBINED_FOLDER_NAME,
+        *precoma_folders,
+        output / COMA_CORRECTION_MODELS,
+    ]:
+        if folder.exists() and clear:
+            [file.unlink() for file in folder.glob("*") if file.is_file()]  # Remove existing files
+        # Nothing is written to the pre coma correction folders if those
+        # results aren't to be saved. We still clear them above so that files
+        # from an earlier processing of the night aren't mistaken as current.
+        if folder in precoma_folders and not save_precoma:
+            continue
+        folder.mkdir(exist_ok=True)
+
 
-    # Number of expected rows and columns in all raw images
+def create_master_dark(night: ConfigInputNight, config: Config, output: Path, dark_paths):
+    """
+    Creates the master dark for the night from the darks at `dark_paths` in
+    the calibration frames folder of the `output` folder and returns its data
+    """
     rows, cols = config["image"]["rows"], config["image"]["columns"]
+    image_duration = config["processing"]["image_duration"]
+    darks = fit_data_from_fit_images(dark_paths)
+    # Ensure that image dimensions are as specified by rows and cols
+    # If there's extra noise cols or rows, we crop them
+    # Note this is different from the crop_region that's defined in image
+    # options for process. More than crop, it's a fill that fills out the
+    # vignetting ring with zero values
+    darks = [crop(matrix, rows, cols) for matrix in darks]
+    return makeMasterDark(
+        saveAs=output / OUTPUT_CALIBRATION_FOLDER_NAME / MASTER_DARK_NAME,
+        headerToCopyFromName=next(
+            get_darks(night["path"] / INPUT_CALIBRATION_FOLDER_NAME, image_duration)
+        ).absolute(),
+        listOfDarkData=darks,
+    )
+
+
+def recombine_problem(
+    manifest_file: ProcessingManifestFile,
+    fingerprints: Dict[str, str],
+    config: Config,
+    output: Path,
+    raw_images: List[RawImageFile],
+) -> str | None:
+    """
+    Returns why the combinations of the night processed in `output` can't be
+    made again (see `process_night`), None if they can. This is checked before
+    anything in `output` is changed, so that a night that can't be recombined
+    keeps the products of its previous processing.
+    """
+    if not manifest_file.exists():
+        return "it wasn't processed before"
+    master_dark_path = manifest_file.master_dark(
+        {MASTER_DARK_STAGE: fingerprints[MASTER_DARK_STAGE]}
+    )
+    if master_dark_path is None or not master_dark_path.exists():
+        return "the master dark of the previous processing isn't usable"
+    # Models made with any configuration are used
+    coma_models = manifest_file.coma_models({})
+    if coma_models is None or not all(path.exists() for path in coma_models.values()):
+        return "the previous processing has no coma models"
+    alignment_transforms_file = AlignmentTransformsFile(output / ALIGNMENT_TRANSFORMS_FILE_NAME)
+    stored_transforms = alignment_transforms_file.transforms(
+        [raw_image.path() for raw_image in raw_images], *alignment_transforms_key(config)
+    )
+    no_of_images_to_combine = config["processing"]["no_of_images_to_combine"]
+    for nth_combined_image in range(len(raw_images) // no_of_images_to_combine):
+        from_index = nth_combined_image * no_of_images_to_combine
+        combination = raw_images[from_index : from_index + no_of_images_to_combine]
+        if all(raw_image.path() in stored_transforms for raw_image in combination):
+            return None
+    return "the transformations of the raw images of no combination are known"
+
+
+def stages_of_combinations(pass_name: str, fingerprints: Dict[str, str]) -> Dict[str, str]:
+    """
+    Returns the fingerprints of the stages whose products are recorded for
+    the combinations in the pass `pass_name` given the `fingerprints` of all
+    stages
+    """
+    if pass_name == ProcessingManifestFile.PRECOMA_PASS:
+        # Combinations before coma correction are only used for their
+        # alignment and to choose the raw images for the coma models
+        stages = [ALIGNMENT_STAGE]
+    else:
+        stages = [COMBINATION_STAGE, EXTRACTION_STAGE]
+    return {stage: fingerprints[stage] for stage in stages}
+
+
+def process_night(  # noqa
+    night: ConfigInputNight,
+    config: Config,
+    output: Path,
+    night_date: date,
+    resume=False,
+    scheduler: CombinationScheduler | None = None,
+    recombine=False,
+):
+    """
+    Processes a given night of data based on the settings provided in `config` dict
+
+    If `scheduler` is provided, the combinations of the night are processed
+    with the processes of the scheduler.
+
+    If `resume` is True and the night was previously (partially) processed,
+    the products of that processing that would be the same with the current
+    configuration aren't made again. See `m23.processor.stages`.
+
+    If `recombine` is True, the combinations of the night are made again (for
+    example with a different no. of images to combine) from the master dark,
+    coma correction models and transformations of the raw images of the
+    previous processing of the night, without processing the night before
+    coma correction or finding any transformation. Raw images whose
+    transformation isn't known aren't combined.
+    """
+    night_start_time = time.perf_counter()
+    timings = StageTimings()
+    manifest_file = ProcessingManifestFile(output / PROCESSING_MANIFEST_FILE_NAME)
+    fingerprints = stage_fingerprints(config, night)
+    requested_resume = resume
+    resume = resume and manifest_file.exists()
+
     radii_of_extraction = config["processing"]["radii_of_extraction"]
     image_duration = config["processing"]["image_duration"]
     dark_prefix = config["processing"]["dark_prefix"]
@@ -249,10 +424,38 @@ def process_night(night: ConfigInputNight, config: Config, output: Path, night_d
         config["processing"]["yfwhm_target"],
     )
 
+    # Define relevant input folders for the night being processed
+    NIGHT_INPUT_FOLDER: Path = night["path"]
+    NIGHT_INPUT_CALIBRATION_FOLDER: Path = NIGHT_INPUT_FOLDER / INPUT_CALIBRATION_FOLDER_NAME
+    NIGHT_INPUT_IMAGES_FOLDER = NIGHT_INPUT_FOLDER / M23_RAW_IMAGES_FOLDER_NAME
+
+    if raw_img_prefix := night.get("image_prefix"):
+        raw_images: List[RawImageFile] = [
+            RawImageFile(file.absolute())
+            for file in get_all_fit_files(
+                NIGHT_INPUT_IMAGES_FOLDER, image_duration, prefix=raw_img_prefix
+            )
+        ]
+    else:
+        raw_images: List[RawImageFile] = list(
+            get_raw_images(NIGHT_INPUT_IMAGES_FOLDER, image_duration)
+        )
+
+    if recombine and (
+        problem := recombine_problem(manifest_file, fingerprints, config, output, raw_images)
+    ):
+        sys.stderr.write(f"Cannot recombine {night_date} as {problem}\n")
+        return
+
+    # Save the config file used to do the current data processing
+    CONFIG_PATH = output / CONFIG_FILE_NAME
+    with CONFIG_PATH.open("w+") as fd:
+        toml.dump(config, fd)
+
     log_file_path = output / get_log_file_name(night_date)
     # Clear file contents if exists, so that reprocessing a night wipes out
     # contents instead of appending to it
-    if log_file_path.exists():
+    if log_file_path.exists() and not resume and not recombine:
         log_file_path.unlink()
 
     logger = logging.getLogger("LOGGER_" + str(night_date))
@@ -266,6 +469,14 @@ def process_night(night: ConfigInputNight, config: Config, output: Path, night_d
     ch2.setFormatter(formatter)
     logger.addHandler(ch2)  # Write to stdout
     logger.info(f"Starting processing for {night_date} with m23 version: {__version__}")
+    if recombine:
+        logger.info(f"Recombining using {manifest_file}")
+    elif resume:
+        logger.info(f"Resuming processing using {manifest_file}")
+    elif requested_resume:
+        logger.warning(
+            "Cannot resume as the night wasn't processed before. Processing from the beginning."
+        )
 
     ref_file_path = config["reference"]["file"]
     color_ref_file_path = config["reference"]["color"]
@@ -273,84 +484,57 @@ def process_night(night: ConfigInputNight, config: Config, output: Path, night_d
     reference_log_file = ReferenceLogFile(ref_file_path)
     logfile_combined_reference_logfile = LogFileCombinedFile(config["reference"]["logfile"])
 
-    # Define relevant input folders for the night being processed
-    NIGHT_INPUT_FOLDER: Path = night["path"]
-    NIGHT_INPUT_CALIBRATION_FOLDER: Path = NIGHT_INPUT_FOLDER / INPUT_CALIBRATION_FOLDER_NAME
-    NIGHT_INPUT_IMAGES_FOLDER = NIGHT_INPUT_FOLDER / M23_RAW_IMAGES_FOLDER_NAME
-
     # Define and create relevant output folders for the night being processed
-    JUST_ALIGNED_NOT_COMBINED_OUTPUT_FOLDER = output / ALIGNED_FOLDER_NAME
+    # Files from the previous processing are used when resuming
+    create_output_folders(
+        output, config["output"]["save_precoma"], clear=not resume and not recombine
+    )
     CALIBRATION_OUTPUT_FOLDER = output / OUTPUT_CALIBRATION_FOLDER_NAME
-    ALIGNED_COMBINED_OUTPUT_FOLDER = output / ALIGNED_COMBINED_FOLDER_NAME
     LOG_FILES_COMBINED_OUTPUT_FOLDER = output / LOG_FILES_COMBINED_FOLDER_NAME
-    FLUX_LOGS_COMBINED_OUTPUT_FOLDER = output / FLUX_LOGS_COMBINED_FOLDER_NAME
-    RAW_CALIBRATED_OUTPUT_FOLDER = output / RAW_CALIBRATED_FOLDER_NAME
-
-    JUST_ALIGNED_NOT_COMBINED_OUTPUT_FOLDER_PRECOMA = output / precoma_folder_name(
-        ALIGNED_FOLDER_NAME
-    )
-    ALIGNED_COMBINED_OUTPUT_FOLDER_PRECOMA = output / precoma_folder_name(
-        ALIGNED_COMBINED_FOLDER_NAME
-    )
-    LOG_FILES_COMBINED_OUTPUT_FOLDER_PRECOMA = output / precoma_folder_name(
-        LOG_FILES_COMBINED_FOLDER_NAME
-    )
-    RAW_CALIBRATED_OUTPUT_FOLDER_PRECOMA = output / precoma_folder_name(RAW_CALIBRATED_FOLDER_NAME)
     COMA_CORRECTION_MODELS_OUTPUT = output / COMA_CORRECTION_MODELS
+    if recombine:
+        # Only the combinations are made again
+        for folder in [output / ALIGNED_COMBINED_FOLDER_NAME, LOG_FILES_COMBINED_OUTPUT_FOLDER]:
+            [file.unlink() for file in folder.glob("*") if file.is_file()]
+        # The files of the combinations are replaced, so they can't be resumed
+        # by a later processing (which may combine a different no. of images)
+        manifest_file.clear_combinations(ProcessingManifestFile.CORRECTED_PASS)
 
-    for folder in [
-        JUST_ALIGNED_NOT_COMBINED_OUTPUT_FOLDER,
-        CALIBRATION_OUTPUT_FOLDER,
-        RAW_CALIBRATED_OUTPUT_FOLDER,
-        ALIGNED_COMBINED_OUTPUT_FOLDER,
-        LOG_FILES_COMBINED_OUTPUT_FOLDER,
-        FLUX_LOGS_COMBINED_OUTPUT_FOLDER,
-        RAW_CALIBRATED_OUTPUT_FOLDER_PRECOMA,
-        LOG_FILES_COMBINED_OUTPUT_FOLDER_PRECOMA,
-        ALIGNED_COMBINED_OUTPUT_FOLDER_PRECOMA,
-        JUST_ALIGNED_NOT_COMBINED_OUTPUT_FOLDER_PRECOMA,
-        COMA_CORRECTION_MODELS_OUTPUT,
-    ]:
-        if folder.exists():
-            [file.unlink() for file in folder.glob("*") if file.is_file()]  # Remove existing files
-        folder.mkdir(exist_ok=True)
+    if not resume and not recombine:
+        manifest_file.create_file()
 
     # Darks
-    darks = fit_data_from_fit_images(
-        get_darks(NIGHT_INPUT_CALIBRATION_FOLDER, image_duration, dark_prefix)
-    )
-    # Ensure that image dimensions are as specified by rows and cols
-    # If there's extra noise cols or rows, we crop them
-    # Note this is different from the crop_region that's defined in image
-    # options for process. More than crop, it's a fill that fills out the
-    # vignetting ring with zero values
-    darks = [crop(matrix, rows, cols) for matrix in darks]
-    master_dark_data = makeMasterDark(
-        saveAs=CALIBRATION_OUTPUT_FOLDER / MASTER_DARK_NAME,
-        headerToCopyFromName=next(
-            get_darks(NIGHT_INPUT_CALIBRATION_FOLDER, image_duration)
-        ).absolute(),
-        listOfDarkData=darks,
+    master_dark_stages = {MASTER_DARK_STAGE: fingerprints[MASTER_DARK_STAGE]}
+    master_dark_path = (
+        manifest_file.master_dark(master_dark_stages) if resume or recombine else None
     )
-    logger.info("Created master dark")
-    del darks  # Deleting to free memory as we don't use darks anymore
+    with timings.time(MASTER_DARK_STAGE) as counts:
+        if master_dark_path is not None and master_dark_path.exists():
+            master_dark_data = getdata(master_dark_path)
+            counts["bytes_read"] += file_size(master_dark_path)
+            logger.info(f"Using master dark from previous processing {master_dark_path}")
+        else:
+            dark_paths = list(
+                get_darks(NIGHT_INPUT_CALIBRATION_FOLDER, image_duration, dark_prefix)
+            )
+            master_dark_data = create_master_dark(night, config, output, dark_paths)
+            counts["frames"] += len(dark_paths)
+            counts["bytes_read"] += sum(file_size(path) for path in dark_paths)
+            counts["bytes_written"] += file_size(CALIBRATION_OUTPUT_FOLDER / MASTER_DARK_NAME)
+            logger.info("Created master dark")
+        manifest_file.add_master_dark(
+            CALIBRATION_OUTPUT_FOLDER / MASTER_DARK_NAME, master_dark_stages
+        )
 
     master_flat_data = getdata(night["masterflat"])
     # Copy the masterflat provided to the calibration frames
     masterflat_path = Path(night["masterflat"])
     shutil.copy(masterflat_path, CALIBRATION_OUTPUT_FOLDER)
     logger.info("Using pre-provided masterflat")
-
-    if raw_img_prefix := night.get("image_prefix"):
-        raw_images: List[RawImageFile] = [
-            RawImageFile(file.absolute())
-            for file in get_all_fit_files(
-                NIGHT_INPUT_IMAGES_FOLDER, image_duration, prefix=raw_img_prefix
-            )
-        ]
-    else:
-        raw_images: List[RawImageFile] = list(
-            get_raw_images(NIGHT_INPUT_IMAGES_FOLDER, image_duration)
+    # What's needed to calibrate the raw images is computed once for the night
+    with timings.time(CALIBRATION_STAGE):
+        calibration_context = CalibrationContext(
+            master_dark_data, master_flat_data, config["image"]["crop_region"]
         )
 
     logger.info("Processing images")
@@ -361,8 +545,15 @@ def process_night(night: ConfigInputNight, config: Config, output: Path, night_d
     # We now Calibrate/Crop/Align/Combine/Extract set of images in the size of no of combination
     # Note the subtle typing difference between no_of_combined_images and no_of_images_to_combine
     no_of_combined_images = len(raw_images) // no_of_images_to_combine
+    memory_per_combination = (
+        combination_memory_estimate(raw_images[0].header(), no_of_images_to_combine)
+        if len(raw_images) > 0
+        else 0
+    )
 
     # Create a file for storing alignment transformation
+    # When resuming, the records of the completed combinations are written again
+    # in the same order as they're recorded in `record_result`
     alignment_stats_file_name = AlignmentStatsFile.generate_file_name(night_date)
     alignment_stats_file = AlignmentStatsFile(output / alignment_stats_file_name)
     alignment_stats_file.create_file_and_write_header()
@@ -370,107 +561,486 @@ def process_night(night: ConfigInputNight, config: Config, output: Path, night_d
 
     log_files_to_normalize: List[LogFileCombinedFile] = []
     aligned_combined_files: List[AlignedCombinedFile] = []
-    alignment_matrices_for_raw_images: Dict[str, AlignmentTransformationType] = {}
+    # Transformation and residual of each raw image aligned, see `AlignCombineExtractResult`
+    alignment_matrices_for_raw_images: Dict[
+        str, Tuple[AlignmentTransformationType, float | None]
+    ] = {}
 
-    def perform_align_combine_extract(coma_correction_fn=None):
-        for nth_combined_image in range(no_of_combined_images):
-            try:
-                align_combined_extract(
+    # Transformations of the raw images found when the night was processed
+    # before are used instead of finding them again
+    alignment_transforms_file = AlignmentTransformsFile(output / ALIGNMENT_TRANSFORMS_FILE_NAME)
+    reference_hash, alignment_method = alignment_transforms_key(config)
+    stored_transforms = alignment_transforms_file.transforms(
+        [raw_image.path() for raw_image in raw_images], reference_hash, alignment_method
+    )
+    for raw_image in raw_images:
+        if (stored_transform := stored_transforms.get(raw_image.path())) is not None:
+            alignment_matrices_for_raw_images[str(raw_image)] = stored_transform
+    if len(stored_transforms) > 0:
+        logger.info(
+            f"Using transformations of {len(stored_transforms)} raw images from"
+            f" {alignment_transforms_file}"
+        )
+    if recombine and len(stored_transforms) < len(raw_images):
+        logger.warning(
+            f"Transformations of {len(raw_images) - len(stored_transforms)} raw images aren't"
+            " known, combinations with these images are skipped"
+        )
+
+    def record_result(result: AlignCombineExtractResult):
+        """
+        Records the result of align combine extract of a combination. Note
+        that results must be recorded in the order of image number so that the
+        output is the same regardless of how the combinations were processed.
+        """
+        for raw_image, statistics, residual in result["alignment_stats"]:
+            alignment_matrices_for_raw_images[str(raw_image)] = statistics, residual
+            alignment_stats_file.add_record(raw_image.path().name, statistics, residual)
+        alignment_transforms_file.add_transforms(
+            [
+                (raw_image.path(), statistics, residual)
+                for raw_image, statistics, residual in result["alignment_stats"]
+            ],
+            reference_hash,
+            alignment_method,
+        )
+        if aligned_combined_file := result.get("aligned_combined_file"):
+            aligned_combined_files.append(aligned_combined_file)
+        if log_file_combined_file := result.get("log_file_combined_file"):
+            log_files_to_normalize.append(log_file_combined_file)
+        # Results from previous processing don't have timings
+        if combination_timings := result.get("timings"):
+            timings.merge(combination_timings)
+
+    def stages_of_pass(pass_name: str) -> Dict[str, str]:
+        return stages_of_combinations(pass_name, fingerprints)
+
+    def save_result(result: AlignCombineExtractResult, pass_name: str):
+        """
+        Saves the result of a combination to the manifest so that it needn't be
+        processed again
+        """
+        manifest_file.add_combination(
+            pass_name,
+            manifest_record_for_result(result, raw_images_for(result["nth_combined_image"])),
+            stages_of_pass(pass_name),
+        )
+
+    def record_and_save_result(result: AlignCombineExtractResult, pass_name: str):
+        record_result(result)
+        # Combinations made when recombining aren't resumed as they're made with
+        # the coma correction models of another configuration
+        if not recombine:
+            save_result(result, pass_name)
+
+    def raw_images_for(nth_combined_image: int) -> List[RawImageFile]:
+        from_index = nth_combined_image * no_of_images_to_combine
+        return raw_images[from_index : from_index + no_of_images_to_combine]
+
+    def resumed_result(nth_combined_image: int, pass_name: str):
+        """
+        Returns the result of the combination from the previous processing if
+        resuming and the result is still valid, None otherwise
+        """
+        if not resume:
+            return None
+        record = manifest_file.combination(pass_name, nth_combined_image)
+        if record is None:
+            return None
+        raw_images_of_combination = raw_images_for(nth_combined_image)
+        if is_made_by(record, stages_of_pass(pass_name)):
+            return result_from_manifest_record(record, raw_images_of_combination)
+
+        # If only the extraction has changed, we extract stars again from the
+        # aligned combined image instead of processing the combination again
+        if pass_name != ProcessingManifestFile.CORRECTED_PASS or not is_made_by(
+            record, {COMBINATION_STAGE: fingerprints[COMBINATION_STAGE]}
+        ):
+            return None
+        result = result_from_manifest_record(
+            record, raw_images_of_combination, include_log_file=False
+        )
+        if result is None:
+            return None
+        if aligned_combined_file := result.get("aligned_combined_file"):
+            logger.info(f"Extracting stars again from {aligned_combined_file}")
+            # Note that the aligned combined images are saved as int32, so
+            # the extracted values can differ slightly from those extracted
+            # from the combined image while processing the combination.
+            with timings.time(EXTRACTION_STAGE) as counts:
+                result["log_file_combined_file"] = extract_combined_image(
                     config,
                     night,
-                    output,
+                    LOG_FILES_COMBINED_OUTPUT_FOLDER,
                     night_date,
-                    nth_combined_image,
-                    raw_images,
-                    master_dark_data,
-                    master_flat_data,
-                    alignment_stats_file,
                     image_duration,
-                    log_files_to_normalize,
-                    aligned_combined_files,
-                    coma_correction_fn,
-                    alignment_matrices_for_raw_images,
+                    aligned_combined_file,
+                    aligned_combined_file.data(),
                 )
-            except Exception as e:
-                tb = traceback.format_exc()
-                logger.error("Exception during alignment combination extraction")
-                logger.error(e)
-                logger.error(tb)
-                return
+                counts["frames"] += 1
+                counts["bytes_read"] += file_size(aligned_combined_file.path())
+                counts["bytes_written"] += file_size(result["log_file_combined_file"].path())
+            aligned_combined_file.clear()
+        save_result(result, pass_name)
+        return result
+
+    def log_align_combine_extract_exception(tb: str):
+        logger.error("Exception during alignment combination extraction")
+        logger.error(tb)
+
+    combination_cpu_count = int(os.cpu_count() * config["processing"]["combination_cpu_fraction"])
+    if combination_cpu_count > 1 and mp.current_process().daemon:
+        # Processes of a multiprocessing pool can't create their own pool
+        logger.warning(
+            "Cannot process combinations in parallel when nights are processed in parallel."
+            " Processing combinations with single processor."
+        )
+        combination_cpu_count = 0
+    max_memory_bytes = int(config["processing"]["max_memory_gb"] * 1024**3)
+    if combination_cpu_count > 1:
+        combination_cpu_count = processes_within_budget(
+            combination_cpu_count, memory_per_combination, max_memory_bytes
+        )
+
+    def get_align_combined_extract_kwargs(coma_correction_fn):
+        return {
+            "config": config,
+            "night": night,
+            "output": output,
+            "night_date": night_date,
+            "raw_images": raw_images,
+            "calibration_context": calibration_context,
+            "image_duration": image_duration,
+            "coma_correction_fn": coma_correction_fn,
+            "alignment_matrices_for_raw_images": alignment_matrices_for_raw_images,
+            "find_transformations": not recombine,
+        }
+
+    def align_combined_extract_each(nth_combined_images: List[int], align_combined_extract_kwargs):
+        """
+        Yields (nth_combined_image, result, traceback) for each of
+        `nth_combined_images` processed with the scheduler if there's one, or
+        serially otherwise. The result is None and traceback is the formatted
+        exception if processing the combination raised an exception.
+        """
+        if scheduler is not None:
+            yield from scheduler.align_combined_extract(
+                nth_combined_images,
+                log_file_path,
+                memory_per_combination,
+                **align_combined_extract_kwargs,
+            )
+            return
+        for nth_combined_image in nth_combined_images:
+            try:
+                result = align_combined_extract(
+                    nth_combined_image=nth_combined_image, **align_combined_extract_kwargs
+                )
+                yield nth_combined_image, result, None
+            except Exception:
+                yield nth_combined_image, None, traceback.format_exc()
+
+    def perform_sampled_align_combine_extract():
+        """
+        Aligns, combines and extracts just one combination for each coma group
+        (hour) of the night, which are all that's needed to make coma
+        correction models. The first combination of the group that can be
+        aligned and combined is used.
+        """
+        align_combined_extract_kwargs = get_align_combined_extract_kwargs(None)
+        pass_name = ProcessingManifestFile.PRECOMA_PASS
+        combinations_for_coma_groups = sample_combinations_for_coma_groups(
+            raw_images, no_of_images_to_combine
+        )
+        logger.info(f"Using sampled coma prepass for {len(combinations_for_coma_groups)} groups")
+
+        def has_usable_result(name):
+            results = results_of_group[name]
+            return len(results) > 0 and "aligned_combined_file" in results[-1][0]
+
+        # We try the next combination of every group that doesn't have a usable
+        # combination yet at once, so that groups are processed in parallel
+        # when using the scheduler. Results are recorded in the end, in the
+        # order in which the combinations were tried for each group.
+        candidates = {name: iter(c) for name, c in combinations_for_coma_groups.items()}
+        # Results of each group along with whether the result is new, i.e., not
+        # from previous processing
+        results_of_group: Dict[str, List[Tuple[AlignCombineExtractResult, bool]]] = {
+            name: [] for name in combinations_for_coma_groups
+        }
+        groups_to_try = list(combinations_for_coma_groups.keys())
+        while groups_to_try:
+            group_of_combination = {}
+            for name in groups_to_try:
+                if (nth_combined_image := next(candidates[name], None)) is not None:
+                    group_of_combination[nth_combined_image] = name
+            nth_combined_images_to_process = []
+            for nth_combined_image, name in group_of_combination.items():
+                if result := resumed_result(nth_combined_image, pass_name):
+                    results_of_group[name].append((result, False))
+                else:
+                    nth_combined_images_to_process.append(nth_combined_image)
+            for nth_combined_image, result, tb in align_combined_extract_each(
+                nth_combined_images_to_process, align_combined_extract_kwargs
+            ):
+                if tb is not None:
+                    log_align_combine_extract_exception(tb)
+                    continue
+                results_of_group[group_of_combination[nth_combined_image]].append((result, True))
+            groups_to_try = [
+                name for name in group_of_combination.values() if not has_usable_result(name)
+            ]
+
+        for name, results in results_of_group.items():
+            for result, is_new in results:
+                if is_new:
+                    record_and_save_result(result, pass_name)
+                else:
+                    record_result(result)
+            if not has_usable_result(name):
+                logger.warning(f"No combination could be used for coma correction of {name}")
+
+    def perform_align_combine_extract(coma_correction_fn=None):
+        align_combined_extract_kwargs = get_align_combined_extract_kwargs(coma_correction_fn)
+        if coma_correction_fn is None:
+            pass_name = ProcessingManifestFile.PRECOMA_PASS
+        else:
+            pass_name = ProcessingManifestFile.CORRECTED_PASS
+        resumed_results = {}
+        for nth_combined_image in range(no_of_combined_images):
+            if result := resumed_result(nth_combined_image, pass_name):
+                resumed_results[nth_combined_image] = result
+        if resume:
+            logger.info(
+                f"Resuming {len(resumed_results)} of {no_of_combined_images} combinations"
+                f" from previous processing in {pass_name} pass"
+            )
+
+        nth_combined_images_to_process = [
+            i for i in range(no_of_combined_images) if i not in resumed_results
+        ]
+        if scheduler is not None or combination_cpu_count > 1:
+            if scheduler is not None:
+                results = scheduler.align_combined_extract(
+                    nth_combined_images_to_process,
+                    log_file_path,
+                    memory_per_combination,
+                    **align_combined_extract_kwargs,
+                )
+            else:
+                logger.info(
+                    f"Processing combinations in parallel. CPU count: {combination_cpu_count}"
+                )
+                results = align_combined_extract_in_parallel(
+                    combination_cpu_count,
+                    nth_combined_images_to_process,
+                    log_file_path,
+                    **align_combined_extract_kwargs,
+                )
+            for nth_combined_image in range(no_of_combined_images):
+                if nth_combined_image in resumed_results:
+                    record_result(resumed_results[nth_combined_image])
+                    continue
+                _, result, tb = next(results)
+                if tb is not None:
+                    # Like in the serial case, we stop at the first exception
+                    log_align_combine_extract_exception(tb)
+                    results.close()
+                    return
+                record_and_save_result(result, pass_name)
+        else:
+            # Read the raw images of upcoming combinations while the current
+            # combination is being processed
+            with RawImagePrefetcher(
+                raw_images,
+                no_of_images_to_combine,
+                config["processing"]["prefetch_combinations"],
+                int(config["processing"]["prefetch_memory_gb"] * 1024**3),
+                nth_combined_images_to_process,
+            ) as prefetcher:
+                for nth_combined_image in range(no_of_combined_images):
+                    if nth_combined_image in resumed_results:
+                        record_result(resumed_results[nth_combined_image])
+                        continue
+                    prefetcher.wait(nth_combined_image)
+                    try:
+                        result = align_combined_extract(
+                            nth_combined_image=nth_combined_image, **align_combined_extract_kwargs
+                        )
+                    except Exception:
+                        log_align_combine_extract_exception(traceback.format_exc())
+                        return
+                    record_and_save_result(result, pass_name)
+                    prefetcher.release(nth_combined_image)
 
     # First we perform align combine extract without coma correction
     # Then we generate coma correction models and use those models
     # to perform coma correction
-    perform_align_combine_extract()
-    # Generate coma correction models
-    correction_function = coma_correction(
-        aligned_combined_files,
-        log_files_to_normalize,
-        logger,
-        COMA_CORRECTION_MODELS_OUTPUT,
-        xfwhm_target,
-        yfwhm_target,
-    )
+    coma_models_stages = {COMA_MODELS_STAGE: fingerprints[COMA_MODELS_STAGE]}
+    if recombine:
+        # Models made with any configuration are used
+        coma_models = manifest_file.coma_models({})
+        logger.info("Using coma correction models from previous processing")
+        correction_function = load_coma_correction(coma_models, logger)
+    elif resume and (coma_models := manifest_file.coma_models(coma_models_stages)) is not None:
+        # The models are made once the pass without coma correction is
+        # complete, so we only need the alignment of the images from that pass
+        logger.info("Using coma correction models from previous processing")
+        for record in manifest_file.combinations(ProcessingManifestFile.PRECOMA_PASS):
+            nth_combined_image = record["nth_combined_image"]
+            if result := resumed_result(nth_combined_image, ProcessingManifestFile.PRECOMA_PASS):
+                record_result(result)
+        correction_function = load_coma_correction(coma_models, logger)
+    else:
+        if config["processing"]["coma_prepass"] == COMA_PREPASS_SAMPLED:
+            perform_sampled_align_combine_extract()
+        else:
+            perform_align_combine_extract()
+        # Models from an incomplete previous processing may be for other groups
+        [file.unlink() for file in COMA_CORRECTION_MODELS_OUTPUT.glob("*") if file.is_file()]
+        # Generate coma correction models
+        with timings.time(COMA_MODELS_STAGE) as counts:
+            correction_function = coma_correction(
+                aligned_combined_files,
+                log_files_to_normalize,
+                logger,
+                COMA_CORRECTION_MODELS_OUTPUT,
+                xfwhm_target,
+                yfwhm_target,
+            )
+            counts["bytes_written"] += sum(
+                file_size(path) for path in COMA_CORRECTION_MODELS_OUTPUT.glob("*.psf")
+            )
+        manifest_file.add_coma_models(
+            {path.stem: path for path in sorted(COMA_CORRECTION_MODELS_OUTPUT.glob("*.psf"))},
+            coma_models_stages,
+        )
     # Now we redo align combine extract
     log_files_to_normalize, aligned_combined_files = [], []
     perform_align_combine_extract(correction_function)
+    log_peak_memory_usage(logger)
 
     # Intranight + Internight Normalization
     try:
-        normalization_helper(
-            radii_of_extraction,
-            reference_log_file,
-            log_files_to_normalize,
-            image_duration,
-            night_date,
-            color_ref_file_path,
-            output,
-            logfile_combined_reference_logfile,
-            is_running_as_part_of_process=True,
-        )
+        with timings.time(NORMALIZATION_STAGE) as counts:
+            normalization_helper(
+                radii_of_extraction,
+                reference_log_file,
+                log_files_to_normalize,
+                image_duration,
+                night_date,
+                color_ref_file_path,
+                output,
+                logfile_combined_reference_logfile,
+                is_running_as_part_of_process=True,
+            )
+            counts["frames"] += len(log_files_to_normalize)
+            counts["bytes_read"] += sum(file_size(file.path()) for file in log_files_to_normalize)
+            counts["bytes_written"] += sum(
+                file_size(file)
+                for file in (output / (FLUX_LOGS_COMBINED_FOLDER_NAME + "(All)")).rglob("*")
+                if file.is_file()
+            )
     except Exception as e:
         tb = traceback.format_exc()
         logger.error("Exception during normalization/sky_bg generation")
         logger.error(e)
         logger.debug(tb)
-        return
+
+    # Write the time taken by each stage next to the config file
+    total_wall_time = time.perf_counter() - night_start_time
+    TimingsFile(output / TIMINGS_FILE_NAME).create_file(
+        timings.stages(), total_wall_time, len(raw_images)
+    )
+    logger.info("Time taken by each stage (wall time is summed over processes)")
+    for line in timings.summary(total_wall_time, len(raw_images)):
+        logger.info(line)
 
 
-def start_data_processing_auxiliary(config: Config):
+def start_data_processing_auxiliary(config: Config, resume=False, recombine=False):
     """
     This function processes (one or more) nights defined in config dict by
     putting together various functionalities like calibration, alignment,
     extraction, and normalization together.
+    If `resume` is True, the combinations completed in previous processing of
+    the nights with the same configuration aren't processed again.
+    If `recombine` is True, only the combinations of the nights are made again
+    from the previous processing of the nights, see `process_night`.
     """
 
     OUTPUT_PATH: Path = config["output"]["path"]
     # If directory doesn't exist create directory including necessary parent directories.
     OUTPUT_PATH.mkdir(parents=True, exist_ok=True)
 
-    def process_nights_mapper(night):
+    def process_nights_mapper(night, scheduler=None):
         night_path: Path = night["path"]
         night_date = get_date_from_input_night_folder_name(night_path.name)
         OUTPUT_NIGHT_FOLDER = OUTPUT_PATH / get_output_folder_name_from_night_date(night_date)
-        # Create output folder for the night, if it doesn't already exist
-        OUTPUT_NIGHT_FOLDER.mkdir(exist_ok=True)
-        process_night(night, config, OUTPUT_NIGHT_FOLDER, night_date)
+        # A night that fails is logged so that it doesn't stop the processing
+        # of the other nights processed along with it
+        try:
+            # Create output folder for the night, if it doesn't already exist
+            OUTPUT_NIGHT_FOLDER.mkdir(exist_ok=True)
+            process_night(
+                night, config, OUTPUT_NIGHT_FOLDER, night_date, resume, scheduler, recombine
+            )
+        except Exception as e:
+            logger = logging.getLogger("LOGGER_" + str(night_date))
+            logger.error(f"Processing of {night_path.name} failed")
+            logger.error(e)
+            logger.error(traceback.format_exc())
+        return night_path.name
+
+    nights = config["input"]["nights"]
+    costs = [processing_cost(night, config) for night in nights]
+    progress = NightsProgress({night["path"].name: cost for night, cost in zip(nights, costs)})
+    # Nights processed in parallel are processed largest first so that the
+    # processing doesn't end with a large night being processed alone
+    nights_largest_first = largest_first(nights, costs)
 
     cpu_fraction = config["processing"]["cpu_fraction"]
-    if cpu_fraction > 0:
-        cpu_count = int(os.cpu_count() * cpu_fraction)
+    cpu_count = int(os.cpu_count() * cpu_fraction)
+    max_memory_bytes = int(config["processing"]["max_memory_gb"] * 1024**3)
+    if config["processing"]["scheduler"] == SCHEDULER_GLOBAL and cpu_count > 1:
+        nights_in_progress = min(len(nights), SCHEDULER_MAX_NIGHTS_IN_PROGRESS)
+        print(f"Global scheduler used. CPU count: {cpu_count}. Nights: {nights_in_progress}")
+        # Nights are processed in threads that wait for their combinations to be
+        # processed by the scheduler's processes
+        with CombinationScheduler(cpu_count, max_memory_bytes) as scheduler:
+            with ThreadPoolExecutor(nights_in_progress) as executor:
+                futures = {
+                    executor.submit(process_nights_mapper, night, scheduler): night["path"].name
+                    for night in nights_largest_first
+                }
+                for future in as_completed(futures):
+                    if future.exception() is not None:
+                        sys.stderr.write(f"Processing of {futures[future]} failed\n")
+                    progress.completed(futures[future])
+    elif cpu_fraction > 0:
+        # Each night processes one combination at a time, so the no. of nights
+        # processed at once is limited by the memory of the largest combination
+        if max_memory_bytes > 0:
+            memory_per_night = max(
+                night_combination_memory_estimate(night, config) for night in nights
+            )
+            cpu_count = processes_within_budget(cpu_count, memory_per_night, max_memory_bytes)
         print(f"Multiprocessing module used. CPU count: {cpu_count}")
         with mp.Pool(cpu_count) as p:  # Use 75% CPU
-            p.map(process_nights_mapper, config["input"]["nights"])
+            for night_name in p.imap_unordered(process_nights_mapper, nights_largest_first):
+                progress.completed(night_name)
     else:
         # Dont use multiprocessing
-        for night in config["input"]["nights"]:
+        for night in nights:
             print("Using single processor.")
-            process_nights_mapper(night)
+            progress.completed(process_nights_mapper(night))
 
 
-def start_data_processing(file_path: str):
+def start_data_processing(file_path: str, resume=False, recombine=False):
     """
     Starts data processing with the configuration file `file_path` provided as the argument.
     Calls auxiliary function `start_data_processing_auxiliary` if the configuration is valid.
     """
-    validate_file(Path(file_path), on_success=start_data_processing_auxiliary)
+    validate_file(
+        Path(file_path),
+        on_success=partial(start_data_processing_auxiliary, resume=resume, recombine=recombine),
+    )
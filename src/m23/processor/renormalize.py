@@ -10,6 +10,7 @@ from m23 import __version__
 from m23.constants import FLUX_LOGS_COMBINED_FOLDER_NAME
 from m23.file.log_file_combined_file import LogFileCombinedFile
 from m23.file.reference_log_file import ReferenceLogFile
+from m23.processor.night_costs import NightsProgress, largest_first, renormalization_cost
 from m23.processor.process_nights import normalization_helper
 from m23.utils import get_date_from_input_night_folder_name, get_log_file_name
 
@@ -21,6 +22,20 @@ from .renormalize_config_loader import (
 
 def renormalize_auxiliary(renormalize_dict: RenormalizeConfig):
     def night_renorm_mapper(night):
+        NIGHT_FOLDER = night["path"]
+        # A night that fails is logged so that it doesn't stop the
+        # renormalization of the other nights renormalized along with it
+        try:
+            renormalize_night(night)
+        except Exception as e:
+            night_date = get_date_from_input_night_folder_name(NIGHT_FOLDER.name)
+            logger = logging.getLogger("LOGGER_" + str(night_date))
+            logger.error(f"Renormalization of {NIGHT_FOLDER.name} failed")
+            logger.error(e)
+            logger.error(traceback.format_exc())
+        return NIGHT_FOLDER.name
+
+    def renormalize_night(night):
         NIGHT_FOLDER = night["path"]
         night_date = get_date_from_input_night_folder_name(NIGHT_FOLDER.name)
         log_file_path = NIGHT_FOLDER / get_log_file_name(night_date)
@@ -77,17 +92,24 @@ def renormalize_auxiliary(renormalize_dict: RenormalizeConfig):
             logger.error("Exception during normalization/sky_bg generation")
             logger.error(e)
             logger.debug(tb)
-            return
+
+    nights = renormalize_dict["input"]["nights"]
+    costs = [renormalization_cost(night) for night in nights]
+    progress = NightsProgress({night["path"].name: cost for night, cost in zip(nights, costs)})
 
     cpu_count = int(os.cpu_count() * renormalize_dict["processing"]["cpu_fraction"])
     if cpu_count > 1:
         print("Multiprocessing module use. CPU count", cpu_count)
         with mp.Pool(int(os.cpu_count() * 0.6)) as p:  # Use 75% CPU
-            p.map(night_renorm_mapper, renormalize_dict["input"]["nights"])
+            # Largest nights first so that the renormalization doesn't end with
+            # a large night being renormalized alone
+            nights_largest_first = largest_first(nights, costs)
+            for night_name in p.imap_unordered(night_renorm_mapper, nights_largest_first):
+                progress.completed(night_name)
     else:
         print("Single processor used")
-        for night in renormalize_dict["input"]["nights"]:
-            night_renorm_mapper(night)
+        for night in nights:
+            progress.completed(night_renorm_mapper(night))
 
 
 def renormalize(file_path: str):
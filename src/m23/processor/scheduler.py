@@ -0,0 +1,137 @@
+import logging
+import traceback
+import uuid
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Iterable, Iterator, Tuple
+
+import dill
+import multiprocess as mp
+from m23.constants import SCHEDULER_MAX_NIGHTS_IN_PROGRESS
+from m23.processor.align_combined_extract import (
+    AlignCombineExtractResult,
+    add_worker_logger_handlers,
+    align_combined_extract,
+)
+from m23.processor.memory import MemoryBudget, log_peak_memory_usage
+
+
+class CombinationScheduler:
+    """
+    Pool of worker processes that is shared by all nights being processed, so
+    that the combinations of all nights are processed with a single budget of
+    processors. Nights are processed in threads of the main process which
+    submit their combinations to the scheduler and wait for the results, so the
+    order of the stages of a night (for example, making the coma correction
+    models before processing the combinations with coma correction) is
+    maintained by the night itself.
+
+    Combinations are submitted to the processes only while the estimated
+    memory of the combinations in progress, of all nights, fits within
+    `max_memory_bytes` (0 means there's no limit).
+
+    Usage:
+        with CombinationScheduler(no_of_processes) as scheduler:
+            # In each of the threads processing a night
+            for nth, result, tb in scheduler.align_combined_extract(...):
+                ...
+    """
+
+    def __init__(self, no_of_processes: int, max_memory_bytes: int = 0) -> None:
+        self.__pool = mp.Pool(no_of_processes)
+        self.__memory_budget = MemoryBudget(max_memory_bytes)
+
+    def align_combined_extract(
+        self,
+        nth_combined_images: Iterable[int],
+        log_file_path: Path,
+        memory_per_combination: int = 0,
+        **kwargs,
+    ) -> Iterator[Tuple[int, AlignCombineExtractResult | None, str | None]]:
+        """
+        Same as `align_combined_extract_in_parallel` but uses the processes of
+        the scheduler.
+
+        The arguments to `align_combined_extract` that are common to all
+        combinations are saved to a file in the night's output folder once,
+        and each worker process reads them only when it processes the first
+        combination of the night, instead of receiving them with each task.
+
+        `memory_per_combination` is the estimated memory in bytes used to
+        process one combination of the night.
+        """
+        context_path = Path(kwargs["output"]) / f".align_combined_extract-{uuid.uuid4().hex}.pkl"
+        with context_path.open("wb") as fd:
+            dill.dump((kwargs, log_file_path), fd)
+
+        def release(_):
+            self.__memory_budget.release(memory_per_combination)
+
+        tasks = iter(nth_combined_images)
+        next_task = next(tasks, None)
+        submitted = deque()
+        try:
+            while next_task is not None or submitted:
+                # Submit combinations while they fit within the memory budget,
+                # and wait for the budget only if there's no submitted
+                # combination whose result we could wait for instead
+                while next_task is not None and self.__memory_budget.acquire(
+                    memory_per_combination, blocking=len(submitted) == 0
+                ):
+                    submitted.append(
+                        self.__pool.apply_async(
+                            _scheduler_worker,
+                            ((str(context_path), next_task),),
+                            callback=release,
+                            error_callback=release,
+                        )
+                    )
+                    next_task = next(tasks, None)
+                yield submitted.popleft().get()
+        finally:
+            context_path.unlink(missing_ok=True)
+
+    def close(self):
+        self.__pool.close()
+        self.__pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# Arguments of the nights most recently processed by the worker process, keyed
+# by the path of the file they're saved in
+_contexts: OrderedDict = OrderedDict()
+
+
+def _load_context(context_path: str):
+    if context_path in _contexts:
+        _contexts.move_to_end(context_path)
+        return _contexts[context_path]
+    with open(context_path, "rb") as fd:
+        kwargs, log_file_path = dill.load(fd)
+    add_worker_logger_handlers(kwargs["night_date"], log_file_path)
+    _contexts[context_path] = kwargs
+    # Each night in progress can have at most one context in use at a time
+    while len(_contexts) > SCHEDULER_MAX_NIGHTS_IN_PROGRESS:
+        _contexts.popitem(last=False)
+    return kwargs
+
+
+def _scheduler_worker(task: Tuple[str, int]):
+    context_path, nth_combined_image = task
+    # The context is removed when the night stops processing its combinations
+    # (for example, after an exception) so that its remaining tasks are skipped
+    if not Path(context_path).exists():
+        _contexts.pop(context_path, None)
+        return nth_combined_image, None, "Skipped as the night stopped processing combinations"
+    try:
+        kwargs = _load_context(context_path)
+        result = align_combined_extract(nth_combined_image=nth_combined_image, **kwargs)
+        log_peak_memory_usage(logging.getLogger("LOGGER_" + str(kwargs["night_date"])))
+        return nth_combined_image, result, None
+    except Exception:
+        return nth_combined_image, None, traceback.format_exc()
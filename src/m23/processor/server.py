@@ -0,0 +1,216 @@
+import builtins
+import getpass
+import importlib
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import traceback
+from multiprocessing.connection import Client, Connection, Listener
+from pathlib import Path
+from typing import Dict, Tuple
+
+# Environment variable with the key that clients must know to submit jobs to
+# a server listening on a port. It isn't needed for Unix sockets, which are
+# only accessible to the user running the server.
+SERVER_KEY_ENVIRONMENT_VARIABLE = "M23_SERVER_KEY"
+
+# Function run for each command, as (module, function)
+JOB_FUNCTIONS: Dict[str, Tuple[str, str]] = {
+    "process": ("m23.processor.process_nights", "start_data_processing"),
+    "norm": ("m23.processor.renormalize", "renormalize"),
+    "csv": ("m23.processor.nights_csv", "create_nights_csv"),
+}
+
+
+def default_server_address() -> str:
+    return str(Path(tempfile.gettempdir()) / f"m23_{getpass.getuser()}.sock")
+
+
+def parse_server_address(address: str) -> str | Tuple[str, int]:
+    """
+    Returns the address of the server for `multiprocessing.connection`. An
+    empty `address` is the default address, `host:port` is a TCP address and
+    anything else is the path of a Unix socket.
+    """
+    if address == "":
+        return default_server_address()
+    host, separator, port = address.rpartition(":")
+    if separator and port.isdigit():
+        return (host or "localhost", int(port))
+    return address
+
+
+def server_key(address: str | Tuple[str, int]) -> bytes | None:
+    key = os.environ.get(SERVER_KEY_ENVIRONMENT_VARIABLE)
+    if isinstance(address, tuple) and not key:
+        raise ValueError(
+            f"Set {SERVER_KEY_ENVIRONMENT_VARIABLE} to use a server listening on a port"
+        )
+    return key.encode() if key else None
+
+
+class _ConnectionWriter:
+    """
+    File like object that sends what's written to it to the client of a job
+    """
+
+    def __init__(self, connection: Connection) -> None:
+        self.__connection = connection
+
+    def write(self, text: str) -> int:
+        if text:
+            self.__connection.send(("output", text))
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def _run_job(connection: Connection, job: Dict):
+    """
+    Runs `job` in a process forked from the server and sends its output (and
+    questions, see `prompt_to_continue`) to the client
+    """
+    sys.stdout = sys.stderr = _ConnectionWriter(connection)
+
+    def input_from_client(prompt=""):
+        connection.send(("input", prompt))
+        return connection.recv()
+
+    builtins.input = input_from_client
+    os.chdir(job["cwd"])
+    module_name, function_name = JOB_FUNCTIONS[job["command"]]
+    function = getattr(importlib.import_module(module_name), function_name)
+    try:
+        function(Path(job["config_file"]), **job["kwargs"])
+    except Exception:
+        sys.stderr.write(traceback.format_exc())
+        sys.exit(1)
+
+
+def _warm_up():
+    """
+    Imports the modules of the jobs, parses the default reference files and
+    detects the stars of the default reference image, so that jobs (in
+    processes forked from the server) don't have to
+    """
+    from m23.align import reference_aligner
+    from m23.file.reference_log_file import ReferenceLogFile
+    from m23.file.ri_color_file import RIColorFile
+    from m23.reference import get_reference_files_dict
+
+    for module_name, _ in JOB_FUNCTIONS.values():
+        importlib.import_module(module_name)
+    reference_files = get_reference_files_dict()
+    ReferenceLogFile(reference_files["file"]).data()
+    RIColorFile(reference_files["color"]).data()
+    # The default reference image may not be installed, in which case jobs use their own
+    if Path(reference_files["image"]).exists():
+        reference_aligner(reference_files["image"])
+
+
+def start_server(address: str, no_of_workers: int):
+    """
+    Starts a server at `address` (see `parse_server_address`) that runs the
+    `process`, `norm` and `csv` jobs submitted with `submit_job`, at most
+    `no_of_workers` of them at once, until interrupted with Ctrl-C.
+
+    Modules are imported and default reference files are parsed once, when the
+    server starts. Each job is run in a process forked from the server, so
+    jobs start warm but don't share any other state (like the loggers of
+    nights) with one another.
+    """
+    if "fork" not in multiprocessing.get_all_start_methods():
+        sys.stderr.write("Server requires an operating system that supports fork\n")
+        return
+    server_address = parse_server_address(address)
+    key = server_key(server_address)
+    if isinstance(server_address, str) and Path(server_address).exists():
+        # Socket of a server that didn't stop cleanly
+        Path(server_address).unlink()
+    print("Warming up")
+    _warm_up()
+    context = multiprocessing.get_context("fork")
+    workers = threading.Semaphore(no_of_workers)
+    # Forking while another thread forks isn't safe
+    fork_lock = threading.Lock()
+
+    def handle(connection: Connection, job_no: int):
+        with connection:
+            try:
+                job = connection.recv()
+            except EOFError:
+                return
+            if job.get("command") not in JOB_FUNCTIONS:
+                connection.send(("output", f"Unknown command {job.get('command')}\n"))
+                connection.send(("exit", 1))
+                return
+            print(f"Job {job_no}: {job['command']} {job['config_file']}")
+            with workers:
+                with fork_lock:
+                    process = context.Process(target=_run_job, args=(connection, job))
+                    process.start()
+                process.join()
+            print(f"Job {job_no} finished with exit code {process.exitcode}")
+            try:
+                connection.send(("exit", process.exitcode))
+            except OSError:
+                pass  # Client has disconnected
+
+    # The Unix socket is created accessible only to the user
+    umask = os.umask(0o177)
+    try:
+        listener = Listener(server_address, authkey=key)
+    finally:
+        os.umask(umask)
+    with listener:
+        print(f"Listening on {server_address} with {no_of_workers} workers")
+        job_no = 0
+        try:
+            while True:
+                try:
+                    connection = listener.accept()
+                except (OSError, EOFError, multiprocessing.AuthenticationError) as e:
+                    print(f"Couldn't accept connection: {e}")
+                    continue
+                job_no += 1
+                threading.Thread(target=handle, args=(connection, job_no), daemon=True).start()
+        except KeyboardInterrupt:
+            print("Stopping server")
+
+
+def submit_job(address: str, command: str, config_file: str | Path, **kwargs) -> int:
+    """
+    Runs the `command` (process, norm or csv) with the `config_file` on the
+    server at `address` (see `start_server`), writing its output to stdout as
+    it runs. `kwargs` are passed on to the function of the command. Returns
+    the exit code of the job.
+    """
+    server_address = parse_server_address(address)
+    with Client(server_address, authkey=server_key(server_address)) as connection:
+        connection.send(
+            {
+                "command": command,
+                "config_file": str(Path(config_file).absolute()),
+                "cwd": os.getcwd(),
+                "kwargs": kwargs,
+            }
+        )
+        while True:
+            try:
+                kind, value = connection.recv()
+            except EOFError:
+                sys.stdout.write("Lost connection to the server\n")
+                return 1
+            if kind == "output":
+                sys.stdout.write(value)
+                sys.stdout.flush()
+            elif kind == "input":
+                connection.send(input(value))
+            elif kind == "exit":
+                return value
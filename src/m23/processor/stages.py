@@ -0,0 +1,164 @@
+"""
+Stages of processing a night and the configuration options each of them
+depends on. Processing a night is modelled as the following chain of stages,
+where each stage uses the products of the stage before it:
+
+    master dark -> calibration -> alignment -> coma models -> combination ->
+    extraction -> normalization
+
+The fingerprint of a stage is a hash of the configuration options of the
+stage and the fingerprint of the stage before it, so it changes when the
+options of the stage or of any stage before it change. Options that are paths
+of input files are hashed along with the contents of the files, so that
+replacing a file at the same path changes the fingerprint as well. Products of processing
+are recorded in the processing manifest with the fingerprints of the stages
+that produced them, and when resuming, only the products whose fingerprints
+are different from the current ones are made again. For example, changing the
+radii of extraction only requires extracting stars from the aligned combined
+images again.
+
+Intranight normalization is cheap compared to the other stages, so it's
+always done again. Internight normalization and sky background are done by
+the `norm` command.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from m23.file import file_hash
+from m23.processor.config_loader import Config, ConfigInputNight
+
+MASTER_DARK_STAGE = "master_dark"
+CALIBRATION_STAGE = "calibration"
+ALIGNMENT_STAGE = "alignment"
+COMA_MODELS_STAGE = "coma_models"
+COMBINATION_STAGE = "combination"
+EXTRACTION_STAGE = "extraction"
+NORMALIZATION_STAGE = "normalization"
+
+# Configuration options of each stage in the order the stages are done. The
+# options are given as (section, key) where the section "night" refers to the
+# options of the night being processed.
+STAGE_OPTIONS: List[Tuple[str, List[Tuple[str, str]]]] = [
+    (
+        MASTER_DARK_STAGE,
+        [
+            ("night", "path"),
+            ("image", "rows"),
+            ("image", "columns"),
+            ("processing", "image_duration"),
+            ("processing", "dark_prefix"),
+        ],
+    ),
+    (
+        CALIBRATION_STAGE,
+        [
+            ("night", "masterflat"),
+            ("night", "image_prefix"),
+            ("image", "crop_region"),
+            ("output", "save_calibrated"),
+        ],
+    ),
+    (
+        ALIGNMENT_STAGE,
+        [
+            ("reference", "image"),
+            ("processing", "no_of_images_to_combine"),
+            ("processing", "coma_prepass"),
+            ("processing", "alignment_method"),
+            ("processing", "phase_correlation_max_rotation"),
+            ("processing", "warp_backend"),
+            ("output", "save_aligned"),
+            ("output", "save_precoma"),
+        ],
+    ),
+    (
+        COMA_MODELS_STAGE,
+        [
+            ("processing", "xfwhm_target"),
+            ("processing", "yfwhm_target"),
+        ],
+    ),
+    (COMBINATION_STAGE, []),
+    (
+        EXTRACTION_STAGE,
+        [
+            ("reference", "file"),
+            ("processing", "radii_of_extraction"),
+            ("night", "starttime"),
+            ("night", "endtime"),
+        ],
+    ),
+    (
+        NORMALIZATION_STAGE,
+        [
+            ("reference", "logfile"),
+            ("reference", "color"),
+        ],
+    ),
+]
+
+# Options that are paths of input files whose contents are part of the fingerprints
+FILE_OPTIONS = [
+    ("night", "masterflat"),
+    ("reference", "image"),
+    ("reference", "file"),
+    ("reference", "logfile"),
+    ("reference", "color"),
+]
+
+# Options that only affect how fast a night is processed and not its output
+OPTIONS_NOT_AFFECTING_OUTPUT = [
+    ("processing", "cpu_fraction"),
+    ("processing", "combination_cpu_fraction"),
+    ("processing", "prefetch_combinations"),
+    ("processing", "prefetch_memory_gb"),
+    ("processing", "max_memory_gb"),
+    ("processing", "scheduler"),
+    ("output", "path"),
+]
+
+
+def option_value(options: Dict, section: str, key: str):
+    """
+    Returns the value of the option `key` of `section` in `options` as it's
+    hashed into the fingerprints, which for the paths of input files (see
+    `FILE_OPTIONS`) includes the hash of the contents of the file
+    """
+    value = options.get(section, {}).get(key)
+    if (section, key) in FILE_OPTIONS and value and Path(value).is_file():
+        return [value, file_hash(Path(value))]
+    return value
+
+
+def stage_fingerprints(config: Config, night: ConfigInputNight) -> Dict[str, str]:
+    """
+    Returns the fingerprint of each stage for processing `night` with `config`
+    """
+    options = {"night": night, **{k: v for k, v in config.items() if k != "input"}}
+    options_of_stages = {option for _, stage_options in STAGE_OPTIONS for option in stage_options}
+
+    # Options that aren't assigned to any stage are considered to be options of
+    # the first stage, so that changing them invalidates all products
+    unassigned_options = [
+        (section, key)
+        for section, section_options in options.items()
+        for key in section_options
+        if (section, key) not in options_of_stages
+        and (section, key) not in OPTIONS_NOT_AFFECTING_OUTPUT
+    ]
+
+    fingerprints = {}
+    previous_fingerprint = ""
+    for index, (stage, stage_options) in enumerate(STAGE_OPTIONS):
+        if index == 0:
+            stage_options = stage_options + sorted(unassigned_options)
+        values = [
+            [section, key, option_value(options, section, key)] for section, key in stage_options
+        ]
+        serialized = json.dumps([previous_fingerprint, values], default=str)
+        fingerprints[stage] = hashlib.sha256(serialized.encode()).hexdigest()
+        previous_fingerprint = fingerprints[stage]
+    return fingerprints
@@ -0,0 +1,105 @@
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator
+
+# Stages that are timed in addition to the stages in `m23.processor.stages`
+READING_STAGE = "reading"
+COMA_CORRECTION_STAGE = "coma_correction"
+
+# Counts that the code of a stage adds to, in addition to the time taken
+STAGE_COUNTS = ["frames", "bytes_read", "bytes_written"]
+
+
+class StageTimings:
+    """
+    Wall time, CPU time, bytes read and written and the no. of frames
+    processed in each stage of processing a night.
+
+    Usage:
+        timings = StageTimings()
+        with timings.time(CALIBRATION_STAGE) as counts:
+            # Calibrate images
+            counts["frames"] += len(images)
+
+    Each stage can be timed any no. of times, and its values are added up.
+    Timings made in other processes (for example of combinations processed in
+    parallel) can be added with `merge`, so the wall time of a stage is the
+    sum of the wall times in all processes.
+
+    CPU time is the CPU time of the thread that does the stage, so that
+    nights processed in threads of the same process don't count the CPU time
+    of each other.
+    """
+
+    def __init__(self) -> None:
+        self.__stages: Dict[str, Dict[str, float]] = {}
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[Dict[str, int]]:
+        counts = {count: 0 for count in STAGE_COUNTS}
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield counts
+        finally:
+            self.add(
+                stage,
+                {
+                    "wall_time": time.perf_counter() - wall_start,
+                    "cpu_time": time.thread_time() - cpu_start,
+                    **counts,
+                },
+            )
+
+    def add(self, stage: str, values: Dict[str, float]) -> None:
+        """
+        Adds `values` (wall time, CPU time and counts) to the values of `stage`
+        """
+        stage_values = self.__stages.setdefault(
+            stage, {"wall_time": 0, "cpu_time": 0, **{count: 0 for count in STAGE_COUNTS}}
+        )
+        for key, value in values.items():
+            stage_values[key] += value
+
+    def merge(self, other: "StageTimings") -> None:
+        """
+        Adds the values of all stages of `other` to the values of this
+        """
+        for stage, values in other.stages().items():
+            self.add(stage, values)
+
+    def stages(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns the values of each stage in the order the stages were first timed
+        """
+        return self.__stages
+
+    def summary(self, total_wall_time: float, no_of_frames: int) -> Iterable[str]:
+        """
+        Yields lines summarizing the timings of each stage and the throughput
+        of processing `no_of_frames` raw images in `total_wall_time` seconds
+        """
+        for stage, values in self.stages().items():
+            line = f"{stage}: {values['wall_time']:.1f} s wall, {values['cpu_time']:.1f} s CPU"
+            if values["frames"] > 0:
+                line += f", {values['frames']} frames"
+                if values["wall_time"] > 0:
+                    line += f" ({values['frames'] / values['wall_time']:.2f} frames/s)"
+            line += (
+                f", {values['bytes_read'] / 1024**2:.1f} MB read"
+                f", {values['bytes_written'] / 1024**2:.1f} MB written"
+            )
+            yield line
+        frames_per_second = no_of_frames / total_wall_time if total_wall_time > 0 else 0
+        yield (
+            f"Processed {no_of_frames} raw images in {total_wall_time:.1f} s"
+            f" ({frames_per_second:.2f} frames/s)"
+        )
+
+
+def file_size(path: Path) -> int:
+    """
+    Returns the size of the file at `path` in bytes or 0 if it doesn't exist
+    """
+    path = Path(path)
+    return path.stat().st_size if path.exists() else 0
@@ -0,0 +1,496 @@
+import datetime
+import logging
+import shutil
+import sys
+import time
+import traceback
+from datetime import date
+from functools import partial
+from pathlib import Path
+from typing import Dict, List, Set
+
+import toml
+from astropy.io.fits import getdata
+from m23 import __version__
+from m23.calibrate.calibration import CalibrationContext
+from m23.coma import (
+    coma_correction,
+    coma_correction_from_models,
+    coma_group_name_for_image,
+    load_coma_correction,
+    sample_combinations_for_coma_groups,
+)
+from m23.constants import (
+    ALIGNMENT_TRANSFORMS_FILE_NAME,
+    COMA_CORRECTION_MODELS,
+    COMA_PREPASS_SAMPLED,
+    CONFIG_FILE_NAME,
+    INPUT_CALIBRATION_FOLDER_NAME,
+    M23_RAW_IMAGES_FOLDER_NAME,
+    MASTER_DARK_NAME,
+    OUTPUT_CALIBRATION_FOLDER_NAME,
+    PROCESSING_MANIFEST_FILE_NAME,
+)
+from m23.file.alignment_transforms_file import AlignmentTransformsFile
+from m23.file.folder_watcher import FolderWatcher
+from m23.file.processing_manifest_file import ProcessingManifestFile
+from m23.file.raw_image_file import RawImageFile
+from m23.processor.align_combined_extract import (
+    AlignCombineExtractResult,
+    add_worker_logger_handlers,
+    align_combined_extract,
+    alignment_transforms_key,
+    manifest_record_for_result,
+)
+from m23.processor.config_loader import Config, ConfigInputNight, validate_file
+from m23.processor.night_costs import raw_image_paths
+from m23.processor.process_nights import (
+    create_master_dark,
+    create_output_folders,
+    process_night,
+    stages_of_combinations,
+)
+from m23.processor.stages import (
+    COMA_MODELS_STAGE,
+    MASTER_DARK_STAGE,
+    stage_fingerprints,
+)
+from m23.utils import (
+    get_darks,
+    get_date_from_input_night_folder_name,
+    get_log_file_name,
+    get_output_folder_name_from_night_date,
+    sorted_by_number,
+)
+
+# Seconds to wait before looking again at files that may still be being written
+SETTLE_INTERVAL = 1
+
+
+def hour_of(raw_image: RawImageFile) -> datetime.datetime:
+    """
+    Returns the hour in which `raw_image` was taken. Raw images taken in the
+    same hour have the same coma group, see `coma_group_name_for_image`.
+    """
+    return raw_image.datetime().replace(minute=0, second=0, microsecond=0)
+
+
+class LiveNight:
+    """
+    Processes a night while its raw images are being written by the camera.
+
+    Each combination is aligned, combined and extracted as soon as its raw
+    images are written. Coma correction models are made for each coma group
+    (hour) once the images of the hour are all written, after which the
+    combinations of the hour are processed again with coma correction. This is
+    the same processing that `process_night` does after all images are
+    written, in the same order for each combination, and it records its
+    results in the processing manifest, so that processing the night with
+    `resume` in the end only processes the combinations that are left and
+    normalizes the night.
+
+    Usage:
+        live_night = LiveNight(night, config, output, night_date)
+        live_night.start()
+        while images_are_being_written:
+            live_night.update(raw_image_paths, dark_paths)
+        live_night.finish(dark_paths)
+    """
+
+    def __init__(
+        self, night: ConfigInputNight, config: Config, output: Path, night_date: date
+    ) -> None:
+        self.__night = night
+        self.__config = config
+        self.__output = output
+        self.__night_date = night_date
+        self.__fingerprints = stage_fingerprints(config, night)
+        self.__manifest_file = ProcessingManifestFile(output / PROCESSING_MANIFEST_FILE_NAME)
+        self.__alignment_transforms_file = AlignmentTransformsFile(
+            output / ALIGNMENT_TRANSFORMS_FILE_NAME
+        )
+        self.__log_file_path = output / get_log_file_name(night_date)
+        self.__logger = logging.getLogger("LOGGER_" + str(night_date))
+        self.__no_of_images_to_combine = config["processing"]["no_of_images_to_combine"]
+        self.__sampled_coma_prepass = config["processing"]["coma_prepass"] == COMA_PREPASS_SAMPLED
+
+        self.__raw_images: List[RawImageFile] = []
+        # Raw images written after the images that come after them
+        self.__late_raw_image_paths: Set[Path] = set()
+        self.__dark_paths: List[Path] = []
+        self.__master_dark_data = None
+        self.__master_flat_data = None
+        self.__calibration_context: CalibrationContext | None = None
+        self.__alignment_matrices_for_raw_images = {}
+        # Results of the combinations before coma correction, until the coma
+        # correction model of their group is made
+        self.__precoma_results: Dict[int, AlignCombineExtractResult] = {}
+        self.__no_of_precoma_combinations = 0
+        self.__no_of_corrected_combinations = 0
+        self.__coma_models: Dict[str, Path] = {}
+        # Coma groups whose model is made, or can't be made
+        self.__completed_coma_groups: Set[str] = set()
+        self.__coma_correction_fn = coma_correction_from_models({}, self.__logger)
+
+    def start(self):
+        """
+        Creates the output folders of the night (removing the products of any
+        previous processing) and the processing manifest
+        """
+        if self.__log_file_path.exists():
+            self.__log_file_path.unlink()
+        add_worker_logger_handlers(self.__night_date, self.__log_file_path)
+        self.__logger.info(
+            f"Starting live processing for {self.__night_date} with m23 version: {__version__}"
+        )
+        if not self.__config["output"]["save_precoma"]:
+            self.__logger.info(
+                "Combinations before coma correction aren't saved, so combinations are first"
+                " written after the coma correction model of their hour is made"
+            )
+        create_output_folders(self.__output, self.__config["output"]["save_precoma"], clear=True)
+        self.__manifest_file.create_file()
+        with (self.__output / CONFIG_FILE_NAME).open("w+") as fd:
+            toml.dump(self.__config, fd)
+
+        self.__master_flat_data = getdata(self.__night["masterflat"])
+        masterflat_path = Path(self.__night["masterflat"])
+        shutil.copy(masterflat_path, self.__output / OUTPUT_CALIBRATION_FOLDER_NAME)
+        self.__logger.info("Using pre-provided masterflat")
+
+    def raw_images(self) -> List[RawImageFile]:
+        return self.__raw_images
+
+    def update(self, raw_image_paths: List[Path], dark_paths: List[Path]) -> int:
+        """
+        Adds the raw images at `raw_image_paths` that weren't added before and
+        processes the combinations that can be processed. Returns the no. of
+        raw images added.
+
+        param: raw_image_paths: Paths of all raw images written so far, in the
+            order they're combined
+        param: dark_paths: Paths of all darks written so far. The master dark is
+            made from these when the first combination is to be processed.
+        """
+        no_of_raw_images = len(self.__raw_images)
+        position = {path: index for index, path in enumerate(raw_image_paths)}
+        known_paths = {raw_image.path() for raw_image in self.__raw_images}
+        known_paths |= self.__late_raw_image_paths
+        last_position = -1
+        if no_of_raw_images > 0:
+            last_position = position.get(self.__raw_images[-1].path(), -1)
+        for path in raw_image_paths:
+            if path in known_paths:
+                continue
+            if position[path] < last_position:
+                self.__late_raw_image_paths.add(path)
+                # The combinations after this image have been processed, so
+                # it's only used when the night is processed in the end
+                self.__logger.warning(
+                    f"Raw image {path.name} was written after the images that come after it."
+                    " Ignoring it until the end of the night"
+                )
+                continue
+            self.__raw_images.append(RawImageFile(path))
+            known_paths.add(path)
+            last_position = position[path]
+        no_of_new_raw_images = len(self.__raw_images) - no_of_raw_images
+        if no_of_new_raw_images > 0:
+            self.__logger.info(f"Found {no_of_new_raw_images} new raw images")
+
+        no_of_combined_images = len(self.__raw_images) // self.__no_of_images_to_combine
+        if no_of_combined_images == 0 or not self._has_master_dark(dark_paths):
+            return no_of_new_raw_images
+        if not self.__sampled_coma_prepass:
+            for nth_combined_image in range(
+                self.__no_of_precoma_combinations, no_of_combined_images
+            ):
+                if result := self._align_combined_extract(nth_combined_image, None):
+                    self.__precoma_results[nth_combined_image] = result
+                self.__no_of_precoma_combinations = nth_combined_image + 1
+        self._make_coma_models(finished=False)
+        self._process_corrected_combinations()
+        return no_of_new_raw_images
+
+    def finish(self, dark_paths: List[Path]):
+        """
+        Makes the coma correction models of the rest of the night and processes
+        the rest of the night with `process_night`
+        """
+        resume = True
+        if len(self.__raw_images) == 0:
+            self.__logger.warning("No raw images were written for the night")
+        elif self.__master_dark_data is not None and set(dark_paths) != set(self.__dark_paths):
+            self.__logger.warning(
+                "Darks have changed since the master dark was made. Processing the night again."
+            )
+            resume = False
+        elif self._has_master_dark(dark_paths):
+            self._make_coma_models(finished=True)
+            self.__manifest_file.add_coma_models(
+                self.__coma_models,
+                {COMA_MODELS_STAGE: self.__fingerprints[COMA_MODELS_STAGE]},
+            )
+        self.__logger.info("Processing the rest of the night")
+
+        # Processing the night adds its own handlers to the logger
+        for handler in self.__logger.handlers[:]:
+            handler.close()
+            self.__logger.removeHandler(handler)
+        process_night(self.__night, self.__config, self.__output, self.__night_date, resume)
+
+    def _has_master_dark(self, dark_paths: List[Path]) -> bool:
+        """
+        Makes the master dark from `dark_paths`, if it isn't made already.
+        Returns whether the master dark is made.
+        """
+        if self.__master_dark_data is not None:
+            return True
+        if len(dark_paths) == 0:
+            self.__logger.info("Waiting for darks to be written")
+            return False
+        self.__master_dark_data = create_master_dark(
+            self.__night, self.__config, self.__output, dark_paths
+        )
+        self.__dark_paths = dark_paths
+        self.__calibration_context = CalibrationContext(
+            self.__master_dark_data,
+            self.__master_flat_data,
+            self.__config["image"]["crop_region"],
+        )
+        self.__manifest_file.add_master_dark(
+            self.__output / OUTPUT_CALIBRATION_FOLDER_NAME / MASTER_DARK_NAME,
+            {MASTER_DARK_STAGE: self.__fingerprints[MASTER_DARK_STAGE]},
+        )
+        self.__logger.info(f"Created master dark from {len(dark_paths)} darks")
+        return True
+
+    def _raw_images_for(self, nth_combined_image: int) -> List[RawImageFile]:
+        from_index = nth_combined_image * self.__no_of_images_to_combine
+        return self.__raw_images[from_index : from_index + self.__no_of_images_to_combine]
+
+    def _align_combined_extract(
+        self, nth_combined_image: int, coma_correction_fn
+    ) -> AlignCombineExtractResult | None:
+        """
+        Processes the combination and records its result in the manifest.
+        Returns None if processing raised an exception.
+        """
+        try:
+            result = align_combined_extract(
+                config=self.__config,
+                night=self.__night,
+                output=self.__output,
+                night_date=self.__night_date,
+                nth_combined_image=nth_combined_image,
+                raw_images=self.__raw_images,
+                calibration_context=self.__calibration_context,
+                image_duration=self.__config["processing"]["image_duration"],
+                coma_correction_fn=coma_correction_fn,
+                alignment_matrices_for_raw_images=self.__alignment_matrices_for_raw_images,
+            )
+        except Exception:
+            self.__logger.error("Exception during alignment combination extraction")
+            self.__logger.error(traceback.format_exc())
+            return None
+        finally:
+            # Combinations that fail or are skipped don't release the data of
+            # their raw images, which would otherwise be kept for the whole night
+            for raw_image in self._raw_images_for(nth_combined_image):
+                raw_image.clear()
+        for raw_image, statistics, residual in result["alignment_stats"]:
+            self.__alignment_matrices_for_raw_images[str(raw_image)] = statistics, residual
+        self.__alignment_transforms_file.add_transforms(
+            [
+                (raw_image.path(), statistics, residual)
+                for raw_image, statistics, residual in result["alignment_stats"]
+            ],
+            *alignment_transforms_key(self.__config),
+        )
+        if coma_correction_fn is None:
+            pass_name = ProcessingManifestFile.PRECOMA_PASS
+        else:
+            pass_name = ProcessingManifestFile.CORRECTED_PASS
+        self.__manifest_file.add_combination(
+            pass_name,
+            manifest_record_for_result(result, self._raw_images_for(nth_combined_image)),
+            stages_of_combinations(pass_name, self.__fingerprints),
+        )
+        return result
+
+    def _latest_hour(self) -> datetime.datetime:
+        """
+        Returns the hour of the latest combination. The coma groups of the
+        hours before it are complete, as the raw images are written in order.
+        """
+        no_of_combined_images = len(self.__raw_images) // self.__no_of_images_to_combine
+        latest_combination = self._raw_images_for(no_of_combined_images - 1)
+        return hour_of(latest_combination[len(latest_combination) // 2])
+
+    def _make_coma_models(self, finished: bool):
+        """
+        Makes the coma correction models of the coma groups that are complete,
+        or of all coma groups if the night is `finished`
+        """
+        no_of_combined_images = len(self.__raw_images) // self.__no_of_images_to_combine
+        latest_hour = None if finished else self._latest_hour()
+        # Aligned combined files have the header of the raw image in the middle
+        combinations_of_group: Dict[str, List[int]] = {}
+        for nth_combined_image in range(no_of_combined_images):
+            raw_images = self._raw_images_for(nth_combined_image)
+            middle_raw_image = raw_images[len(raw_images) // 2]
+            if latest_hour is not None and hour_of(middle_raw_image) >= latest_hour:
+                break
+            name = coma_group_name_for_image(middle_raw_image)
+            if name not in self.__completed_coma_groups:
+                combinations_of_group.setdefault(name, []).append(nth_combined_image)
+        if not combinations_of_group:
+            return
+
+        if self.__sampled_coma_prepass:
+            sample_combinations = sample_combinations_for_coma_groups(
+                self.__raw_images[: no_of_combined_images * self.__no_of_images_to_combine],
+                self.__no_of_images_to_combine,
+            )
+        models_folder = self.__output / COMA_CORRECTION_MODELS
+        for name, combinations in combinations_of_group.items():
+            aligned_combined_files = []
+            if self.__sampled_coma_prepass:
+                # Like `perform_sampled_align_combine_extract` of `process_night`
+                for nth_combined_image in sample_combinations.get(name, []):
+                    result = self._align_combined_extract(nth_combined_image, None)
+                    if result and (aligned_combined_file := result.get("aligned_combined_file")):
+                        aligned_combined_files.append(aligned_combined_file)
+                        break
+            else:
+                for nth_combined_image in combinations:
+                    result = self.__precoma_results.pop(nth_combined_image, None)
+                    if result and (aligned_combined_file := result.get("aligned_combined_file")):
+                        aligned_combined_files.append(aligned_combined_file)
+            if aligned_combined_files:
+                coma_correction(
+                    aligned_combined_files,
+                    [],
+                    self.__logger,
+                    models_folder,
+                    self.__config["processing"]["xfwhm_target"],
+                    self.__config["processing"]["yfwhm_target"],
+                )
+                self.__coma_models[name] = models_folder / f"{name}.psf"
+            else:
+                self.__logger.warning(
+                    f"No combination could be used for coma correction of {name}"
+                )
+            self.__completed_coma_groups.add(name)
+        # The rest of the night is processed by `process_night` once finished
+        if not finished:
+            self.__coma_correction_fn = load_coma_correction(self.__coma_models, self.__logger)
+
+    def _process_corrected_combinations(self):
+        """
+        Processes the combinations whose raw images are all in coma groups
+        that are complete with coma correction
+        """
+        no_of_combined_images = len(self.__raw_images) // self.__no_of_images_to_combine
+        latest_hour = self._latest_hour()
+        for nth_combined_image in range(
+            self.__no_of_corrected_combinations, no_of_combined_images
+        ):
+            # Each raw image is corrected with the model of its own coma group
+            if hour_of(self._raw_images_for(nth_combined_image)[-1]) >= latest_hour:
+                break
+            self._align_combined_extract(nth_combined_image, self.__coma_correction_fn)
+            self.__no_of_corrected_combinations = nth_combined_image + 1
+
+
+def watch_night(
+    night: ConfigInputNight,
+    config: Config,
+    output: Path,
+    night_date: date,
+    poll_interval: float,
+    idle_timeout: float,
+    use_inotify=True,
+):
+    """
+    Processes `night` as its raw images are written, until no raw image is
+    written for `idle_timeout` seconds or the user interrupts with Ctrl-C,
+    after which the rest of the night is processed. See `LiveNight`.
+
+    The folder of raw images is looked at every `poll_interval` seconds, or as
+    soon as a file is written to it where inotify is available.
+    """
+    live_night = LiveNight(night, config, output, night_date)
+    live_night.start()
+    logger = logging.getLogger("LOGGER_" + str(night_date))
+
+    NIGHT_INPUT_IMAGES_FOLDER = night["path"] / M23_RAW_IMAGES_FOLDER_NAME
+    NIGHT_INPUT_CALIBRATION_FOLDER = night["path"] / INPUT_CALIBRATION_FOLDER_NAME
+    image_duration = config["processing"]["image_duration"]
+    dark_prefix = config["processing"]["dark_prefix"]
+
+    def all_dark_paths():
+        return sorted(get_darks(NIGHT_INPUT_CALIBRATION_FOLDER, image_duration, dark_prefix))
+
+    with FolderWatcher(
+        [NIGHT_INPUT_IMAGES_FOLDER, NIGHT_INPUT_CALIBRATION_FOLDER], poll_interval, use_inotify
+    ) as watcher:
+        if watcher.uses_inotify():
+            logger.info(f"Watching {NIGHT_INPUT_IMAGES_FOLDER} for raw images")
+        else:
+            logger.info(
+                f"Looking for raw images in {NIGHT_INPUT_IMAGES_FOLDER} every {poll_interval}s"
+            )
+        last_raw_image_time = time.monotonic()
+        try:
+            while True:
+                paths = raw_image_paths(night, config)
+                if night.get("image_prefix"):
+                    paths = sorted_by_number(paths)
+                settled_paths = watcher.settled(paths)
+                dark_paths = all_dark_paths()
+                settled_dark_paths = watcher.settled(dark_paths)
+                # The master dark is made only from darks that are all written
+                if len(settled_dark_paths) < len(dark_paths):
+                    settled_dark_paths = []
+                if live_night.update(settled_paths, settled_dark_paths) > 0:
+                    last_raw_image_time = time.monotonic()
+                elif time.monotonic() - last_raw_image_time >= idle_timeout:
+                    logger.info(f"No new raw images for {idle_timeout}s. Ending live processing")
+                    break
+                is_being_written = len(settled_paths) < len(paths) or len(
+                    settled_dark_paths
+                ) < len(dark_paths)
+                watcher.wait(SETTLE_INTERVAL if is_being_written else None)
+        except KeyboardInterrupt:
+            logger.info("Live processing interrupted. Processing the rest of the night")
+    live_night.finish(all_dark_paths())
+
+
+def start_watching_auxiliary(config: Config, poll_interval: float, idle_timeout: float):
+    nights = config["input"]["nights"]
+    if len(nights) != 1:
+        sys.stderr.write(f"Exactly one night can be watched, found {len(nights)} in config\n")
+        return
+    night = nights[0]
+    night_date = get_date_from_input_night_folder_name(night["path"].name)
+    OUTPUT_NIGHT_FOLDER = config["output"]["path"] / get_output_folder_name_from_night_date(
+        night_date
+    )
+    OUTPUT_NIGHT_FOLDER.mkdir(parents=True, exist_ok=True)
+    watch_night(night, config, OUTPUT_NIGHT_FOLDER, night_date, poll_interval, idle_timeout)
+
+
+def start_watching(file_path: str, poll_interval: float, idle_timeout: float):
+    """
+    Processes the night in the configuration file `file_path` as its raw images
+    are written. The raw images are looked for every `poll_interval` seconds and
+    live processing ends when no raw image is written for `idle_timeout` seconds.
+    """
+    validate_file(
+        Path(file_path),
+        on_success=partial(
+            start_watching_auxiliary, poll_interval=poll_interval, idle_timeout=idle_timeout
+        ),
+        live=True,
+    )
@@ -3,21 +3,22 @@ import re
 from datetime import date, datetime
 from decimal import ROUND_HALF_UP, Decimal
 from pathlib import Path, PosixPath
-from typing import Iterable, List, Union
+from typing import TYPE_CHECKING, Iterable, List, Union
 
 import numpy as np
-from astropy.io.fits import getdata as getfitsdata
 from numpy.typing import DTypeLike
 
 from m23.constants import (
     INPUT_NIGHT_FOLDER_NAME_DATE_FORMAT,
     OUTPUT_NIGHT_FOLDER_NAME_DATE_FORMAT,
 )
-from m23.file.raw_image_file import RawImageFile
 
 # local imports
 from .rename import rename
 
+if TYPE_CHECKING:
+    from m23.file.raw_image_file import RawImageFile
+
 
 def get_image_number_in_log_file_combined_file(file: Path) -> int:
     """
@@ -80,11 +81,14 @@ def get_all_fit_files(folder: Path, image_duration=None, prefix="") -> Iterable[
     return result
 
 
-def get_raw_images(folder: Path, image_duration=None) -> Iterable[RawImageFile]:
+def get_raw_images(folder: Path, image_duration=None) -> Iterable["RawImageFile"]:
     """
     Return a list `RawImageFile` files in `folder` provided sorted asc. by image number
     Note that only filenames matching the naming convention of RawImageFile are returned
     """
+    # Imported here as astropy is slow to import and not needed by all of m23.utils
+    from m23.file.raw_image_file import RawImageFile
+
     all_files = [RawImageFile(file.absolute()) for file in folder.glob("*.fit")]
     # Filter files whose filename don't match naming convention
     all_files = filter(lambda raw_image_file: raw_image_file.is_valid_file_name(), all_files)
@@ -107,7 +111,7 @@ def time_taken_to_capture_and_save_a_raw_file(folder_path: Path, night_config) -
         Exception if no raw image is present in the given folder
 
     """
-    raw_images: Iterable[RawImageFile] = list(get_raw_images(folder_path))
+    raw_images = list(get_raw_images(folder_path))
     first_img = raw_images[0]
     last_image = raw_images[-1]
     no_of_images = len(raw_images)
@@ -161,10 +165,12 @@ def fitFilesInFolder(folder, fileType="All"):
 
 
 def fitDataFromFitImages(images):
-    return [getfitsdata(item) for item in images]
+    return fit_data_from_fit_images(images)
 
 
 def fit_data_from_fit_images(images: Iterable[str | Path]) -> List[DTypeLike]:
+    from astropy.io.fits import getdata as getfitsdata
+
     return [getfitsdata(item) for item in images]
 
 
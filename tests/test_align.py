@@ -0,0 +1,197 @@
+import inspect
+from datetime import datetime
+
+import astroalign as ast
+import numpy as np
+import pytest
+from astropy.io.fits import getdata as getfitsdata
+from m23.align import (
+    ReferenceAligner,
+    image_alignment,
+    predict_transformation,
+    reference_aligner,
+    warp_image,
+)
+from m23.align.catalog import catalog_aligner
+from m23.align.phase import phase_correlation_aligner
+from m23.bench.synthetic import generate_synthetic_night, synthetic_raw_images
+from m23.constants import WARP_BACKEND_OPENCV
+from m23.exceptions import CouldNotAlignException
+from m23.file.alignment_stats_file import AlignmentStatsFile
+from scipy.ndimage import binary_dilation
+from skimage.transform import SimilarityTransform
+
+
+def test_astroalign_private_functions():
+    # The aligners use these private functions of astroalign, which may change in
+    # versions of astroalign other than the one it's pinned to
+    for name in ["_find_sources", "_bw", "_generate_invariants", "_ransac"]:
+        assert callable(getattr(ast, name, None)), f"astroalign {ast.__version__} has no {name}"
+    assert {"img", "detection_sigma", "min_area"} <= set(
+        inspect.signature(ast._find_sources).parameters
+    )
+    assert inspect.signature(ast._ransac).parameters.keys() == {
+        "data",
+        "model",
+        "thresh",
+        "min_matches",
+    }
+    model = ast._MatchTransform(np.zeros((3, 2)), np.zeros((3, 2)))
+    assert callable(model.fit)
+
+
+def test_reference_aligner_matches_find_transform(tmp_path):
+    night = generate_synthetic_night(tmp_path, no_of_images=3, no_of_darks=1, no_of_stars=100)
+    ref_image_name = night["reference_image"]
+    ref_image_data = np.array(getfitsdata(ref_image_name), dtype="float")
+    image_data = np.array(getfitsdata(synthetic_raw_images(night)[-1]), dtype="float")
+
+    t, _ = ast.find_transform(
+        source=image_data,
+        target=ref_image_data,
+        max_control_points=50,
+        detection_sigma=5,
+        min_area=5,
+    )
+    expected, _ = ast.apply_transform(t, image_data, ref_image_data, fill_value=0)
+    aligned_data, (rotation, translation_x, translation_y, scale), residual = ReferenceAligner(
+        ref_image_name
+    ).align(image_data)
+    assert np.array_equal(aligned_data, expected)
+    assert (rotation, translation_x, translation_y, scale) == (t.rotation, *t.translation, t.scale)
+    assert residual < 0.5
+
+    assert reference_aligner(ref_image_name) is reference_aligner(ref_image_name)
+    with pytest.raises(CouldNotAlignException):
+        image_alignment(np.zeros_like(image_data), ref_image_name)
+
+
+def test_seeded_alignment(tmp_path):
+    night = generate_synthetic_night(tmp_path, no_of_images=4, no_of_darks=1, no_of_stars=100)
+    aligner = ReferenceAligner(night["reference_image"])
+    images_data = [getfitsdata(path) for path in synthetic_raw_images(night)]
+    transformations = [aligner.align(image_data)[1] for image_data in images_data]
+
+    predicted = predict_transformation(
+        [(datetime(2019, 9, 4, 3, 0, 0), transformations[0])], datetime(2019, 9, 4, 3, 0, 10)
+    )
+    assert predicted == transformations[0]
+    predicted = predict_transformation(
+        [
+            (datetime(2019, 9, 4, 3, 0, 0), (0, 1, 2, 1)),
+            (datetime(2019, 9, 4, 3, 0, 10), (0, 2, 4, 1)),
+        ],
+        datetime(2019, 9, 4, 3, 0, 30),
+    )
+    assert predicted == (0, 4, 8, 1)
+
+    # Each image is aligned with the transformation of the image before it as prediction
+    for image_data, previous_transformation, transformation in zip(
+        images_data[1:], transformations, transformations[1:]
+    ):
+        _, seeded_transformation, _ = aligner.align(image_data, previous_transformation)
+        assert np.allclose(seeded_transformation, transformation, atol=0.1)
+    # Transformations that are off by more than the search radius aren't verified
+    _, _, translation_y, _ = transformations[0]
+    image_data = np.array(images_data[0], dtype="float")
+    assert aligner.refine_transform(image_data, (0, 50, translation_y, 1)) is None
+
+
+def test_catalog_alignment(tmp_path):
+    night = generate_synthetic_night(tmp_path, no_of_images=3, no_of_darks=1, no_of_stars=300)
+    astroalign_aligner = ReferenceAligner(night["reference_image"])
+    aligner = catalog_aligner(night["reference_file"], night["reference_image"])
+    assert catalog_aligner(night["reference_file"], night["reference_image"]) is aligner
+    for path in synthetic_raw_images(night):
+        image_data = getfitsdata(path)
+        aligned_data, transformation, residual = aligner.align(image_data)
+        _, expected_transformation, _ = astroalign_aligner.align(image_data)
+        assert aligned_data.shape == (1024, 1024)
+        assert np.allclose(transformation, expected_transformation, atol=0.2)
+        assert residual < 0.5
+
+    with pytest.raises(CouldNotAlignException):
+        aligner.align(np.random.default_rng(0).normal(100, 10, (1024, 1024)))
+
+
+def test_catalog_alignment_with_spurious_bright_source(tmp_path):
+    night = generate_synthetic_night(tmp_path, no_of_images=1, no_of_darks=1, no_of_stars=300)
+    aligner = catalog_aligner(night["reference_file"], night["reference_image"])
+    image_data = np.array(getfitsdata(synthetic_raw_images(night)[0]), dtype="float")
+    _, expected_transformation, _ = aligner.align(image_data)
+    # A bright blob (a satellite, a hot column, etc.) that isn't in the catalog is
+    # the brightest source, which used to be mapped with all the other sources
+    # onto a pair of close catalog stars by a transformation with a tiny scale
+    y, x = np.mgrid[:1024, :1024]
+    for blob_x, blob_y in [(900, 100), (500, 500), (60, 60)]:
+        blob = 5e5 * np.exp(-((x - blob_x) ** 2 + (y - blob_y) ** 2) / 18)
+        _, transformation, residual = aligner.align(image_data + blob)
+        assert np.allclose(transformation, expected_transformation, atol=0.1)
+        assert residual < 0.5
+
+
+def test_alignment_stats_file(tmp_path):
+    alignment_stats_file = AlignmentStatsFile(tmp_path / "stats.txt")
+    alignment_stats_file.create_file_and_write_header()
+    alignment_stats_file.add_record("m23_7.0-001.fit", (0.0001, 1.5, -2.25, 1.0), 0.1234)
+    alignment_stats_file.add_record("m23_7.0-002.fit", (0.0001, 1.5, -2.25, 1.0))
+    header, first, second = alignment_stats_file.path().read_text().splitlines()
+    assert header.split() == [
+        "Image_Name",
+        "Rotation",
+        "Translation_X",
+        "Translation_Y",
+        "Scale",
+        "Residual",
+    ]
+    assert first.split() == ["m23_7.0-001.fit", "0.000100000", "1.500", "-2.250", "1.000", "0.123"]
+    assert second.split()[-1] == "nan"
+
+
+def test_phase_correlation_alignment(tmp_path):
+    night = generate_synthetic_night(tmp_path, no_of_images=1, no_of_darks=1, no_of_stars=100)
+    ref_image_data = np.array(getfitsdata(night["reference_image"]), dtype="float")
+    # The reference image doesn't have noise
+    image_data = np.random.default_rng(0).poisson(np.roll(ref_image_data, (3, -5), axis=(0, 1)))
+
+    aligner = phase_correlation_aligner(night["reference_image"], 0.0001)
+    assert aligner.find_translation(image_data) == (5, -3)
+    _, (rotation, translation_x, translation_y, scale), residual = aligner.align(image_data)
+    assert (rotation, scale) == (0, 1)
+    assert abs(translation_x - 5) < 0.05 and abs(translation_y + 3) < 0.05
+    assert residual < 0.1
+
+    # Images that are rotated are aligned with the full similarity transformation
+    image_data = getfitsdata(synthetic_raw_images(night)[0])
+    aligned_data, transformation, _ = phase_correlation_aligner(
+        night["reference_image"], 0
+    ).align(image_data)
+    expected_aligned_data, expected_transformation, _ = ReferenceAligner(
+        night["reference_image"]
+    ).align(image_data)
+    assert transformation == expected_transformation
+    assert np.array_equal(aligned_data, expected_aligned_data)
+
+
+def test_opencv_warp_backend(tmp_path):
+    night = generate_synthetic_night(tmp_path, no_of_images=1, no_of_darks=1, no_of_stars=100)
+    image_data = np.array(getfitsdata(synthetic_raw_images(night)[0]), dtype="float")
+    t = SimilarityTransform(rotation=0.002, translation=(3.2, -5.7), scale=1.0001)
+
+    expected = warp_image(t, image_data, image_data.shape)
+    warped = warp_image(t, image_data, image_data.shape, WARP_BACKEND_OPENCV)
+    # Pixels outside the image are the same, except for a few along its edge that
+    # OpenCV sets to 0 too, as it interpolates the footprint less precisely
+    assert np.all(warped[expected == 0] == 0)
+    extra_zeros = (warped == 0) & (expected != 0)
+    assert extra_zeros.sum() < 100
+    assert np.all(binary_dilation(expected == 0)[extra_zeros])
+    assert abs(warped.sum() / expected.sum() - 1) < 1e-4
+    # Flux of the stars
+    star_rows, star_cols = np.nonzero(
+        (expected > np.percentile(expected, 99.9)) & (warped != 0) & (expected != 0)
+    )
+    for row, col in zip(star_rows, star_cols):
+        if 5 <= row < expected.shape[0] - 5 and 5 <= col < expected.shape[1] - 5:
+            aperture = np.s_[row - 5 : row + 6, col - 5 : col + 6]
+            assert abs(warped[aperture].sum() / expected[aperture].sum() - 1) < 0.005
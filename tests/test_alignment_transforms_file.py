@@ -0,0 +1,36 @@
+import os
+
+from m23.file.alignment_transforms_file import AlignmentTransformsFile
+
+
+def test_alignment_transforms_are_stored(tmp_path):
+    first, second = tmp_path / "m23_7.0-001.fit", tmp_path / "m23_7.0-002.fit"
+    first.write_bytes(b"1")
+    second.write_bytes(b"2")
+    transforms_file = AlignmentTransformsFile(tmp_path / "transforms.sqlite")
+    assert transforms_file.transforms([first, second], "hash", "astroalign") == {}
+
+    transforms_file.add_transforms(
+        [(first, (0.0001, 1.5, -2.25, 1.0), 0.125), (second, (0.0, 3.0, 4.0, 1.0), None)],
+        "hash",
+        "astroalign",
+    )
+    transforms_file = AlignmentTransformsFile(tmp_path / "transforms.sqlite")
+    assert transforms_file.transforms([first, second], "hash", "astroalign") == {
+        first: ((0.0001, 1.5, -2.25, 1.0), 0.125),
+        second: ((0.0, 3.0, 4.0, 1.0), None),
+    }
+    # Transformations found with another reference image or alignment method
+    assert transforms_file.transforms([first], "other hash", "astroalign") == {}
+    assert transforms_file.transforms([first], "hash", "catalog") == {}
+
+    # Transformations of raw images that have changed since aren't used
+    stat = second.stat()
+    os.utime(second, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert list(transforms_file.transforms([first, second], "hash", "astroalign")) == [first]
+
+    # Transformations found again replace the stored ones
+    transforms_file.add_transforms([(second, (0.0, 3.5, 4.0, 1.0), 0.5)], "hash", "astroalign")
+    assert transforms_file.transforms([second], "hash", "astroalign") == {
+        second: ((0.0, 3.5, 4.0, 1.0), 0.5)
+    }
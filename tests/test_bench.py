@@ -0,0 +1,71 @@
+from astropy.io import fits
+
+from m23.bench import (
+    compare_with_baseline,
+    format_results,
+    generate_synthetic_night,
+    run_benchmarks,
+)
+from m23.file.raw_image_file import RawImageFile
+from m23.file.reference_log_file import ReferenceLogFile
+from m23.utils import get_darks, get_raw_images
+
+
+def test_generate_synthetic_night(tmp_path):
+    night = generate_synthetic_night(tmp_path, no_of_images=3, no_of_darks=2, no_of_stars=20)
+    assert night["path"].name == "September 04, 2019"
+    raw_images = get_raw_images(night["path"] / "m23", night["image_duration"])
+    assert [raw_image.image_number() for raw_image in raw_images] == [1, 2, 3]
+    assert len(list(get_darks(night["path"] / "Calibration Frames", 7.0))) == 2
+    assert raw_images[0].header()["DATE-OBS"] == "2019-09-05T03:40:00"
+    assert raw_images[0].data().shape == (1024, 1024)
+    assert fits.getdata(night["masterflat"]).shape == (1024, 1024)
+
+    reference_log_file = ReferenceLogFile(night["reference_file"])
+    assert len(reference_log_file.data()) == night["no_of_stars"] == 20
+    # Stars are drawn at the positions in the reference file
+    x, y = reference_log_file.get_star_xy(1)
+    reference_image = RawImageFile(night["reference_image"]).data()
+    assert reference_image[round(y), round(x)] > 2 * reference_image[10, 10]
+
+
+def test_synthetic_night_star_positions_scale_with_size(tmp_path):
+    small = generate_synthetic_night(tmp_path / "small", no_of_images=1, no_of_stars=5)
+    large = generate_synthetic_night(tmp_path / "large", size=2048, no_of_images=1, no_of_stars=5)
+    small_x, small_y = ReferenceLogFile(small["reference_file"]).get_star_xy(1)
+    large_x, large_y = ReferenceLogFile(large["reference_file"]).get_star_xy(1)
+    assert abs(large_x - 2 * small_x) < 0.02 and abs(large_y - 2 * small_y) < 0.02
+
+
+def test_run_benchmarks():
+    results = run_benchmarks(
+        sizes=[1024],
+        benchmarks=["master_dark", "calibration"],
+        repeat=2,
+        no_of_stars=20,
+        measure_memory=True,
+    )
+    calibration = results["results"]["1024"]["calibration"]
+    assert len(calibration["times"]) == 2
+    assert min(calibration["times"]) <= calibration["median"] <= calibration["p95"]
+    assert set(results["results"]["1024"]) == {"master_dark", "calibration"}
+    # Calibrating 10 images of 1024x1024 makes 10 float32 images
+    assert calibration["peak_memory"] > 10 * 1024 * 1024 * 4
+
+    table = format_results(results).splitlines()
+    assert len(table) == 3
+    assert table[2].split()[:2] == ["1024x1024", "calibration"]
+
+
+def test_compare_with_baseline():
+    def results_with_medians(medians):
+        return {
+            "results": {
+                "1024": {name: {"median": median} for name, median in medians.items()},
+            }
+        }
+
+    baseline = results_with_medians({"alignment": 1.0, "extraction": 2.0})
+    results = results_with_medians({"alignment": 1.1, "extraction": 3.0, "calibration": 1.0})
+    regressions = compare_with_baseline(results, baseline, tolerance=0.2)
+    assert regressions == ["extraction (1024x1024): 3.000 s, baseline 2.000 s (+50%)"]
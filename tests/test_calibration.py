@@ -0,0 +1,82 @@
+import numpy as np
+from m23.calibrate.calibration import (
+    CalibrationContext,
+    applyCalibration,
+    getCenterAverage,
+    getHotPixelPositions,
+    recalibrateAtHotLocations,
+)
+from m23.matrix import fillMatrix
+
+
+def master_frames(size=1024, seed=0):
+    rng = np.random.default_rng(seed)
+    master_dark = rng.normal(100, 5, (size, size))
+    # Hot pixels, some of them next to each other and at the edges
+    hot_pixels = rng.integers(0, size, (500, 2))
+    master_dark[hot_pixels[:, 0], hot_pixels[:, 1]] = 5000
+    master_dark[500:502, 600:602] = 5000
+    master_flat = rng.normal(20000, 500, (size, size)).astype("float32")
+    master_flat[10, 20] = 0
+    return master_dark, master_flat, rng
+
+
+def test_calibration_context_matches_apply_calibration():
+    master_dark, master_flat, rng = master_frames()
+    context = CalibrationContext(master_dark, master_flat)
+    for image_data in [
+        rng.poisson(300, master_dark.shape).astype("uint16"),
+        rng.normal(300, 200, master_dark.shape),
+    ]:
+        expected = applyCalibration(
+            image_data,
+            master_dark,
+            master_flat,
+            getCenterAverage(master_flat),
+            getHotPixelPositions(master_dark),
+        )
+        calibrated = context.calibrate(image_data)
+        assert calibrated.dtype == expected.dtype
+        assert np.array_equal(calibrated, expected)
+
+
+def test_calibration_context_fills_crop_region():
+    master_dark, master_flat, rng = master_frames(size=2048)
+    crop_region = [
+        [[0, 448], [0, 0], [492, 0], [210, 181]],
+        [[1400, 2048], [2048, 2048], [2048, 1500], [1834, 1830]],
+    ]
+    image_data = rng.poisson(300, master_dark.shape).astype("uint16")
+    calibrated = CalibrationContext(master_dark, master_flat).calibrate(image_data)
+    expected = fillMatrix(calibrated.copy(), crop_region, 1)
+
+    context = CalibrationContext(master_dark, master_flat, crop_region)
+    assert np.array_equal(context.fill_crop_region(context.calibrate(image_data)), expected)
+
+
+def recalibrate_at_hot_locations_one_by_one(locations, calibrated_image_data):
+    # How the hot pixels were recalibrated before, one after another
+    for row, col in locations:
+        surrounding_sum = np.sum(calibrated_image_data[row - 1 : row + 2, col - 1 : col + 2])
+        calibrated_image_data[row][col] = (surrounding_sum - calibrated_image_data[row][col]) / 8
+
+
+def test_recalibrate_at_hot_locations_matches_one_by_one():
+    master_dark, _, rng = master_frames()
+    locations = getHotPixelPositions(master_dark)
+    # Blocks and a line of hot pixels, which are next to each other, in no particular order
+    extra_locations = [[r, c] for r in range(200, 204) for c in range(300, 303)]
+    extra_locations += [[700, c] for c in range(100, 110)]
+    extra_locations = rng.permutation(extra_locations)
+    locations = np.concatenate([extra_locations, locations[::-1], [[20, 30], [21, 31]]])
+
+    calibrated_image_data = rng.normal(300, 200, master_dark.shape).astype("float32")
+    calibrated_image_data[master_dark > 1000] = 20000
+    expected = calibrated_image_data.copy()
+    recalibrate_at_hot_locations_one_by_one(locations, expected)
+    recalibrateAtHotLocations(locations, calibrated_image_data)
+    assert np.array_equal(calibrated_image_data, expected)
+
+    # No hot pixels
+    recalibrateAtHotLocations([], calibrated_image_data)
+    assert np.array_equal(calibrated_image_data, expected)
@@ -0,0 +1,48 @@
+import datetime
+
+import numpy as np
+from astropy.io import fits
+
+from m23.coma import coma_group_name_for_image, sample_combinations_for_coma_groups
+from m23.file.aligned_combined_file import AlignedCombinedFile
+from m23.file.raw_image_file import RawImageFile
+
+
+def create_raw_images(folder, image_numbers, start, seconds_per_image):
+    raw_images = []
+    for i, image_number in enumerate(image_numbers):
+        path = folder / f"m23_7.0-{image_number:03}.fit"
+        header = fits.Header()
+        observed = start + datetime.timedelta(seconds=seconds_per_image * i)
+        header["DATE-OBS"] = observed.strftime("%Y-%m-%dT%H:%M:%S")
+        fits.writeto(path, np.zeros((4, 4), dtype="int16"), header=header)
+        raw_images.append(RawImageFile(path))
+    return raw_images
+
+
+def test_sample_combinations_for_coma_groups(tmp_path):
+    # 3 images per combination, 10 minutes per image gives 2 combinations an hour
+    start = datetime.datetime(2019, 9, 5, 3, 0, 0)
+    raw_images = create_raw_images(tmp_path, range(1, 31), start, 600)
+    result = sample_combinations_for_coma_groups(raw_images, 3)
+    assert list(result.keys()) == ["05-03", "05-04", "05-05", "05-06", "05-07"]
+    # The combination in the middle of the hour is preferred
+    assert result["05-03"] == [1, 0]
+    assert result["05-07"] == [9, 8]
+
+
+def test_sample_combinations_for_coma_groups_skips_non_sequential(tmp_path):
+    start = datetime.datetime(2019, 9, 5, 3, 0, 0)
+    image_numbers = [1, 2, 3, 4, 5, 9, 10, 11, 12]
+    raw_images = create_raw_images(tmp_path, image_numbers, start, 10)
+    result = sample_combinations_for_coma_groups(raw_images, 3)
+    assert result == {"05-03": [2, 0]}
+
+
+def test_coma_group_name_for_unsaved_aligned_combined_file(tmp_path):
+    start = datetime.datetime(2019, 9, 5, 3, 0, 0)
+    raw_images = create_raw_images(tmp_path, range(1, 4), start, 10)
+    aligned_combined = AlignedCombinedFile(tmp_path / "m23_7.0-0001.fit")
+    aligned_combined.set_header_from(raw_images[1])
+    assert not aligned_combined.exists()
+    assert coma_group_name_for_image(aligned_combined) == "05-03"
@@ -0,0 +1,69 @@
+import shutil
+
+import m23.extract
+import m23.norm
+import numpy as np
+import toml
+from m23.bench import RecordedInputs, SyntheticInputs, check_equivalence
+from m23.bench.equivalence import LOG_FILE_COMBINED_TOLERANCES, compare_columns
+from m23.constants import CONFIG_FILE_NAME, LOG_FILES_COMBINED_FOLDER_NAME
+
+
+def test_compare_columns():
+    legacy = {"X": np.array([1.0, 2.0, np.nan]), "Star ADU 5": np.array([1e6, 2e6, 3e6])}
+    optimized = {"X": np.array([1.01, 2.0, np.nan]), "Star ADU 5": np.array([1e6, 2e6, 3e6])}
+    deviations, failures = compare_columns(legacy, optimized, LOG_FILE_COMBINED_TOLERANCES)
+    assert failures == []
+    assert abs(deviations["X"] - 0.01) < 1e-9 and deviations["Star ADU 5"] == 0
+
+    optimized["X"][2] = 3.0
+    optimized["Star ADU 5"][1] = 2e6 + 1
+    deviations, failures = compare_columns(legacy, optimized, LOG_FILE_COMBINED_TOLERANCES, "f")
+    assert deviations["X"] == np.inf
+    assert failures == [
+        "f: X in row 3 is 3.0, expected nan (1 values over tolerance)",
+        "f: Star ADU 5 in row 2 is 2000001.0, expected 2000000.0 (1 values over tolerance)",
+    ]
+
+
+def test_check_equivalence_of_extraction(tmp_path):
+    inputs = SyntheticInputs(tmp_path / "inputs", no_of_stars=20)
+    result = check_equivalence(
+        "newStarCenters", m23.extract.newStarCenters, inputs, tmp_path / "same"
+    )
+    assert result["failures"] == []
+    assert result["max_deviation"]["Star ADU 3"] == 0 and result["speedup"] > 0
+
+    legacy_flux_log_for_radius = m23.extract.flux_log_for_radius
+
+    def brighter_flux_log_for_radius(*args):
+        return [(total, bg, flux * 1.001) for total, bg, flux in legacy_flux_log_for_radius(*args)]
+
+    result = check_equivalence(
+        "flux_log_for_radius", brighter_flux_log_for_radius, inputs, tmp_path / "brighter"
+    )
+    assert len(result["failures"]) == 3  # One for each radius of extraction
+    assert result["max_deviation"]["X"] == 0 and result["max_deviation"]["Star ADU 5"] > 100
+    # The legacy implementation is restored
+    assert m23.extract.flux_log_for_radius is legacy_flux_log_for_radius
+
+
+def test_check_equivalence_of_intranight_normalization_of_recorded_night(tmp_path):
+    inputs = SyntheticInputs(tmp_path / "inputs", no_of_stars=20)
+    night_folder = tmp_path / "output" / inputs.context.night["path"].name
+    for log_file in inputs.log_files_combined():
+        (night_folder / LOG_FILES_COMBINED_FOLDER_NAME).mkdir(parents=True, exist_ok=True)
+        shutil.copy(log_file.path(), night_folder / LOG_FILES_COMBINED_FOLDER_NAME)
+    with (night_folder / CONFIG_FILE_NAME).open("w") as fd:
+        toml.dump({"processing": {"image_duration": 7.0, "radii_of_extraction": [3, 5]}}, fd)
+    recorded_inputs = RecordedInputs(
+        night_folder, {"file": str(inputs.context.night["reference_file"])}
+    )
+
+    result = check_equivalence(
+        "normalize_log_files", m23.norm.normalize_log_files, recorded_inputs, tmp_path / "norm"
+    )
+    assert result["inputs"] == "September 04, 2019"
+    assert result["failures"] == []
+    assert set(result["max_deviation"]) == {"ADU", "X", "Y", "Norm", "Datetime"}
+    assert len(list((tmp_path / "norm" / "optimized").glob("*/*_flux.txt"))) == 40
@@ -0,0 +1,41 @@
+import threading
+import time
+
+from m23.file.folder_watcher import FIT_BLOCK_SIZE, FolderWatcher
+
+
+def test_settled_files_are_completely_written(tmp_path):
+    paths = [tmp_path / f"m23_7.0-00{i}.fit" for i in range(1, 4)]
+    paths[0].write_bytes(b"0" * FIT_BLOCK_SIZE)
+    paths[1].write_bytes(b"0" * FIT_BLOCK_SIZE * 2)
+    with FolderWatcher([tmp_path], poll_interval=1, use_inotify=False) as watcher:
+        # Files need to be seen unchanged twice to be settled
+        assert watcher.settled(paths) == []
+        assert watcher.settled(paths) == paths[:2]
+
+        # A file that's being written stops files after it from being settled
+        paths[2].write_bytes(b"0" * 100)
+        paths[1].write_bytes(b"0" * FIT_BLOCK_SIZE * 3)
+        assert watcher.settled(paths) == paths[:1]
+        assert watcher.settled(paths) == paths[:2]
+        paths[2].write_bytes(b"0" * FIT_BLOCK_SIZE)
+        watcher.settled(paths)
+        assert watcher.settled(paths) == paths
+
+
+def test_wait(tmp_path):
+    with FolderWatcher([tmp_path], poll_interval=0.2, use_inotify=False) as watcher:
+        assert not watcher.uses_inotify()
+        start = time.monotonic()
+        watcher.wait()
+        assert time.monotonic() - start >= 0.2
+
+    with FolderWatcher([tmp_path], poll_interval=30) as watcher:
+        if not watcher.uses_inotify():
+            return  # inotify isn't available on this system
+        timer = threading.Timer(0.1, (tmp_path / "m23_7.0-001.fit").write_bytes, [b"0"])
+        timer.start()
+        start = time.monotonic()
+        watcher.wait()
+        assert time.monotonic() - start < 10
+        timer.join()
@@ -0,0 +1,48 @@
+import subprocess
+import sys
+
+import m23.processor
+
+# Modules that are slow to import and only needed to process nights
+HEAVY_MODULES = ["matplotlib", "astropy", "scipy", "pandas", "cv2", "astroalign", "regularizepsf"]
+
+
+def imported_heavy_modules(code: str):
+    """
+    Returns the heavy modules imported by running `code` in a new Python process
+    """
+    check = (
+        "import sys\n"
+        f"print('Imported:', *(m for m in {HEAVY_MODULES} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", f"{code}\n{check}"], check=True, capture_output=True, text=True
+    )
+    # Ignore what `code` prints before the imported modules
+    return result.stdout.splitlines()[-1].split()[1:]
+
+
+def test_csv_subcommand_doesnt_import_heavy_modules():
+    assert imported_heavy_modules("from m23.processor import create_nights_csv") == []
+    code = (
+        "import runpy, sys\n"
+        "sys.argv = ['m23', 'csv', '--help']\n"
+        "try:\n"
+        "    runpy.run_module('m23', run_name='__main__')\n"
+        "except SystemExit:\n"
+        "    pass"
+    )
+    assert imported_heavy_modules(code) == []
+
+
+def test_processor_functions_are_imported_when_used():
+    from m23.processor.process_nights import start_data_processing
+
+    assert m23.processor.start_data_processing is start_data_processing
+    assert "start_data_processing" in dir(m23.processor)
+    try:
+        m23.processor.not_a_function
+    except AttributeError:
+        pass
+    else:
+        assert False, "Expected AttributeError"
@@ -0,0 +1,75 @@
+import threading
+import time
+
+import numpy as np
+from astropy.io import fits
+
+from m23.processor.memory import (
+    MemoryBudget,
+    combination_memory_estimate,
+    processes_within_budget,
+    raw_image_bytes_per_pixel,
+)
+
+
+def header_of(data) -> fits.Header:
+    return fits.PrimaryHDU(data).header
+
+
+def test_raw_image_bytes_per_pixel():
+    # Unsigned 16 bit data, as written by the cameras, are read as uint16
+    hdu = fits.PrimaryHDU(np.zeros((4, 4), dtype="uint16"))
+    hdu.scale("int16", bzero=32768)
+    assert raw_image_bytes_per_pixel(hdu.header) == 2
+    assert raw_image_bytes_per_pixel(header_of(np.zeros((4, 4), dtype="int32"))) == 4
+    assert raw_image_bytes_per_pixel(header_of(np.zeros((4, 4), dtype="float64"))) == 8
+    scaled = header_of(np.zeros((4, 4), dtype="int16"))
+    scaled["BSCALE"] = 2
+    assert raw_image_bytes_per_pixel(scaled) == 4
+
+
+def test_combination_memory_estimate_scales_with_image_size():
+    small = combination_memory_estimate(header_of(np.zeros((1024, 1024), dtype="int16")), 10)
+    large = combination_memory_estimate(header_of(np.zeros((2048, 2048), dtype="int16")), 10)
+    assert large == 4 * small
+    # At least the raw and aligned data of every image of the combination
+    assert small > 1024 * 1024 * 10 * (2 + 8)
+
+
+def test_processes_within_budget():
+    assert processes_within_budget(8, 3, 10) == 3
+    assert processes_within_budget(2, 3, 10) == 2
+    # At least one process is used even if it doesn't fit within the budget
+    assert processes_within_budget(8, 30, 10) == 1
+    # No limit
+    assert processes_within_budget(8, 30, 0) == 8
+
+
+def test_memory_budget():
+    budget = MemoryBudget(10)
+    assert budget.acquire(6)
+    assert not budget.acquire(6, blocking=False)
+    assert budget.acquire(4, blocking=False)
+
+    acquired = threading.Event()
+
+    def acquire():
+        budget.acquire(6)
+        acquired.set()
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    time.sleep(0.05)
+    assert not acquired.is_set()
+    budget.release(6)
+    thread.join(timeout=5)
+    assert acquired.is_set()
+    assert budget.bytes_in_use() == 10
+
+
+def test_memory_budget_admits_large_work_when_idle():
+    budget = MemoryBudget(10)
+    assert budget.acquire(20, blocking=False)
+    assert not budget.acquire(1, blocking=False)
+    budget.release(20)
+    assert MemoryBudget(0).acquire(10**12, blocking=False)
@@ -0,0 +1,25 @@
+from pathlib import Path
+
+import numpy as np
+from astropy.io import fits
+
+from m23.processor.night_costs import largest_first, processing_cost
+
+
+def create_night(folder: Path, no_of_images: int, size: int) -> Path:
+    raw_images_folder = folder / "m23"
+    raw_images_folder.mkdir(parents=True)
+    for i in range(1, no_of_images + 1):
+        data = np.zeros((size, size), dtype="int16")
+        fits.writeto(raw_images_folder / f"m23_7.0-{i:03}.fit", data)
+    return folder
+
+
+def test_processing_cost(tmp_path):
+    config = {"processing": {"image_duration": 7.0}}
+    small = {"path": create_night(tmp_path / "small", 3, 8)}
+    large = {"path": create_night(tmp_path / "large", 2, 16)}
+    empty = {"path": create_night(tmp_path / "empty", 0, 8)}
+    costs = [processing_cost(night, config) for night in [small, large, empty]]
+    assert costs == [3 * 8 * 8, 2 * 16 * 16, 0]
+    assert largest_first([small, large, empty], costs) == [large, small, empty]
@@ -0,0 +1,48 @@
+import shutil
+from datetime import date
+
+from m23.bench.synthetic import generate_synthetic_night
+from m23.constants import LOG_FILES_COMBINED_FOLDER_NAME
+from m23.processor.config_loader import (
+    create_processing_config,
+    load_configuration_with_necessary_reference_files,
+)
+from m23.processor.process_nights import start_data_processing_auxiliary
+from m23.utils import get_output_folder_name_from_night_date
+
+
+def test_failed_night_doesnt_stop_other_nights(tmp_path):
+    night = generate_synthetic_night(tmp_path / "input", no_of_images=10, no_of_stars=40)
+    other_night_path = night["path"].parent / "September 05, 2019"
+    shutil.copytree(night["path"], other_night_path)
+    failing_masterflat = tmp_path / "masterflat.fit"
+    shutil.copy(night["masterflat"], failing_masterflat)
+    output = tmp_path / "output"
+    config = {
+        "image": {"rows": 1024, "columns": 1024},
+        "processing": {
+            "no_of_images_to_combine": 10,
+            "image_duration": night["image_duration"],
+            "radii_of_extraction": [4],
+            # Nights are processed in a pool of processes
+            "cpu_fraction": 1,
+            "xfwhm_target": 3.5,
+            "yfwhm_target": 3.5,
+        },
+        "reference": {"image": night["reference_image"], "file": night["reference_file"]},
+        "input": {
+            "nights": [
+                {"path": night["path"], "masterflat": failing_masterflat},
+                {"path": other_night_path, "masterflat": night["masterflat"]},
+            ]
+        },
+        "output": {"path": output},
+    }
+    load_configuration_with_necessary_reference_files(config)
+    config = create_processing_config(config)
+    # The first night fails as its masterflat can't be read
+    failing_masterflat.write_bytes(b"")
+
+    start_data_processing_auxiliary(config)
+    other_night_output = output / get_output_folder_name_from_night_date(date(2019, 9, 5))
+    assert len(list((other_night_output / LOG_FILES_COMBINED_FOLDER_NAME).glob("*.txt"))) == 1
@@ -0,0 +1,41 @@
+from m23.file.processing_manifest_file import ProcessingManifestFile
+
+
+def test_manifest_records_survive_crash(tmp_path):
+    manifest = ProcessingManifestFile(tmp_path / "manifest.jsonl")
+    manifest.create_file()
+    record = {"nth_combined_image": 0, "raw_images": ["m23_7.0-001.fit"]}
+    manifest.add_combination(ProcessingManifestFile.PRECOMA_PASS, record, {"alignment": "a"})
+    manifest.add_coma_models({"05-03": tmp_path / "05-03.psf"}, {"coma_models": "b"})
+    # Simulate a crash while writing a record
+    with manifest.path().open("a") as fd:
+        fd.write('{"type": "combination", "pass": "corr')
+
+    manifest = ProcessingManifestFile(tmp_path / "manifest.jsonl")
+    assert manifest.combination(ProcessingManifestFile.PRECOMA_PASS, 0)["raw_images"] == [
+        "m23_7.0-001.fit"
+    ]
+    assert manifest.combination(ProcessingManifestFile.PRECOMA_PASS, 1) is None
+    assert manifest.combinations(ProcessingManifestFile.CORRECTED_PASS) == []
+    assert manifest.coma_models({"coma_models": "b"}) == {"05-03": tmp_path / "05-03.psf"}
+    # Models made with a different configuration can't be used
+    assert manifest.coma_models({"coma_models": "c"}) is None
+
+
+
+def test_cleared_combinations(tmp_path):
+    manifest = ProcessingManifestFile(tmp_path / "manifest.jsonl")
+    manifest.create_file()
+    for pass_name in [ProcessingManifestFile.PRECOMA_PASS, ProcessingManifestFile.CORRECTED_PASS]:
+        manifest.add_combination(pass_name, {"nth_combined_image": 0}, {"alignment": "a"})
+    manifest.clear_combinations(ProcessingManifestFile.CORRECTED_PASS)
+    assert manifest.combinations(ProcessingManifestFile.CORRECTED_PASS) == []
+
+    manifest = ProcessingManifestFile(tmp_path / "manifest.jsonl")
+    assert manifest.combinations(ProcessingManifestFile.CORRECTED_PASS) == []
+    assert manifest.combination(ProcessingManifestFile.PRECOMA_PASS, 0) is not None
+    # Combinations recorded after clearing are kept
+    record = {"nth_combined_image": 1}
+    manifest.add_combination(ProcessingManifestFile.CORRECTED_PASS, record, {"alignment": "a"})
+    manifest = ProcessingManifestFile(tmp_path / "manifest.jsonl")
+    assert len(manifest.combinations(ProcessingManifestFile.CORRECTED_PASS)) == 1
@@ -0,0 +1,75 @@
+import numpy as np
+from astropy.io import fits
+
+from m23.file.raw_image_file import RawImageFile
+from m23.file.raw_image_prefetcher import RawImagePrefetcher
+
+
+def create_raw_images(folder, no_of_images):
+    raw_images = []
+    for i in range(no_of_images):
+        path = folder / f"m23_7.0-{i + 1:03}.fit"
+        fits.writeto(path, np.full((16, 16), i, dtype="int32"))
+        raw_images.append(RawImageFile(path))
+    return raw_images
+
+
+def is_read(raw_image: RawImageFile) -> bool:
+    return raw_image._RawImageFile__is_read
+
+
+def scheduled(prefetcher: RawImagePrefetcher) -> set:
+    return set(prefetcher._RawImagePrefetcher__futures)
+
+
+class TestRawImagePrefetcher:
+    def test_reads_ahead(self, tmp_path):
+        raw_images = create_raw_images(tmp_path, 8)
+        with RawImagePrefetcher(raw_images, 2, 2, 1024**3) as prefetcher:
+            prefetcher.wait(0)
+            # The current combination is guaranteed to be read
+            assert all(is_read(img) for img in raw_images[:2])
+            # Images beyond the depth aren't scheduled
+            assert not any(is_read(img) for img in raw_images[6:])
+            prefetcher.release(0)
+            assert not any(is_read(img) for img in raw_images[:2])
+            prefetcher.wait(1)
+            assert (raw_images[3].data() == 3).all()
+        assert not any(is_read(img) for img in raw_images)
+
+    def test_memory_budget(self, tmp_path):
+        raw_images = create_raw_images(tmp_path, 8)
+        size_of_one_combination = sum(img.path().stat().st_size for img in raw_images[:2])
+        with RawImagePrefetcher(raw_images, 2, 3, size_of_one_combination) as prefetcher:
+            prefetcher.wait(0)
+            prefetcher.wait(0)
+            # Only the current combination fits within the budget
+            assert not any(is_read(img) for img in raw_images[2:])
+
+    def test_resumed_night_with_gaps(self, tmp_path):
+        raw_images = create_raw_images(tmp_path, 12)
+        size_of_one_combination = sum(img.path().stat().st_size for img in raw_images[:2])
+        # Combinations 1, 2 and 4 were completed in the previous processing
+        nth_combined_images_to_process = [0, 3, 5]
+        resumed_images = raw_images[2:6] + raw_images[8:10]
+        with RawImagePrefetcher(
+            raw_images, 2, 2, 2 * size_of_one_combination, nth_combined_images_to_process
+        ) as prefetcher:
+            for nth_combined_image in nth_combined_images_to_process:
+                prefetcher.wait(nth_combined_image)
+                assert not any(is_read(img) for img in resumed_images)
+                if nth_combined_image == 0:
+                    # The next combination to process is read ahead, as the resumed
+                    # combinations don't take up the memory budget
+                    assert scheduled(prefetcher) == {0, 3}
+                prefetcher.release(nth_combined_image)
+            assert not any(is_read(img) for img in raw_images)
+
+    def test_disabled(self, tmp_path):
+        raw_images = create_raw_images(tmp_path, 4)
+        with RawImagePrefetcher(raw_images, 2, 0, 1024**3) as prefetcher:
+            prefetcher.wait(0)
+            assert not any(is_read(img) for img in raw_images)
+            raw_images[0].data()
+            prefetcher.release(0)
+            assert not is_read(raw_images[0])
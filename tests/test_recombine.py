@@ -0,0 +1,71 @@
+from m23.bench.synthetic import generate_synthetic_night
+from m23.constants import (
+    ALIGNMENT_TRANSFORMS_FILE_NAME,
+    CONFIG_FILE_NAME,
+    LOG_FILES_COMBINED_FOLDER_NAME,
+    PROCESSING_MANIFEST_FILE_NAME,
+)
+from m23.file.processing_manifest_file import ProcessingManifestFile
+from m23.processor.config_loader import (
+    create_processing_config,
+    load_configuration_with_necessary_reference_files,
+)
+from m23.processor.process_nights import start_data_processing_auxiliary
+
+
+def create_config(night, output, no_of_images_to_combine):
+    config = {
+        "image": {"rows": 1024, "columns": 1024},
+        "processing": {
+            "no_of_images_to_combine": no_of_images_to_combine,
+            "image_duration": night["image_duration"],
+            "radii_of_extraction": [4],
+            "cpu_fraction": 0,
+            "xfwhm_target": 3.5,
+            "yfwhm_target": 3.5,
+        },
+        "reference": {"image": night["reference_image"], "file": night["reference_file"]},
+        "input": {"nights": [{"path": night["path"], "masterflat": night["masterflat"]}]},
+        "output": {"path": output},
+    }
+    load_configuration_with_necessary_reference_files(config)
+    return create_processing_config(config)
+
+
+def test_resume_after_recombine(tmp_path):
+    night = generate_synthetic_night(tmp_path / "input", no_of_images=10, no_of_stars=40)
+    output = tmp_path / "output"
+    night_output = output / night["path"].name
+    log_file = night_output / LOG_FILES_COMBINED_FOLDER_NAME / "09-04-19_m23_7.0-001.txt"
+
+    start_data_processing_auxiliary(create_config(night, output, 10))
+    combined_of_10 = log_file.read_text()
+
+    start_data_processing_auxiliary(create_config(night, output, 5), recombine=True)
+    assert log_file.read_text() != combined_of_10
+
+    # Resuming with 10 images to combine doesn't mistake the combinations of 5
+    # images made by recombining for its own, so it combines 10 images again
+    start_data_processing_auxiliary(create_config(night, output, 10), resume=True)
+    assert log_file.read_text() == combined_of_10
+    manifest_file = ProcessingManifestFile(night_output / PROCESSING_MANIFEST_FILE_NAME)
+    corrected_combinations = manifest_file.combinations(ProcessingManifestFile.CORRECTED_PASS)
+    assert [len(record["raw_images"]) for record in corrected_combinations] == [10]
+
+
+def test_failed_recombine_keeps_previous_processing(tmp_path):
+    night = generate_synthetic_night(tmp_path / "input", no_of_images=10, no_of_stars=40)
+    output = tmp_path / "output"
+    night_output = output / night["path"].name
+    start_data_processing_auxiliary(create_config(night, output, 10))
+    files = [
+        night_output / CONFIG_FILE_NAME,
+        night_output / PROCESSING_MANIFEST_FILE_NAME,
+        night_output / LOG_FILES_COMBINED_FOLDER_NAME / "09-04-19_m23_7.0-001.txt",
+    ]
+    contents = [file.read_bytes() for file in files]
+
+    # The night can't be recombined without the transformations of its raw images
+    (night_output / ALIGNMENT_TRANSFORMS_FILE_NAME).unlink()
+    start_data_processing_auxiliary(create_config(night, output, 5), recombine=True)
+    assert [file.read_bytes() for file in files] == contents
@@ -0,0 +1,22 @@
+import datetime
+
+import dill
+from m23.processor import scheduler
+from m23.processor.scheduler import _scheduler_worker
+
+
+def test_scheduler_worker_skips_tasks_of_stopped_nights(tmp_path):
+    context_path = tmp_path / "context.pkl"
+    kwargs = {"night_date": datetime.date(2019, 9, 4)}
+    with context_path.open("wb") as fd:
+        dill.dump((kwargs, tmp_path / "log.txt"), fd)
+
+    # Invalid arguments to align_combined_extract are reported as traceback
+    nth, result, tb = _scheduler_worker((str(context_path), 3))
+    assert nth == 3 and result is None and "TypeError" in tb
+    assert scheduler._contexts[str(context_path)] == kwargs
+
+    context_path.unlink()
+    nth, result, tb = _scheduler_worker((str(context_path), 4))
+    assert nth == 4 and result is None and tb.startswith("Skipped")
+    assert str(context_path) not in scheduler._contexts
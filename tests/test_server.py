@@ -0,0 +1,47 @@
+import subprocess
+import sys
+import time
+
+import numpy as np
+from m23.file.reference_log_file import ReferenceLogFile
+from m23.processor.server import parse_server_address, submit_job
+
+
+def test_parse_server_address():
+    assert parse_server_address("/tmp/m23.sock") == "/tmp/m23.sock"
+    assert parse_server_address("localhost:8023") == ("localhost", 8023)
+    assert parse_server_address(":8023") == ("localhost", 8023)
+    assert parse_server_address("").endswith(".sock")
+
+
+def test_reference_files_are_parsed_once(tmp_path):
+    reference_file = tmp_path / "ref.txt"
+    reference_file.write_text("\n" * 9 + "1 2 3 4 5 6\n7 8 9 10 11 12\n")
+    data = ReferenceLogFile(reference_file).data()
+    assert ReferenceLogFile(reference_file).data() is data
+    assert not data.flags.writeable
+
+    # Files are parsed again when they change
+    reference_file.write_text("\n" * 9 + "1 2 3 4 5 6\n")
+    assert np.array_equal(ReferenceLogFile(reference_file).data(), [[1, 2, 3, 4, 5, 6]])
+
+
+def test_jobs_run_on_server(tmp_path, capsys):
+    address = tmp_path / "m23.sock"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "m23", "serve", "--address", str(address)],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        for _ in range(600):
+            if address.exists():
+                break
+            time.sleep(0.1)
+        config_file = tmp_path / "csv.toml"
+        config_file.write_text('input = []\noutput = "."\n')
+        # The config file doesn't have a radius
+        assert submit_job(str(address), "csv", config_file) == 1
+        assert "Improper radius value" in capsys.readouterr().out
+    finally:
+        server.terminate()
+        server.wait()
@@ -0,0 +1,72 @@
+from m23.processor.stages import (
+    ALIGNMENT_STAGE,
+    CALIBRATION_STAGE,
+    COMBINATION_STAGE,
+    EXTRACTION_STAGE,
+    MASTER_DARK_STAGE,
+    stage_fingerprints,
+)
+
+
+def create_config(**processing):
+    return {
+        "image": {"rows": 1024, "columns": 1024, "crop_region": []},
+        "processing": {
+            "no_of_images_to_combine": 10,
+            "radii_of_extraction": [3, 4, 5],
+            "image_duration": 7.0,
+            "xfwhm_target": 3.0,
+            "yfwhm_target": 3.0,
+            "cpu_fraction": 0,
+            **processing,
+        },
+        "reference": {"image": "ref.fit", "file": "ref.txt", "logfile": "a", "color": "b"},
+        "input": {"nights": []},
+        "output": {"path": "output", "save_aligned": False, "save_calibrated": False},
+    }
+
+
+def test_stage_fingerprints():
+    night = {"path": "night", "masterflat": "masterflat.fit"}
+    fingerprints = stage_fingerprints(create_config(), night)
+
+    # Options that don't affect output don't change any fingerprint
+    assert stage_fingerprints(create_config(cpu_fraction=0.5), night) == fingerprints
+
+    # Changing the radii of extraction only changes extraction onwards
+    changed = stage_fingerprints(create_config(radii_of_extraction=[4]), night)
+    assert changed[COMBINATION_STAGE] == fingerprints[COMBINATION_STAGE]
+    assert changed[EXTRACTION_STAGE] != fingerprints[EXTRACTION_STAGE]
+
+    # Changing the images to combine changes alignment and every stage after it
+    changed = stage_fingerprints(create_config(no_of_images_to_combine=5), night)
+    assert changed[MASTER_DARK_STAGE] == fingerprints[MASTER_DARK_STAGE]
+    assert changed[ALIGNMENT_STAGE] != fingerprints[ALIGNMENT_STAGE]
+    assert changed[COMBINATION_STAGE] != fingerprints[COMBINATION_STAGE]
+
+    # Options unknown to the stages invalidate everything
+    changed = stage_fingerprints(create_config(some_new_option=1), night)
+    assert all(changed[stage] != fingerprints[stage] for stage in fingerprints)
+
+
+def test_stage_fingerprints_of_replaced_files(tmp_path):
+    masterflat, ref_file = tmp_path / "masterflat.fit", tmp_path / "ref.txt"
+    masterflat.write_bytes(b"flat")
+    ref_file.write_text("stars")
+    config = create_config()
+    config["reference"]["file"] = ref_file
+    night = {"path": "night", "masterflat": masterflat}
+    fingerprints = stage_fingerprints(config, night)
+    assert stage_fingerprints(config, night) == fingerprints
+
+    # Replacing the reference file at the same path only changes extraction onwards
+    ref_file.write_text("other stars")
+    changed = stage_fingerprints(config, night)
+    assert changed[COMBINATION_STAGE] == fingerprints[COMBINATION_STAGE]
+    assert changed[EXTRACTION_STAGE] != fingerprints[EXTRACTION_STAGE]
+
+    # Replacing the masterflat changes calibration onwards
+    masterflat.write_bytes(b"other flat")
+    changed_again = stage_fingerprints(config, night)
+    assert changed_again[MASTER_DARK_STAGE] == fingerprints[MASTER_DARK_STAGE]
+    assert changed_again[CALIBRATION_STAGE] != changed[CALIBRATION_STAGE]
@@ -0,0 +1,61 @@
+import pickle
+import time
+
+from m23.file.timings_file import TimingsFile
+from m23.processor.timings import StageTimings
+
+
+def test_stage_timings():
+    timings = StageTimings()
+    with timings.time("calibration") as counts:
+        time.sleep(0.01)
+        counts["frames"] += 10
+        counts["bytes_read"] += 100
+    with timings.time("calibration") as counts:
+        counts["frames"] += 5
+    with timings.time("extraction") as counts:
+        counts["bytes_written"] += 50
+
+    stages = timings.stages()
+    assert list(stages) == ["calibration", "extraction"]
+    assert stages["calibration"]["frames"] == 15
+    assert stages["calibration"]["bytes_read"] == 100
+    assert stages["calibration"]["wall_time"] >= 0.01
+    assert stages["extraction"]["bytes_written"] == 50
+
+
+def test_stage_timings_are_recorded_on_exception():
+    timings = StageTimings()
+    try:
+        with timings.time("alignment") as counts:
+            counts["frames"] += 1
+            raise ValueError
+    except ValueError:
+        pass
+    assert timings.stages()["alignment"]["frames"] == 1
+
+
+def test_merge_timings_from_other_processes():
+    timings, combination_timings = StageTimings(), StageTimings()
+    with timings.time("master_dark") as counts:
+        counts["frames"] += 3
+    with combination_timings.time("alignment") as counts:
+        counts["frames"] += 10
+    # Timings are sent back from worker processes with the results
+    timings.merge(pickle.loads(pickle.dumps(combination_timings)))
+    timings.merge(combination_timings)
+    assert timings.stages()["master_dark"]["frames"] == 3
+    assert timings.stages()["alignment"]["frames"] == 20
+    summary = list(timings.summary(10, 20))
+    assert summary[-1] == "Processed 20 raw images in 10.0 s (2.00 frames/s)"
+
+
+def test_timings_file(tmp_path):
+    timings = StageTimings()
+    timings.add("alignment", {"wall_time": 4, "cpu_time": 3, "frames": 20})
+    timings_file = TimingsFile(tmp_path / "timings.json")
+    timings_file.create_file(timings.stages(), 10, 20)
+    data = timings_file.data()
+    assert data["frames_per_second"] == 2
+    assert data["stages"]["alignment"]["frames_per_second"] == 5
+    assert data["stages"]["alignment"]["bytes_read"] == 0
@@ -0,0 +1,77 @@
+from m23.bench.synthetic import generate_synthetic_night, synthetic_raw_images
+from m23.constants import (
+    FLUX_LOGS_COMBINED_FOLDER_NAME,
+    INPUT_CALIBRATION_FOLDER_NAME,
+    LOG_FILES_COMBINED_FOLDER_NAME,
+)
+from m23.processor.config_loader import (
+    create_processing_config,
+    load_configuration_with_necessary_reference_files,
+)
+from m23.processor.process_nights import start_data_processing_auxiliary
+from m23.processor.watch import LiveNight
+from m23.utils import (
+    get_darks,
+    get_date_from_input_night_folder_name,
+    get_output_folder_name_from_night_date,
+)
+
+
+def create_config(night, output):
+    config = {
+        "image": {"rows": 1024, "columns": 1024},
+        "processing": {
+            "no_of_images_to_combine": 5,
+            "image_duration": night["image_duration"],
+            "radii_of_extraction": [4],
+            "cpu_fraction": 0,
+            "xfwhm_target": 3.5,
+            "yfwhm_target": 3.5,
+        },
+        "reference": {"image": night["reference_image"], "file": night["reference_file"]},
+        "input": {"nights": [{"path": night["path"], "masterflat": night["masterflat"]}]},
+        "output": {"path": output},
+    }
+    load_configuration_with_necessary_reference_files(config)
+    return create_processing_config(config)
+
+
+def test_live_night_matches_process(tmp_path):
+    night = generate_synthetic_night(tmp_path / "input", no_of_images=12, no_of_stars=40)
+    # The first combination is skipped as one of its raw images is missing
+    raw_image_paths = synthetic_raw_images(night)
+    raw_image_paths.pop(2).unlink()
+    night_date = get_date_from_input_night_folder_name(night["path"].name)
+    night_folder_name = get_output_folder_name_from_night_date(night_date)
+
+    start_data_processing_auxiliary(create_config(night, tmp_path / "processed"))
+
+    config = create_config(night, tmp_path / "live")
+    output = tmp_path / "live" / night_folder_name
+    output.mkdir(parents=True)
+    live_night = LiveNight(config["input"]["nights"][0], config, output, night_date)
+    live_night.start()
+    dark_paths = sorted(
+        get_darks(night["path"] / INPUT_CALIBRATION_FOLDER_NAME, night["image_duration"])
+    )
+    # The raw images are written in two batches
+    for no_of_written in [6, 11]:
+        live_night.update(raw_image_paths[:no_of_written], dark_paths)
+        # Data of the raw images isn't kept once their combination is processed,
+        # even if it's skipped
+        assert all(
+            raw_image._RawImageFile__data is None for raw_image in live_night.raw_images()
+        )
+    live_night.finish(dark_paths)
+
+    assert len(list(output.joinpath(LOG_FILES_COMBINED_FOLDER_NAME).glob("*.txt"))) == 1
+    for folder in [LOG_FILES_COMBINED_FOLDER_NAME, FLUX_LOGS_COMBINED_FOLDER_NAME]:
+        processed_files = sorted((tmp_path / "processed" / night_folder_name / folder).rglob("*"))
+        live_files = sorted(output.joinpath(folder).rglob("*"))
+        assert [file.relative_to(output) for file in live_files] == [
+            file.relative_to(tmp_path / "processed" / night_folder_name)
+            for file in processed_files
+        ]
+        for processed_file, live_file in zip(processed_files, live_files):
+            if processed_file.is_file():
+                assert processed_file.read_bytes() == live_file.read_bytes()